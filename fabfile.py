@@ -192,21 +192,21 @@ def start_nginx():
 def start_all():
     sudo("supervisorctl start mixgene")
     sudo("supervisorctl start mixgene_notifier")
-    sudo("supervisorctl start celery")
+    sudo("supervisorctl start celery:*")
 
 
 def halt_all():
     sudo("supervisorctl stop mixgene")
     sudo("supervisorctl stop mixgene_notifier")
-    sudo("supervisorctl stop celery")
-    sudo("killall -9 celery")
+    sudo("supervisorctl stop celery:*")
+    sudo("pkill -9 -f mixgene.workers")
 
 def restart_all():
     halt_all()
     start_all()
 
 def run_status():
-    sudo("supervisorctl status mixgene mixgene_notifier celery")
+    sudo("supervisorctl status mixgene mixgene_notifier celery:*")
 
 
 def initial_install():
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+    Single pass reader of GEO series SOFT files (GSE family files).
+
+    Unlike `Bio.Geo.parse` records aren't kept in memory: platform table is
+     reduced to the requested columns and sample values are written
+     directly into preallocated float matrix, rows follow platform probes
+     order, columns follow samples order.
+"""
+import logging
+
+import numpy as np
+import pandas as pd
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+# Version of produced data, cached preprocessing results are keyed by it,
+#   see environment.dataset_cache. Increment when the output changes.
+PARSER_VERSION = 1
+
+# Used when series doesn't list its samples, matrix grows twice when exhausted
+DEFAULT_SAMPLES_CAPACITY = 16
+
+
+def split_key_value(line):
+    """
+        "^SAMPLE = GSM1" -> ("SAMPLE", "GSM1")
+
+        @rtype: (str, str)
+    """
+    key, _, value = line[1:].partition("=")
+    return key.strip(), value.strip()
+
+
+def add_attribute(attributes, key, value):
+    """
+        Repeated attributes are collected into list, as `Bio.Geo` does
+    """
+    if key in attributes:
+        existing = attributes[key]
+        if isinstance(existing, list):
+            existing.append(value)
+        else:
+            attributes[key] = [existing, value]
+    else:
+        attributes[key] = value
+
+
+def parse_value(value):
+    try:
+        return float(value)
+    except ValueError:
+        # "null", empty cells and so on
+        return np.nan
+
+
+class SoftPlatform(object):
+    def __init__(self, entity_id, columns):
+        """
+            @type  columns: list of str
+            @param columns: Platform table columns to be kept
+        """
+        self.entity_id = entity_id
+        self.attributes = {}
+        self.columns = columns
+        self.probes = []
+        # column name -> list of values in probes order
+        self.table = dict((column, []) for column in columns)
+
+    def get_column(self, name):
+        """
+            @rtype: list of str
+        """
+        return self.table[name]
+
+
+class GseSoftReader(object):
+    """
+        Usage:
+            reader = GseSoftReader().read(gzip.open(filepath))
+            assay_df = reader.get_assay_data_frame()
+    """
+    def __init__(self, platform_columns=("ID", "ENTREZ_GENE_ID"), dtype=np.float64):
+        """
+            @type  platform_columns: list of str
+            @param platform_columns: Platform table columns to be kept,
+                the first one should identify probes
+
+            @param dtype: Type of assay matrix
+        """
+        self.platform_columns = list(platform_columns)
+        self.dtype = dtype
+
+        self.series_attributes = {}
+        self.platform = None
+
+        self.sample_ids = []
+        # attributes of samples in the same order as `sample_ids`
+        self.sample_attributes = []
+
+        self.unknown_probes_count = 0
+
+        self._assay = None
+        self._probe_positions = None
+
+        # parsing state
+        self._entity_type = None
+        self._attributes = None
+        self._header = None
+        self._columns_idx = None
+        self._is_table = False
+
+    @property
+    def samples_count(self):
+        return len(self.sample_ids)
+
+    def read(self, lines):
+        """
+            @param lines: Iterable over SOFT file lines, e.g. opened file
+
+            @return: self
+        """
+        for line in lines:
+            line = line.rstrip("\r\n")
+            if not line:
+                continue
+            mark = line[0]
+            if mark == "^":
+                self._on_entity(*split_key_value(line))
+            elif mark == "!":
+                lowered = line.lower()
+                if lowered.endswith("_table_begin"):
+                    self._is_table = True
+                    self._header = None
+                elif lowered.endswith("_table_end"):
+                    self._is_table = False
+                else:
+                    key, value = split_key_value(line)
+                    add_attribute(self._attributes, key, value)
+            elif mark == "#":
+                # column descriptions aren't used
+                continue
+            elif self._is_table:
+                self._on_table_row(line.split("\t"))
+
+        if self._entity_type == "PLATFORM":
+            self._on_platform_end()
+        return self
+
+    def _on_entity(self, entity_type, entity_id):
+        if self._entity_type == "PLATFORM":
+            self._on_platform_end()
+
+        self._entity_type = entity_type
+        self._is_table = False
+        self._header = None
+
+        if entity_type == "SERIES":
+            self._attributes = self.series_attributes
+        elif entity_type == "PLATFORM":
+            if self.platform is not None:
+                raise RuntimeError("Series with several platforms aren't supported")
+            self.platform = SoftPlatform(entity_id, self.platform_columns)
+            self._attributes = self.platform.attributes
+        elif entity_type == "SAMPLE":
+            if self._probe_positions is None:
+                raise RuntimeError("Sample %s precedes platform description" % entity_id)
+            self._ensure_capacity(self.samples_count + 1)
+            self.sample_ids.append(entity_id)
+            self._attributes = {}
+            self.sample_attributes.append(self._attributes)
+        else:
+            # e.g. DATABASE
+            self._attributes = {}
+
+    def _on_platform_end(self):
+        self._probe_positions = dict(
+            (probe, pos) for pos, probe in enumerate(self.platform.probes)
+        )
+
+    def _on_table_row(self, row):
+        if self._header is None:
+            self._header = row
+            if self._entity_type == "PLATFORM":
+                self._columns_idx = [self._get_column_idx(column)
+                                     for column in self.platform_columns]
+            elif self._entity_type == "SAMPLE":
+                self._columns_idx = [self._get_column_idx("ID_REF"),
+                                     self._get_column_idx("VALUE")]
+            return
+
+        if self._entity_type == "SAMPLE":
+            id_ref_idx, value_idx = self._columns_idx
+            pos = self._probe_positions.get(row[id_ref_idx])
+            if pos is None:
+                self.unknown_probes_count += 1
+            elif value_idx < len(row):
+                self._assay[pos, self.samples_count - 1] = parse_value(row[value_idx])
+        elif self._entity_type == "PLATFORM":
+            table = self.platform.table
+            for column, idx in zip(self.platform_columns, self._columns_idx):
+                table[column].append(row[idx] if idx < len(row) else "")
+            self.platform.probes.append(row[self._columns_idx[0]])
+
+    def _get_column_idx(self, column):
+        try:
+            return self._header.index(column)
+        except ValueError:
+            raise RuntimeError("Column %s is absent in %s table" % (column, self._entity_type))
+
+    def _ensure_capacity(self, samples_count):
+        if self._assay is not None and self._assay.shape[1] >= samples_count:
+            return
+
+        if self._assay is None:
+            expected = self.series_attributes.get("Series_sample_id", [])
+            if not isinstance(expected, list):
+                expected = [expected]
+            capacity = max(len(expected) or DEFAULT_SAMPLES_CAPACITY, samples_count)
+        else:
+            log.debug("Series has more samples than declared, growing assay matrix")
+            capacity = max(2 * self._assay.shape[1], samples_count)
+
+        assay = np.empty((len(self.platform.probes), capacity), dtype=self.dtype)
+        assay.fill(np.nan)
+        if self._assay is not None:
+            assay[:, :self._assay.shape[1]] = self._assay
+        self._assay = assay
+
+    def get_assay_array(self):
+        """
+            @rtype: np.ndarray
+            @return: Matrix probes x samples
+        """
+        if self._assay is None:
+            return np.empty((len(self.platform.probes) if self.platform else 0, 0),
+                            dtype=self.dtype)
+        if self._assay.shape[1] != self.samples_count:
+            # drop spare columns, so the matrix stays contiguous
+            self._assay = np.ascontiguousarray(self._assay[:, :self.samples_count])
+        return self._assay
+
+    def get_assay_data_frame(self):
+        """
+            @rtype: pd.DataFrame
+            @return: Probes as index, samples as columns, matrix isn't copied
+        """
+        return pd.DataFrame(
+            self.get_assay_array(),
+            index=self.platform.probes,
+            columns=self.sample_ids,
+        )
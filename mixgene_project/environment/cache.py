@@ -0,0 +1,252 @@
+"""
+    Process wide cache of objects loaded from files.
+
+    Celery workers read the same data frames and gene sets many times
+     (every fold, every classifier, every visualisation refresh), so parsed
+     objects are kept in memory. Entries are keyed by file path together
+     with inode, mtime and size, so a rewritten file is never served stale.
+
+    Cached arrays and data frames are shared between callers. They are made
+     read only when cached, so accidental modification raises instead
+     of corrupting other readers; callers which modify the result should
+     ask for a copy. Other objects (gene sets, unpickled results) can't be
+     protected this way, every caller receives its own copy of them.
+"""
+from collections import OrderedDict
+from copy import deepcopy
+import cPickle as pickle
+import logging
+import numbers
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+def get_max_bytes_setting():
+    """
+        @rtype: int
+        @return: Memory budget from `DATA_CACHE_MAX_BYTES` setting
+    """
+    try:
+        from django.conf import settings
+        return int(getattr(settings, "DATA_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES))
+    except Exception:
+        # settings aren't configured, e.g. standalone scripts
+        return DEFAULT_MAX_BYTES
+
+
+def estimate_size(obj):
+    """
+        Rough estimate of memory occupied by the loaded object.
+
+        @rtype: int
+    """
+    if isinstance(obj, pd.DataFrame):
+        row_width = sum(64 if dtype == object else dtype.itemsize
+                        for dtype in obj.dtypes)
+        return 64 * (len(obj.index) + len(obj.columns)) + row_width * len(obj.index)
+    if isinstance(obj, pd.Series):
+        return 64 * len(obj.index) + obj.values.nbytes
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, dict):
+        return sum(estimate_size(k) + estimate_size(v) for k, v in obj.iteritems())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return 64 + sum(estimate_size(x) for x in obj)
+    if isinstance(obj, basestring):
+        return 40 + len(obj)
+    if hasattr(obj, "__dict__"):
+        return estimate_size(obj.__dict__)
+    return 64
+
+
+def freeze(obj):
+    """
+        Marks arrays of the object as read only
+
+        @rtype: bool
+        @return: True when object can't be modified anymore and can be shared
+    """
+    if isinstance(obj, np.ndarray):
+        obj.flags.writeable = False
+    elif isinstance(obj, pd.Series):
+        obj.values.flags.writeable = False
+    elif isinstance(obj, pd.DataFrame):
+        # `values` of a frame with several dtypes is a new array,
+        #   so flags are set on the blocks data is kept in
+        for block in obj._data.blocks:
+            block.values.flags.writeable = False
+    elif isinstance(obj, (tuple, frozenset)):
+        return all(freeze(x) for x in obj)
+    elif not (obj is None or isinstance(obj, (basestring, numbers.Number, np.generic))):
+        return False
+    return True
+
+
+def copy_object(obj):
+    if isinstance(obj, (pd.DataFrame, pd.Series, np.ndarray)):
+        return obj.copy()
+    try:
+        # much faster than deepcopy for large nested structures
+        return pickle.loads(pickle.dumps(obj, pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return deepcopy(obj)
+
+
+class DataCache(object):
+    def __init__(self, max_bytes=None):
+        """
+            @type  max_bytes: int or None
+            @param max_bytes: Memory budget, when None value is taken from settings
+        """
+        self._max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (obj, size, is_frozen)
+        self.total_size = 0
+        self.lock = threading.RLock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def max_bytes(self):
+        if self._max_bytes is None:
+            self._max_bytes = get_max_bytes_setting()
+        return self._max_bytes
+
+    @staticmethod
+    def build_key(filepaths, key_extra=None):
+        """
+            @rtype: tuple or None
+            @return: None when some file is absent
+        """
+        key = []
+        for filepath in filepaths:
+            try:
+                stat = os.stat(filepath)
+            except OSError:
+                return None
+            key.append((os.path.abspath(filepath), stat.st_ino, stat.st_mtime, stat.st_size))
+        return tuple(key), key_extra
+
+    def load(self, filepaths, loader, key_extra=None, copy=False, size=None):
+        """
+            @type  filepaths: list of str
+            @param filepaths: Files the object is built from
+
+            @type  loader: callable
+            @param loader: Function without arguments which reads the object
+
+            @param key_extra: Hashable value distinguishing different
+                objects built from the same files
+
+            @type  copy: bool
+            @param copy: When False the shared object is returned, its
+                arrays are read only and caller must not modify it.
+                Objects which can't be made read only are always copied.
+
+            @type  size: int or None
+            @param size: Known object size, otherwise it's estimated
+
+            @return: Loaded object
+        """
+        key = self.build_key(filepaths, key_extra)
+        if key is None or self.max_bytes <= 0:
+            return loader()
+
+        with self.lock:
+            if key in self.entries:
+                entry = self.entries.pop(key)
+                self.entries[key] = entry
+                self.hits += 1
+                obj, _, is_frozen = entry
+                return copy_object(obj) if copy or not is_frozen else obj
+            self.misses += 1
+
+        obj = loader()
+        is_frozen = self.put(key, obj, size)
+        return copy_object(obj) if copy or not is_frozen else obj
+
+    def get(self, filepaths, key_extra=None):
+        """
+            @return: Cached object or None, stats aren't affected. Shared
+                object is returned only when it's read only.
+        """
+        key = self.build_key(filepaths, key_extra)
+        with self.lock:
+            if key not in self.entries:
+                return None
+            entry = self.entries.pop(key)
+            self.entries[key] = entry
+        obj, _, is_frozen = entry
+        return obj if is_frozen else copy_object(obj)
+
+    def put(self, key, obj, size=None):
+        """
+            @rtype: bool
+            @return: False when cached object can't be made read only,
+                so it should be copied before it's given out
+        """
+        if size is None:
+            size = estimate_size(obj)
+        if size > self.max_bytes:
+            log.debug("Object for %s is too big to be cached: %s", key, size)
+            # isn't shared with anyone
+            return True
+
+        is_frozen = freeze(obj)
+        with self.lock:
+            if key in self.entries:
+                self.total_size -= self.entries.pop(key)[1]
+            self.entries[key] = (obj, size, is_frozen)
+            self.total_size += size
+
+            while self.total_size > self.max_bytes:
+                _, (_, evicted_size, _) = self.entries.popitem(last=False)
+                self.total_size -= evicted_size
+                self.evictions += 1
+        return is_frozen
+
+    def invalidate(self, filepath):
+        """
+            Drops all entries built from the given file
+        """
+        abs_path = os.path.abspath(filepath)
+        with self.lock:
+            for key in self.entries.keys():
+                stats, _ = key
+                if any(entry[0] == abs_path for entry in stats):
+                    self.total_size -= self.entries.pop(key)[1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_size = 0
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self):
+        """
+            @rtype: dict
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "size": self.total_size,
+            "max_bytes": self.max_bytes,
+        }
+
+
+data_cache = DataCache()
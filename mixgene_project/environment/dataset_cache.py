@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+    Cache of preprocessed GEO series shared between experiments.
+
+    For each series and parser version a directory is kept:
+        <MEDIA_ROOT>/data/cache/datasets/<GSE>_v<version>/
+            manifest.json
+            es_assay.values.npy
+            es_assay.labels.pkl.gz
+            es_pheno.csv.gz
+            annotation_platform_gene_sets.gmt.gz
+
+    Files are copied into the cache and made read only. Assay matrix and
+     platform gene sets are hard linked into experiment folders, storages
+     replace these files by rename instead of writing into them, so the
+     cached copy is never modified. Phenotype table is copied since users
+     assign sample classes in it. Directory is filled aside and renamed
+     when complete, so readers never see partial entries.
+"""
+import datetime
+import errno
+import json
+import logging
+import os
+import shutil
+import uuid
+
+from mixgene.util import link_or_copy
+from environment.structures import ExpressionSet, PlatformAnnotation, \
+    BinaryDataFrameStorage, DataFrameStorage, GmtStorage
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+MANIFEST_FILENAME = "manifest.json"
+
+# cache file name -> is shared between experiments read only
+DATASET_FILES = {
+    "es_assay.values.npy": True,
+    "es_assay.labels.pkl.gz": True,
+    "es_pheno.csv.gz": False,
+    "annotation_platform_gene_sets.gmt.gz": True,
+}
+
+
+def get_datasets_cache_root():
+    from django.conf import settings
+    return getattr(settings, "DATASETS_CACHE_DIR",
+                   os.path.join(settings.MEDIA_ROOT, "data", "cache", "datasets"))
+
+
+def make_read_only(filepath):
+    os.chmod(filepath, 0444)
+
+
+class GseDatasetCache(object):
+    def __init__(self, geo_uid, version, root=None):
+        """
+            @type  geo_uid: str
+            @param geo_uid: Series id, e.g. GSE1234
+
+            @type  version: int
+            @param version: Parser version, see converters.geo_soft.PARSER_VERSION
+
+            @type  root: str or None
+            @param root: Cache directory, by default is taken from settings
+        """
+        self.geo_uid = geo_uid.upper()
+        self.version = version
+        self.root = root or get_datasets_cache_root()
+
+    @property
+    def path(self):
+        return os.path.join(self.root, "%s_v%s" % (self.geo_uid, self.version))
+
+    def get_file_path(self, name):
+        return os.path.join(self.path, name)
+
+    def load_manifest(self):
+        """
+            @rtype: dict or None
+            @return: None when entry is absent or broken
+        """
+        try:
+            with open(self.get_file_path(MANIFEST_FILENAME)) as inp:
+                manifest = json.load(inp)
+        except (IOError, ValueError):
+            return None
+
+        for name, size in manifest["files"].iteritems():
+            try:
+                if os.path.getsize(self.get_file_path(name)) != size:
+                    return None
+            except OSError:
+                return None
+        return manifest
+
+    def is_ready(self):
+        return self.load_manifest() is not None
+
+    def store(self, es, ann):
+        """
+            Puts copies of preprocessing results into the cache
+
+            @type es: ExpressionSet
+            @type ann: PlatformAnnotation
+
+            @rtype: bool
+            @return: False when structures can't be cached
+        """
+        if not isinstance(es.assay_data_storage, BinaryDataFrameStorage) or \
+                not es.assay_data_storage.is_binary_stored():
+            log.debug("Only binary stored assay could be cached, %s is skipped", self.geo_uid)
+            return False
+        if self.is_ready():
+            return True
+
+        sources = {
+            "es_assay.values.npy": es.assay_data_storage.values_filepath,
+            "es_assay.labels.pkl.gz": es.assay_data_storage.labels_filepath,
+            "es_pheno.csv.gz": es.pheno_data_storage.filepath,
+            "annotation_platform_gene_sets.gmt.gz": ann.gene_sets.storage.filepath,
+        }
+
+        if not os.path.exists(self.root):
+            try:
+                os.makedirs(self.root)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+        tmp_path = os.path.join(self.root, ".%s_v%s.%s" % (self.geo_uid, self.version, uuid.uuid4().hex))
+        os.mkdir(tmp_path)
+        try:
+            files = {}
+            for name, src in sources.iteritems():
+                dst = os.path.join(tmp_path, name)
+                # experiment could rewrite own files, so they aren't linked
+                shutil.copyfile(src, dst)
+                if DATASET_FILES[name]:
+                    make_read_only(dst)
+                files[name] = os.path.getsize(dst)
+
+            manifest = {
+                "geo_uid": self.geo_uid,
+                "version": self.version,
+                "dt_created": datetime.datetime.utcnow().isoformat(),
+                "files": files,
+                "assay_metadata": es.assay_metadata,
+                "pheno_metadata": es.pheno_metadata,
+                "platform_name": ann.name,
+                "gene_sets_metadata": ann.gene_sets.metadata,
+            }
+            with open(os.path.join(tmp_path, MANIFEST_FILENAME), "w") as out:
+                json.dump(manifest, out)
+
+            os.rename(tmp_path, self.path)
+        except OSError, e:
+            # entry was created concurrently
+            if e.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                raise
+        finally:
+            if os.path.exists(tmp_path):
+                shutil.rmtree(tmp_path, ignore_errors=True)
+
+        log.debug("Stored preprocessed %s to cache", self.geo_uid)
+        return True
+
+    def link(self, base_dir, base_filename):
+        """
+            Builds structures of experiment backed by cached files
+
+            @type  base_dir: str
+            @param base_dir: Experiment data folder
+
+            @type  base_filename: str
+            @param base_filename: Prefix for the linked files, usually block uuid
+
+            @rtype: (ExpressionSet, PlatformAnnotation) or None
+            @return: None on cache miss
+        """
+        manifest = self.load_manifest()
+        if manifest is None:
+            return None
+
+        es = ExpressionSet(base_dir, "%s_es" % base_filename)
+        es.assay_metadata = manifest["assay_metadata"]
+        es.pheno_metadata = manifest["pheno_metadata"]
+        es.assay_data_storage = BinaryDataFrameStorage(
+            "%s/%s_assay" % (es.base_dir, es.base_filename))
+        es.pheno_data_storage = DataFrameStorage(
+            "%s/%s_pheno.csv.gz" % (es.base_dir, es.base_filename))
+
+        ann = PlatformAnnotation(manifest["platform_name"], base_dir,
+                                 "%s_annotation" % base_filename)
+        ann.gene_sets.metadata = manifest["gene_sets_metadata"]
+        ann.gene_sets.storage = GmtStorage(
+            filepath="%s/%s_gene_sets.gmt.gz" % (ann.gene_sets.base_dir, ann.gene_sets.base_filename),
+            compression="gzip"
+        )
+
+        link_or_copy(self.get_file_path("es_assay.values.npy"), es.assay_data_storage.values_filepath)
+        link_or_copy(self.get_file_path("es_assay.labels.pkl.gz"), es.assay_data_storage.labels_filepath)
+        shutil.copyfile(self.get_file_path("es_pheno.csv.gz"), es.pheno_data_storage.filepath)
+        link_or_copy(self.get_file_path("annotation_platform_gene_sets.gmt.gz"),
+                     ann.gene_sets.storage.filepath)
+
+        log.debug("Linked preprocessed %s from cache", self.geo_uid)
+        return es, ann
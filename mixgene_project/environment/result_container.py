@@ -4,18 +4,19 @@ import copy
 # from webapp.models import Experiment
 from collections import defaultdict
 import cPickle as pickle
-import functools
 import gzip
 import logging
+import os
 
 from itertools import product
+from uuid import uuid1
 #from functools import reduce
 
 import numpy as np
 import pandas as pd
 
 from environment.structures import GenericStoreStructure, ClassifierResult
-from wrappers.scoring import compute_score_by_metric_name
+from wrappers.scoring import PackedLabels, compute_packed_scores, metrics, metrics_dict
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
@@ -34,8 +35,71 @@ def get_metric_vectorized(metric):
     return np.vectorize(func, otypes=[np.float])
 
 
+def take_segments(offsets, cell_idx):
+    """
+        Positions of elements in flat array for the selected cells
+
+        @type  offsets: np.ndarray
+        @param offsets: Cell boundaries in flat array, length cells_num + 1
+
+        @type  cell_idx: np.ndarray
+        @param cell_idx: Cells to take in the desired order
+
+        @return: (positions, new offsets)
+        @rtype: (np.ndarray, np.ndarray)
+    """
+    cell_idx = np.asarray(cell_idx, dtype=np.int64).ravel()
+    lengths = (offsets[1:] - offsets[:-1])[cell_idx]
+    new_offsets = np.zeros(len(cell_idx) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=new_offsets[1:])
+
+    positions = np.repeat(offsets[cell_idx] - new_offsets[:-1], lengths) + \
+        np.arange(new_offsets[-1], dtype=np.int64)
+    return positions, new_offsets
+
+
+def pack_object_array(ar):
+    """
+        Converts object array of ClassifierResult into flat prediction vectors.
+        Empty cells are kept as zero length segments.
+
+        @type ar: np.ndarray
+
+        @return: (y_true, y_predicted, offsets)
+    """
+    pairs = [
+        (cr.y_true, cr.y_predicted) if cr is not None else None
+        for cr in ar.flat
+    ]
+    packed = PackedLabels.from_pairs(pairs)
+    y_true, y_predicted = packed.y_true, packed.y_predicted
+    if y_true.dtype.kind in "biuf":
+        y_true = y_true.astype(np.int64)
+    if y_predicted.dtype.kind in "biuf":
+        y_predicted = y_predicted.astype(np.int64)
+    return y_true, y_predicted, packed.offsets
+
+
 class ResultsContainer(GenericStoreStructure):
+    # Defaults for containers pickled before packed layout was introduced
+    shape = ()
+    y_true = None
+    y_predicted = None
+    offsets = None
+    version = None
+    score_cache = None
+
     def __init__(self, *args, **kwargs):
+        """
+            Prediction vectors for all combinations of axis labels.
+
+            Data is stored packed: prediction vectors of all cells, in C order
+             of `shape`, are concatenated into `y_true`, `y_predicted` with cell
+             boundaries in `offsets`. Dense score arrays are kept for each metric.
+
+            `ar` object array of ClassifierResult is used only to build
+             a container, it's packed at `store()`.
+        """
         super(ResultsContainer, self).__init__(*args, **kwargs)
         self.filepath = self.form_filepath("_res_cont")
 
@@ -44,6 +108,31 @@ class ResultsContainer(GenericStoreStructure):
         self.labels_dict = {}  # axis -> [label for 0, label for 1] and so on
         self.inverse_labels_dict = defaultdict(dict) # axis -> { label -> idx of element in axis }
 
+        self.shape = ()
+        self.y_true = None
+        self.y_predicted = None
+        self.offsets = None
+        self.scores = {}  # metric name -> np.array of `shape`
+
+        # Changed on every store, invalidates scores cache
+        self.version = None
+        # (frozenset of preserved axis, metric name) -> (axis order, score array)
+        self.score_cache = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["score_cache"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # absent in containers pickled before packed layout
+        self.__dict__.setdefault("scores", {})
+
+    @property
+    def scores_filepath(self):
+        return self.form_filepath("_res_cont_scores")
+
     def init_ar(self):
         shape = tuple(map(len, [
             self.labels_dict[axis]
@@ -51,6 +140,9 @@ class ResultsContainer(GenericStoreStructure):
         ]))
         # noinspection PyNoneFunctionAssignment
         self.ar = np.empty(shape=shape, dtype=object)
+        self.shape = shape
+        self.y_true = self.y_predicted = self.offsets = None
+        self.scores = {}
 
     def get_axis_dim(self, axis):
         """
@@ -59,15 +151,116 @@ class ResultsContainer(GenericStoreStructure):
         """
         return self.axis_list.index(axis)
 
+    @property
+    def cells_num(self):
+        return int(np.prod(self.shape))
+
+    def pack(self):
+        """
+            Moves data from the builder `ar` into packed arrays,
+             or reads them from the file if container was unloaded
+        """
+        if self.ar is not None and self.ar.ndim > 0:
+            self.shape = self.ar.shape
+            self.y_true, self.y_predicted, self.offsets = pack_object_array(self.ar)
+            self.scores = {}
+            self.ar = None
+        elif self.offsets is None and os.path.exists(self.filepath):
+            self.load()
+
+        if self.offsets is None:
+            self.y_true = np.array([], dtype=np.int64)
+            self.y_predicted = np.array([], dtype=np.int64)
+            self.offsets = np.zeros(self.cells_num + 1, dtype=np.int64)
+
+    def get_packed_labels(self):
+        """
+            @rtype: PackedLabels
+        """
+        self.pack()
+        return PackedLabels(self.y_true, self.y_predicted, self.offsets)
+
+    def get_score_cube(self, metric_name):
+        """
+            @return: Score for each cell, NaN for cells we failed to score
+            @rtype: np.ndarray
+        """
+        if metric_name not in self.scores:
+            self.scores[metric_name] = compute_packed_scores(
+                self.get_packed_labels(), metrics_dict[metric_name]
+            ).reshape(self.shape)
+        return self.scores[metric_name]
+
     def store(self):
+        self.pack()
+        packed = self.get_packed_labels()
+        for metric in metrics:
+            if metric.produce_single_number and metric.name not in self.scores:
+                self.scores[metric.name] = compute_packed_scores(
+                    packed, metric).reshape(self.shape)
+
+        self.version = uuid1().hex
+        self.score_cache = None
         with gzip.open(self.filepath, "w") as file_obj:
             out = {
-                "ar": self.ar.tolist(),
+                "version": self.version,
+                "shape": self.shape,
+                "y_true": self.y_true,
+                "y_predicted": self.y_predicted,
+                "offsets": self.offsets,
+                "scores": self.scores,
                 "axis_list": self.axis_list,
                 "labels_dict": self.labels_dict
             }
             pickle.dump(out, file_obj, protocol=pickle.HIGHEST_PROTOCOL)
 
+        if os.path.exists(self.scores_filepath):
+            os.remove(self.scores_filepath)
+
+    def load_score_cache(self):
+        """
+            @return: Cached scores for the current version of container
+            @rtype: dict
+        """
+        if self.score_cache is None:
+            self.score_cache = {}
+            if self.version is None:
+                # container wasn't stored or stored before versioning
+                return self.score_cache
+            try:
+                if os.path.exists(self.scores_filepath):
+                    with gzip.open(self.scores_filepath) as file_obj:
+                        data = pickle.load(file_obj)
+                    if data["version"] == self.version:
+                        self.score_cache = data["entries"]
+            except Exception, e:
+                log.warning("Failed to read scores cache %s: %s", self.scores_filepath, e)
+        return self.score_cache
+
+    def store_score_cache(self):
+        if self.version is None:
+            return
+        tmp_filepath = "%s.%s.tmp" % (self.scores_filepath, uuid1().hex)
+        try:
+            with gzip.open(tmp_filepath, "w") as file_obj:
+                pickle.dump({
+                    "version": self.version,
+                    "entries": self.score_cache,
+                }, file_obj, protocol=pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_filepath, self.scores_filepath)
+        except Exception, e:
+            log.warning("Failed to write scores cache %s: %s", self.scores_filepath, e)
+
+    def unload(self):
+        """
+            Drops data from memory, e.g. before container is saved into block
+        """
+        self.ar = None
+        self.y_true = None
+        self.y_predicted = None
+        self.offsets = None
+        self.scores = {}
+
     def empty_clone(self, base_filename):
         new_rc = ResultsContainer(self.base_dir, base_filename)
 
@@ -80,8 +273,14 @@ class ResultsContainer(GenericStoreStructure):
     def clone(self, base_filename):
         new_rc = self.empty_clone(base_filename)
         self.load()
-        new_rc.ar = copy.deepcopy(self.ar)
+        new_rc.ar = None
+        new_rc.shape = self.shape
+        new_rc.y_true = self.y_true.copy()
+        new_rc.y_predicted = self.y_predicted.copy()
+        new_rc.offsets = self.offsets.copy()
+        new_rc.scores = copy.deepcopy(self.scores)
         new_rc.store()
+        new_rc.unload()
         return new_rc
 
     def load(self):
@@ -91,14 +290,36 @@ class ResultsContainer(GenericStoreStructure):
                 data = pickle.loads(pickled)
                 self.axis_list = data["axis_list"]
                 self.labels_dict = data["labels_dict"]
+                self.version = data.get("version")
 
-                self.ar = np.array(data["ar"])
+                if "ar" in data:
+                    self.load_legacy(data)
+                else:
+                    self.shape = tuple(data["shape"])
+                    self.y_true = data["y_true"]
+                    self.y_predicted = data["y_predicted"]
+                    self.offsets = data["offsets"]
+                    self.scores = data["scores"]
+                self.ar = None
                 self.update_label_index()
 
         except Exception, e:
             log.exception(e)
             raise Exception("Failed to load result container from path: `%s`:", self.filepath)
 
+    def load_legacy(self, data):
+        """
+            Converts container stored as nested list of ClassifierResult
+        """
+        ar = np.empty(shape=tuple(map(len, [
+            data["labels_dict"][axis] for axis in data["axis_list"]
+        ])), dtype=object)
+        ar[...] = np.array(data["ar"], dtype=object).reshape(ar.shape)
+
+        self.shape = ar.shape
+        self.y_true, self.y_predicted, self.offsets = pack_object_array(ar)
+        self.scores = {}
+
     def update_label_index(self):
         self.inverse_labels_dict = defaultdict(dict)
         for axis, labels_list in self.labels_dict.iteritems():
@@ -109,13 +330,10 @@ class ResultsContainer(GenericStoreStructure):
     def get_flat_list_by_metric(self, metric):
         """
             Flatten container and access specified metric.
-            We expecting only ClassifierResult object, other instances would be ignored
+            Cells which we failed to score are ignored
         """
-        return [
-            cr.scores[metric]
-            for cr in self.ar.flatten()
-            if metric in cr.scores
-        ]
+        cube = self.get_score_cube(metric)
+        return cube[~np.isnan(cube)].tolist()
 
     def dim_num(self, axis_name):
         return self.axis_list.index(axis_name)
@@ -139,11 +357,75 @@ class ResultsContainer(GenericStoreStructure):
                 mask_list.append(slice(0, len(self.labels_dict[axis])))
         return tuple(mask_list)
 
-    def filter_by_spec(self, spec_dict):
-        new_rc = self.empty_clone()
-        new_rc.ar = self.ar[self.build_axis_mask(spec_dict)]
+    def cell_index(self):
+        """
+            @return: Flat cell numbers arranged in `shape`
+            @rtype: np.ndarray
+        """
+        self.pack()
+        return np.arange(self.cells_num, dtype=np.int64).reshape(self.shape)
+
+    def take_cells(self, cell_idx):
+        """
+            @return: Prediction vectors of selected cells in the given order
+            @rtype: PackedLabels
+        """
+        self.pack()
+        positions, offsets = take_segments(self.offsets, cell_idx)
+        return PackedLabels(self.y_true[positions], self.y_predicted[positions], offsets)
+
+    def filter_by_spec(self, spec_dict, base_filename=None):
+        if base_filename is None:
+            base_filename = "%s_filtered" % self.base_filename
+        new_rc = ResultsContainer(self.base_dir, base_filename)
+        new_rc.axis_list = list(self.axis_list)
+
+        selectors = []
+        for axis in self.axis_list:
+            labels = self.labels_dict[axis]
+            if axis in spec_dict:
+                key = spec_dict[axis]
+                if isinstance(key, basestring):
+                    key = [key]
+                idx = [self.inverse_labels_dict[axis][key_i] for key_i in key]
+            else:
+                idx = range(len(labels))
+            new_rc.labels_dict[axis] = [labels[i] for i in idx]
+            selectors.append(idx)
+        new_rc.update_label_index()
+
+        cell_idx = self.cell_index()[np.ix_(*selectors)]
+        packed = self.take_cells(cell_idx)
+        new_rc.ar = None
+        new_rc.shape = cell_idx.shape
+        new_rc.y_true = packed.y_true
+        new_rc.y_predicted = packed.y_predicted
+        new_rc.offsets = packed.offsets
         return new_rc
 
+    def aggregate_packed(self, axis_list_to_preserve):
+        """
+            Joins prediction vectors along axis not present in `axis_list_to_preserve`
+
+            @return: (packed labels, shape), cells follow C order of the shape
+                defined by `axis_list_to_preserve`
+            @rtype: (PackedLabels, tuple)
+        """
+        self.pack()
+        axis_list_to_preserve = list(axis_list_to_preserve)
+        preserved_dims = [self.get_axis_dim(axis) for axis in axis_list_to_preserve]
+        other_dims = [dim for dim in range(len(self.axis_list))
+                      if dim not in preserved_dims]
+        new_shape = tuple(self.shape[dim] for dim in preserved_dims)
+
+        group_size = int(np.prod([self.shape[dim] for dim in other_dims]))
+        cell_idx = self.cell_index().transpose(preserved_dims + other_dims)
+        packed = self.take_cells(cell_idx)
+        # consecutive cells of each group merge into one
+        offsets = packed.offsets[::group_size] if group_size \
+            else np.zeros(int(np.prod(new_shape)) + 1, dtype=np.int64)
+        return PackedLabels(packed.y_true, packed.y_predicted, offsets), new_shape
+
     def aggregate_prediction_vectors(self, axis_list_to_preserve):
         """
             Produce new np.array be merging `y_true`, `y_predicted` fields of ClassifierResult objects
@@ -154,42 +436,14 @@ class ResultsContainer(GenericStoreStructure):
                 each element [ClassifierResult] would have joined y_true and y_predicted vectors
             @rtype: np.array
         """
-
-        if len(axis_list_to_preserve) == len(self.axis_list):
-            return np.transpose(self.ar, [
-                self.axis_list.index(axis)
-                for axis in axis_list_to_preserve
-            ])
-
-        new_shape = tuple([
-            len(self.labels_dict[axis_name])
-            for axis_name in axis_list_to_preserve
-        ])
+        packed, new_shape = self.aggregate_packed(axis_list_to_preserve)
         result = np.empty(shape=new_shape, dtype=object)
-        index_labels = [self.labels_dict[axis] for axis in axis_list_to_preserve]
-
-        for row_def in product(*index_labels):
-            # log.debug("processing row: %s", row_def)
-            spec_def = {axis: val for val, axis in zip(row_def, axis_list_to_preserve)}
-            key = np.array(self.build_axis_mask(spec_def))
-            key_for_result = tuple([
-                self.inverse_labels_dict[axis_name][label]
-                for label, axis_name
-                in zip(row_def, axis_list_to_preserve)
-            ])
-            sliced = self.ar[tuple(key)]
-            if hasattr(sliced, 'flatten'):
-                flatten = sliced.flatten()
-                new_cr = ClassifierResult("", "")
-                new_cr.classifier = "aggregated_result"
-                for cr in flatten:
-                    # new_cr.labels_encode_vector.extend(cr.labels_encode_vector)
-                    new_cr.y_true.extend(cr.y_true)
-                    new_cr.y_predicted.extend(cr.y_predicted)
-
-                # import  ipdb; ipdb.set_trace()
-                result[key_for_result] = new_cr
-
+        flat_result = result.reshape(-1)
+        for idx in range(packed.cells_num):
+            new_cr = ClassifierResult("", "")
+            new_cr.classifier = "aggregated_result"
+            new_cr.y_true, new_cr.y_predicted = packed.cell(idx)
+            flat_result[idx] = new_cr
         return result
 
     def compute_score(self, axis_list_to_preserve, metric_name, propogate_error=False):
@@ -197,26 +451,24 @@ class ResultsContainer(GenericStoreStructure):
             @return: Array with computed score or NA if we failed to compute score
             @rtype: np.array
         """
-        agg_ar = self.aggregate_prediction_vectors(axis_list_to_preserve)
-
-        scoring_function = functools.partial(
-            compute_score_by_metric_name, metric_name=metric_name)
-
-        def func(cr):
-            """
-                @type cr: ClassifierResult
-                @rtype: float
-            """
-            try:
-                return scoring_function(cr.y_true, cr.y_predicted)
-            except Exception, e:
-                if propogate_error:
-                    raise e
-                return np.nan
-
-        vectorized_func = np.vectorize(func, otypes=[np.float])
-
-        score_ar = vectorized_func(agg_ar)
+        # scores cache is bound to the version of loaded data
+        self.pack()
+        axis_list_to_preserve = list(axis_list_to_preserve)
+        key = (frozenset(axis_list_to_preserve), metric_name)
+        score_cache = self.load_score_cache()
+        if key in score_cache:
+            axis_order, score_ar = score_cache[key]
+            return np.transpose(score_ar, [
+                axis_order.index(axis) for axis in axis_list_to_preserve
+            ]).copy()
+
+        packed, new_shape = self.aggregate_packed(axis_list_to_preserve)
+        score_ar = compute_packed_scores(
+            packed, metrics_dict[metric_name], propagate_error=propogate_error)
+        score_ar = score_ar.reshape(new_shape)
+
+        score_cache[key] = (axis_list_to_preserve, score_ar.copy())
+        self.store_score_cache()
         return score_ar
 
     def get_pandas_slice_for_boxplot(
@@ -277,15 +529,42 @@ class ResultsContainer(GenericStoreStructure):
         self.update_label_index()
         self.init_ar()
 
-        for idx, rc in enumerate(list_of_rcs):
-            mask = tuple(slice(0, shp) for shp in rc.ar.shape) + (idx,)
-            self.ar[mask] = rc.ar
+        sub_shape = self.shape[:-1]
+        for sub_rc in list_of_rcs:
+            sub_rc.pack()
+            if len(sub_rc.shape) != len(sub_shape) or \
+                    any(dim > max_dim for dim, max_dim in zip(sub_rc.shape, sub_shape)):
+                raise ValueError("Results container of shape %s doesn't fit into %s" %
+                                 (sub_rc.shape, sub_shape))
+
+        # Cells of stacked containers are ordered as (layer, *sub_shape),
+        #  missing layers and cells absent in smaller containers are left empty
+        lengths = np.zeros((len(labels_list),) + sub_shape, dtype=np.int64)
+        for idx, sub_rc in enumerate(list_of_rcs):
+            mask = (idx,) + tuple(slice(0, dim) for dim in sub_rc.shape)
+            lengths[mask] = np.diff(sub_rc.offsets).reshape(sub_rc.shape)
+        stacked_offsets = np.zeros(lengths.size + 1, dtype=np.int64)
+        np.cumsum(lengths.ravel(), out=stacked_offsets[1:])
+
+        # new axis goes last
+        stacked_idx = np.arange(lengths.size, dtype=np.int64).reshape(
+            (len(labels_list),) + sub_shape)
+        positions, offsets = take_segments(
+            stacked_offsets, np.rollaxis(stacked_idx, 0, len(self.shape)))
+
+        self.ar = None
+        self.y_true = np.concatenate(
+            [np.array([], dtype=np.int64)] + [sub_rc.y_true for sub_rc in list_of_rcs])[positions]
+        self.y_predicted = np.concatenate(
+            [np.array([], dtype=np.int64)] + [sub_rc.y_predicted for sub_rc in list_of_rcs])[positions]
+        self.offsets = offsets
+        self.scores = {}
 
     def to_dict(self, *args, **kwargs):
         self.load()
         return {
             "labels_dict": self.labels_dict,
-            "shape": self.ar.shape,
+            "shape": self.shape,
             "axis_list": self.axis_list
         }
 
@@ -295,18 +574,18 @@ class ResultsContainer(GenericStoreStructure):
         meta = self.to_dict()
         log.debug("Meta: %s", meta)
         records = []
+        packed = self.get_packed_labels()
         index_labels = [self.labels_dict[axis] for axis in self.axis_list]
-        for row_def in product(*index_labels):
+        for flat_idx, row_def in enumerate(product(*index_labels)):
             spec_def = {axis: val for val, axis in zip(row_def, self.axis_list)}
             key = tuple(np.array(self.build_axis_mask(spec_def)))
-            val = self.ar[key]
-            log.debug("%s -> %s", (key, val))
+            y_true, y_predicted = packed.cell(flat_idx)
 
             cell = {
                 "key": key,
                 "key_names": spec_def,
-                "y_true": list(val.y_true),
-                "y_predicted": list(val.y_predicted),
+                "y_true": y_true.tolist(),
+                "y_predicted": y_predicted.tolist(),
 
             }
             records.append(cell)
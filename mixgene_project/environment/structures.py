@@ -1,7 +1,9 @@
 import gzip
 import cPickle as pickle
 import logging
+import os
 from uuid import uuid1
+import numpy as np
 import pandas as pd
 import rpy2.robjects as R
 from copy import deepcopy
@@ -9,20 +11,69 @@ import hashlib
 
 import json
 
+from environment.cache import data_cache
 from workflow.input import AbsInputVar
 from wrappers.scoring import metrics
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
+
+def resolve_positions(labels, names=None, positions=None):
+    """
+        Translates selection given either by labels or by positions
+         into positional indexer.
+
+        @type  labels: list or pd.Index
+        @param labels: Stored axis labels
+
+        @type  names: list or None
+        @param names: Selected labels, result follows their order
+
+        @type  positions: list or None
+        @param positions: Selected positions
+
+        @rtype: np.ndarray or None
+        @return: Positions to take, None means whole axis
+    """
+    if names is not None and positions is not None:
+        raise ValueError("Selection should be given either by labels or by positions")
+    if positions is not None:
+        return np.asarray(positions, dtype=np.int64)
+    if names is None:
+        return None
+
+    index = pd.Index(labels)
+    names = list(names)
+    if index.is_unique:
+        result = index.get_indexer(names)
+        if (result == -1).any():
+            missing = [name for name, pos in zip(names, result) if pos == -1]
+            raise KeyError("Labels not found: %s" % missing[:10])
+        return result
+    else:
+        # duplicated labels are taken all, in the stored order
+        return np.flatnonzero(np.in1d(np.asarray(index), names))
+
+
 class PickleStorage(object):
+    # Unpickled objects are larger than compressed file
+    size_factor = 8
+
     def __init__(self, filepath):
         self.filepath = filepath
 
-    def load(self):
+    def _read(self):
         return pickle.loads(gzip.open(self.filepath, "rb").read())
 
+    def load(self):
+        size = None
+        if os.path.exists(self.filepath):
+            size = os.path.getsize(self.filepath) * self.size_factor
+        return data_cache.load([self.filepath], self._read, size=size)
+
     def store(self, obj):
+        data_cache.invalidate(self.filepath)
         with gzip.open(self.filepath, "wb") as out:
             pickle.dump(obj, out, 2)
 
@@ -36,14 +87,54 @@ class DataFrameStorage(object):
     def __init__(self, filepath):
         self.filepath = filepath
 
-    def load(self, nrows=None):
+    def load(self, nrows=None,
+             rows=None, cols=None, row_positions=None, col_positions=None,
+             copy=False):
         """
             @type nrows: int or None
             @param nrows: Number of rows to read
 
+            @param rows: Row labels to select
+            @param cols: Column labels to select
+            @param row_positions: Row positions to select
+            @param col_positions: Column positions to select
+
+            @type  copy: bool
+            @param copy: When False whole matrix is shared with other
+                readers and is read only
+
             @rtype  : pandas.DataFrame
             @return : Stored matrix
         """
+        is_selection = not (rows is None and cols is None and
+                            row_positions is None and col_positions is None)
+        if not is_selection and nrows is None:
+            return data_cache.load([self.filepath], self._read, copy=copy)
+
+        df = None
+        if nrows is None:
+            df = data_cache.get([self.filepath])
+            if df is None and row_positions is not None and len(row_positions):
+                # text file is parsed sequentially, no need to go past the last row
+                nrows = int(np.max(row_positions)) + 1
+            elif df is None:
+                df = data_cache.load([self.filepath], self._read)
+        if df is None:
+            df = self._read(nrows)
+
+        if not is_selection:
+            return df
+
+        # positional selection takes new arrays out of the shared frame
+        row_idx = resolve_positions(df.index, rows, row_positions)
+        col_idx = resolve_positions(df.columns, cols, col_positions)
+        if row_idx is not None:
+            df = df.iloc[row_idx]
+        if col_idx is not None:
+            df = df.iloc[:, col_idx]
+        return df
+
+    def _read(self, nrows=None):
         return pd.read_table(
             self.filepath,
             sep=self.sep,
@@ -53,6 +144,30 @@ class DataFrameStorage(object):
             nrows=nrows
         )
 
+    def load_array(self, mmap=True):
+        """
+            Text format can't be mapped into memory, so matrix is parsed
+             and returned as read-only array.
+
+            @rtype  : numpy.ndarray
+        """
+        values = self.load().values
+        values.flags.writeable = False
+        return values
+
+    def load_labels(self):
+        """
+            @rtype  : dict
+            @return : {"index": [], "index_name": , "columns": [], "columns_name": }
+        """
+        df = data_cache.load([self.filepath], self._read)
+        return {
+            "index": df.index.tolist(),
+            "index_name": df.index.name,
+            "columns": df.columns.tolist(),
+            "columns_name": df.columns.name,
+        }
+
     def store(self, df):
         """
             @type   df: pandas.DataFrame
@@ -60,6 +175,7 @@ class DataFrameStorage(object):
         """
         if not isinstance(df, pd.DataFrame):
             raise TypeError("Given object isn't of DataFrame class: %s" % df)
+        data_cache.invalidate(self.filepath)
         if self.compression == "gzip":
             with gzip.open(self.filepath, "wb") as output:
                 df.to_csv(
@@ -83,6 +199,219 @@ class DataFrameStorage(object):
     #     return R.r["read.table"](self.filepath, sep=self.sep, header=self.header)
 
 
+class BinaryDataFrameStorage(object):
+    """
+        Numeric matrix stored as raw binary array, labels are kept aside.
+
+        For the given `filepath` prefix the following files are written:
+            <filepath>.values.npy       - float matrix in C order
+            <filepath>.labels.pkl.gz    - index and columns labels with names
+
+        When binary files are absent, but `<filepath>.csv.gz` exists,
+         data is read from it as DataFrameStorage does.
+    """
+    dtype = np.float64
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+
+    @property
+    def values_filepath(self):
+        return "%s.values.npy" % self.filepath
+
+    @property
+    def labels_filepath(self):
+        return "%s.labels.pkl.gz" % self.filepath
+
+    @property
+    def legacy_filepath(self):
+        return "%s.csv.gz" % self.filepath
+
+    def is_binary_stored(self):
+        return os.path.exists(self.values_filepath) and \
+            os.path.exists(self.labels_filepath)
+
+    def load_labels(self):
+        """
+            @rtype  : dict
+            @return : {"index": [], "index_name": , "columns": [], "columns_name": }
+        """
+        if not self.is_binary_stored():
+            return DataFrameStorage(self.legacy_filepath).load_labels()
+        labels = self._load_shared_labels()
+        labels["index"] = list(labels["index"])
+        labels["columns"] = list(labels["columns"])
+        return labels
+
+    def _load_shared_labels(self):
+        """
+            @return: Labels as `load_labels()` does, but index and columns
+                are tuples shared with other readers
+        """
+        index, index_name, columns, columns_name = data_cache.load(
+            [self.labels_filepath], self._read_labels)
+        return {
+            "index": index,
+            "index_name": index_name,
+            "columns": columns,
+            "columns_name": columns_name,
+        }
+
+    def _read_labels(self):
+        with gzip.open(self.labels_filepath, "rb") as inp:
+            labels = pickle.load(inp)
+        # tuples can be cached read only, so readers don't copy them
+        return (tuple(labels["index"]), labels["index_name"],
+                tuple(labels["columns"]), labels["columns_name"])
+
+    def load_array(self, mmap=True):
+        """
+            @type  mmap: bool
+            @param mmap: Map file into memory instead of reading it, so
+                processes on the same host share pages of the matrix
+
+            @rtype  : numpy.ndarray
+            @return : Read-only matrix, rows and columns follow `load_labels()`
+        """
+        if not self.is_binary_stored():
+            return DataFrameStorage(self.legacy_filepath).load_array()
+
+        if mmap:
+            return np.load(self.values_filepath, mmap_mode="r")
+
+        values = np.load(self.values_filepath)
+        values.flags.writeable = False
+        return values
+
+    def load(self, nrows=None, mmap=False,
+             rows=None, cols=None, row_positions=None, col_positions=None,
+             copy=False):
+        """
+            When selection is given only requested cells are read
+             from the memory mapped file.
+
+            @type nrows: int or None
+            @param nrows: Number of rows to read
+
+            @type  mmap: bool
+            @param mmap: Build read-only data frame over memory mapped file
+
+            @param rows: Row labels to select
+            @param cols: Column labels to select
+            @param row_positions: Row positions to select
+            @param col_positions: Column positions to select
+
+            @type  copy: bool
+            @param copy: When False whole matrix is shared with other
+                readers and is read only
+
+            @rtype  : pandas.DataFrame
+            @return : Stored matrix
+        """
+        if not self.is_binary_stored():
+            log.debug("Binary data not found for %s, reading legacy csv", self.filepath)
+            return DataFrameStorage(self.legacy_filepath).load(
+                nrows, rows=rows, cols=cols,
+                row_positions=row_positions, col_positions=col_positions,
+                copy=copy)
+
+        labels = self._load_shared_labels()
+        index = labels["index"]
+        columns = labels["columns"]
+
+        row_idx = resolve_positions(index, rows, row_positions)
+        col_idx = resolve_positions(columns, cols, col_positions)
+        if nrows is not None:
+            row_idx = np.arange(min(nrows, len(index))) if row_idx is None \
+                else row_idx[:nrows]
+
+        if mmap and row_idx is None and col_idx is None:
+            values = np.load(self.values_filepath, mmap_mode="r")
+        elif row_idx is None and col_idx is None:
+            return data_cache.load(
+                [self.values_filepath, self.labels_filepath], self._read, copy=copy)
+        else:
+            values = np.load(self.values_filepath, mmap_mode="r")
+            if row_idx is not None:
+                # fancy indexing copies only selected rows out of the mapping
+                values = values[row_idx]
+                index = [index[pos] for pos in row_idx]
+            if col_idx is not None:
+                values = values[:, col_idx]
+                columns = [columns[pos] for pos in col_idx]
+            values = np.asarray(values)
+
+        return pd.DataFrame(
+            values,
+            index=pd.Index(index, name=labels["index_name"]),
+            columns=pd.Index(columns, name=labels["columns_name"]),
+        )
+
+    def _read(self):
+        labels = self._load_shared_labels()
+        return pd.DataFrame(
+            np.load(self.values_filepath),
+            index=pd.Index(labels["index"], name=labels["index_name"]),
+            columns=pd.Index(labels["columns"], name=labels["columns_name"]),
+        )
+
+    def store(self, df):
+        """
+            @type   df: pandas.DataFrame
+            @param  df: Stored matrix, should contain only numeric values
+        """
+        if not isinstance(df, pd.DataFrame):
+            raise TypeError("Given object isn't of DataFrame class: %s" % df)
+
+        if any(dtype == object for dtype in df.dtypes):
+            # e.g. values parsed from text sources
+            df = df.convert_objects(convert_numeric=True)
+        try:
+            values = np.ascontiguousarray(df.values, dtype=self.dtype)
+        except (TypeError, ValueError), e:
+            raise TypeError("Binary storage supports only numeric matrices: %s" % e)
+
+        labels = {
+            "index": df.index.tolist(),
+            "index_name": df.index.name,
+            "columns": df.columns.tolist(),
+            "columns_name": df.columns.name,
+        }
+
+        # Write to temporary files and rename, so readers never see partial data
+        tmp_values_filepath = "%s.tmp" % self.values_filepath
+        with open(tmp_values_filepath, "wb") as output:
+            np.save(output, values)
+
+        tmp_labels_filepath = "%s.tmp" % self.labels_filepath
+        with gzip.open(tmp_labels_filepath, "wb") as output:
+            pickle.dump(labels, output, 2)
+
+        os.rename(tmp_labels_filepath, self.labels_filepath)
+        os.rename(tmp_values_filepath, self.values_filepath)
+        data_cache.invalidate(self.labels_filepath)
+        data_cache.invalidate(self.values_filepath)
+
+
+data_frame_storage_formats = {
+    "csv": lambda filepath: DataFrameStorage("%s.csv.gz" % filepath),
+    "binary": BinaryDataFrameStorage,
+}
+
+
+def build_data_frame_storage(filepath, storage_format="csv"):
+    """
+        @type  filepath: str
+        @param filepath: Path prefix without extension
+
+        @type  storage_format: str
+        @param storage_format: One of `data_frame_storage_formats` keys
+    """
+    if storage_format not in data_frame_storage_formats:
+        raise ValueError("Unknown data frame storage format: %s" % storage_format)
+    return data_frame_storage_formats[storage_format](filepath)
+
+
 class GenericStoreStructure(object):
     def __init__(self, base_dir, base_filename, *args, **kwargs):
         self.base_dir = base_dir
@@ -127,6 +456,9 @@ class BinaryInteraction(GenericStoreStructure):
 
 
 class ExpressionSet(GenericStoreStructure):
+    # Format for newly stored assay matrices, see `data_frame_storage_formats`
+    assay_storage_format = "binary"
+
     def __init__(self, base_dir, base_filename):
         """
             Expression data from micro array experiment.
@@ -163,6 +495,7 @@ class ExpressionSet(GenericStoreStructure):
 
     def clone(self, base_filename, clone_data_frames=False):
         es = ExpressionSet(self.base_dir, base_filename)
+        es.assay_storage_format = self.assay_storage_format
 
         es.working_unit = deepcopy(self.working_unit)
         es.annotation = deepcopy(self.annotation)
@@ -178,13 +511,52 @@ class ExpressionSet(GenericStoreStructure):
 
         return es
 
-    def get_assay_data_frame(self):
+    def get_assay_data_frame(self, rows=None, cols=None,
+                             row_positions=None, col_positions=None):
         """
+            Selection could be given either by labels or by positions,
+             with binary storage only selected part is read.
+
+            @param rows: Row(feature) labels to select
+            @param cols: Column(sample) labels to select
+            @param row_positions: Row positions to select
+            @param col_positions: Column positions to select
+
             @rtype: pd.DataFrame
         """
         if self.assay_data_storage is None:
             raise RuntimeError("Assay data wasn't setup prior")
-        return self.assay_data_storage.load()
+        if rows is None and cols is None and \
+                row_positions is None and col_positions is None:
+            return self.assay_data_storage.load()
+        return self.assay_data_storage.load(
+            rows=rows, cols=cols,
+            row_positions=row_positions, col_positions=col_positions
+        )
+
+    def get_assay_array(self, mmap=True):
+        """
+            Assay matrix without labels, rows are features and columns are samples
+             in the order of `get_assay_labels()`.
+
+            @type  mmap: bool
+            @param mmap: Return view over memory mapped file when storage supports it
+
+            @rtype: np.ndarray
+            @return: Read-only matrix
+        """
+        if self.assay_data_storage is None:
+            raise RuntimeError("Assay data wasn't setup prior")
+        return self.assay_data_storage.load_array(mmap=mmap)
+
+    def get_assay_labels(self):
+        """
+            @rtype: dict
+            @return: {"index": [], "index_name": , "columns": [], "columns_name": }
+        """
+        if self.assay_data_storage is None:
+            raise RuntimeError("Assay data wasn't setup prior")
+        return self.assay_data_storage.load_labels()
 
     def store_assay_data_frame(self, df):
         """
@@ -192,17 +564,23 @@ class ExpressionSet(GenericStoreStructure):
             @param df: Table with expression data
         """
         if self.assay_data_storage is None:
-            self.assay_data_storage = DataFrameStorage(
-                filepath="%s/%s_assay.csv.gz" % (self.base_dir, self.base_filename))
+            self.assay_data_storage = build_data_frame_storage(
+                "%s/%s_assay" % (self.base_dir, self.base_filename),
+                self.assay_storage_format
+            )
         self.assay_data_storage.store(df)
 
-    def get_pheno_data_frame(self):
+    def get_pheno_data_frame(self, copy=False):
         """
+            @type  copy: bool
+            @param copy: Should be True when caller modifies the table,
+                otherwise shared read only frame could be returned
+
             @rtype: pd.DataFrame
         """
         if self.pheno_data_storage is None:
             raise RuntimeError("Phenotype data wasn't setup prior")
-        return self.pheno_data_storage.load()
+        return self.pheno_data_storage.load(copy=copy)
 
     def store_pheno_data_frame(self, df):
         """
@@ -234,6 +612,100 @@ class ExpressionSet(GenericStoreStructure):
         return json.dumps(result)
 
 
+class ExpressionSetView(ExpressionSet):
+    def __init__(self, parent, base_filename, samples, pheno_source=None):
+        """
+            Subset of samples of another expression set.
+
+            Nothing is written to the filesystem, matrices are read from the
+             parent set on request. Once some data frame is stored into the
+             view it behaves as a regular ExpressionSet for that frame.
+
+            @type  parent: ExpressionSet
+            @param parent: Set holding actual data
+
+            @type  samples: list
+            @param samples: Sample names, order defines columns of assay
+                and rows of phenotype
+
+            @type  pheno_source: ExpressionSet or None
+            @param pheno_source: Set to take phenotype from, default is parent
+        """
+        super(ExpressionSetView, self).__init__(parent.base_dir, base_filename)
+        self.parent = parent
+        self.pheno_source = pheno_source
+        self.samples = list(samples)
+
+        self.assay_storage_format = parent.assay_storage_format
+        self.working_unit = deepcopy(parent.working_unit)
+        self.annotation = deepcopy(parent.annotation)
+        self.feature_data = deepcopy(parent.feature_data)
+        self.experiment_data = deepcopy(parent.experiment_data)
+        self.protocol_data = deepcopy(parent.protocol_data)
+
+        self.assay_metadata = deepcopy(parent.assay_metadata)
+        self.pheno_metadata = deepcopy(parent.pheno_metadata)
+
+    def __str__(self):
+        return "ExpressionSetView of %s, samples: %s" % (self.parent, len(self.samples))
+
+    def _select_samples(self, cols=None, col_positions=None):
+        if cols is None and col_positions is None:
+            return self.samples
+        positions = resolve_positions(self.samples, cols, col_positions)
+        return [self.samples[pos] for pos in positions]
+
+    def get_assay_data_frame(self, rows=None, cols=None,
+                             row_positions=None, col_positions=None):
+        if self.assay_data_storage is not None:
+            return super(ExpressionSetView, self).get_assay_data_frame(
+                rows, cols, row_positions, col_positions)
+
+        return self.parent.get_assay_data_frame(
+            rows=rows, row_positions=row_positions,
+            cols=self._select_samples(cols, col_positions)
+        )
+
+    def get_assay_array(self, mmap=True):
+        if self.assay_data_storage is not None:
+            return super(ExpressionSetView, self).get_assay_array(mmap)
+
+        positions = resolve_positions(
+            self.parent.get_assay_labels()["columns"], self.samples)
+        values = self.parent.get_assay_array(mmap=mmap)[:, positions]
+        values.flags.writeable = False
+        return values
+
+    def get_assay_labels(self):
+        if self.assay_data_storage is not None:
+            return super(ExpressionSetView, self).get_assay_labels()
+
+        labels = self.parent.get_assay_labels()
+        labels["columns"] = list(self.samples)
+        return labels
+
+    def get_pheno_data_frame(self, copy=False):
+        if self.pheno_data_storage is not None:
+            return super(ExpressionSetView, self).get_pheno_data_frame(copy)
+
+        # selection by labels builds a new frame
+        source = self.pheno_source or self.parent
+        return source.get_pheno_data_frame().loc[self.samples]
+
+    def to_json_preview(self, row_number=20):
+        assay_df = self.get_assay_data_frame(
+            row_positions=range(min(row_number, len(self.get_assay_labels()["index"]))))
+        pheno_df = self.get_pheno_data_frame()[:row_number]
+
+        result = {
+            "assay_metadata": self.assay_metadata,
+            "assay": json.loads(assay_df.to_json(orient="split")),
+            "pheno_metadata": self.pheno_metadata,
+            "pheno": json.loads(pheno_df.to_json(orient="split")),
+        }
+        return json.dumps(result)
+
+
 class GS(object):
     def __init__(self, description=None, genes=None):
         if description is not None:
@@ -292,8 +764,11 @@ class GmtStorage(object):
     def load(self):
         """
             @rtype  : GS
+            @return : Own copy, gene sets can't be shared read only
         """
+        return data_cache.load([self.filepath], self._read, key_extra=self.sep)
 
+    def _read(self):
         if self.compression == "gzip":
             with gzip.open(self.filepath) as inp:
                 return GmtStorage.read_inp(inp, self.sep)
@@ -301,9 +776,6 @@ class GmtStorage(object):
             with open(self.filepath) as inp:
                 return GmtStorage.read_inp(inp, self.sep)
 
-
-        return gene_sets
-
     def store(self, gene_sets):
         """
             @type gene_sets: GS
@@ -316,12 +788,17 @@ class GmtStorage(object):
                 out.write("%s\t%s\t%s\n" % (
                     (key, description, "\t".join(elements))
                 ))
+        # Written aside and renamed, file could be a link into the shared
+        #   dataset cache, see environment.dataset_cache
+        tmp_filepath = "%s.tmp" % self.filepath
         if self.compression == "gzip":
-            with gzip.open(self.filepath, "w") as output:
+            with gzip.open(tmp_filepath, "w") as output:
                 write_out(output)
         else:
-            with open(self.filepath, "w") as output:
+            with open(tmp_filepath, "w") as output:
                 write_out(output)
+        os.rename(tmp_filepath, self.filepath)
+        data_cache.invalidate(self.filepath)
 
 
 class GeneSets(GenericStoreStructure):
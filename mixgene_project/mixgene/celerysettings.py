@@ -91,3 +91,39 @@ LOGGING = {
         },
     }
 }
+
+## Worker pools, started by `python -m mixgene.workers <pool>`
+#   Each pool consumes own queues, so long computations can't occupy
+#   processes reserved for scheduling tasks. Long tasks are prefetched
+#   one at a time and distributed fairly (-Ofair) to idle processes only.
+import multiprocessing
+CELERY_WORKER_POOLS = {
+    "control": {
+        "queues": ["control"],
+        "pool": "prefork",
+        "concurrency": 4,
+        "prefetch_multiplier": 4,
+    },
+    "io": {
+        "queues": ["io"],
+        "pool": "prefork",
+        "concurrency": 4,
+        "prefetch_multiplier": 1,
+        "fair": True,
+    },
+    "cpu": {
+        "queues": ["cpu"],
+        "pool": "prefork",
+        "concurrency": max(multiprocessing.cpu_count() - 1, 1),
+        "prefetch_multiplier": 1,
+        "fair": True,
+    },
+    # rpy2 isn't fork safe, R tasks are executed in the worker process itself,
+    #   run several "r" workers to process R tasks in parallel
+    "r": {
+        "queues": ["r"],
+        "pool": "solo",
+        "concurrency": 1,
+        "prefetch_multiplier": 1,
+    },
+}
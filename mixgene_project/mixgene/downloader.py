@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+"""
+    In-process HTTP downloader.
+
+    When server reports content length and accepts ranges, file is fetched
+     by several threads with Range requests, chunk by chunk. Data is written
+     to `<target>.part`, completed chunks are recorded in
+     `<target>.part.json`, so interrupted download continues from the
+     remaining chunks. Otherwise file is streamed in a single request.
+
+    Result is verified by length, by md5 when it's known (given by caller
+     or `Content-MD5` header) and by gzip CRC for gzipped files.
+"""
+import base64
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import urllib2
+from Queue import Queue, Empty
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+DEFAULT_THREADS = 4
+DEFAULT_RETRIES = 3
+DEFAULT_TIMEOUT = 60
+
+# size of reads from socket and file
+BUFFER_SIZE = 64 * 1024
+
+
+class DownloadError(RuntimeError):
+    pass
+
+
+class HeadRequest(urllib2.Request):
+    def get_method(self):
+        return "HEAD"
+
+
+def file_md5(filepath):
+    md5 = hashlib.md5()
+    with open(filepath, "rb") as inp:
+        for block in iter(lambda: inp.read(BUFFER_SIZE), ""):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def verify_gzip(filepath):
+    """
+        Reads archive through, GzipFile checks CRC and length at the end
+    """
+    try:
+        with gzip.open(filepath, "rb") as inp:
+            while inp.read(BUFFER_SIZE):
+                pass
+    except (IOError, EOFError), e:
+        raise DownloadError("Downloaded archive is corrupted: %s" % e)
+
+
+class Downloader(object):
+    def __init__(self, url, target_file,
+                 chunk_size=DEFAULT_CHUNK_SIZE, threads=DEFAULT_THREADS,
+                 retries=DEFAULT_RETRIES, timeout=DEFAULT_TIMEOUT,
+                 expected_md5=None, on_progress=None, progress_interval=2.0):
+        """
+            @type  url: str
+            @type  target_file: str
+
+            @type  chunk_size: int
+            @param chunk_size: Bytes fetched by one range request
+
+            @type  threads: int
+            @param threads: Number of parallel connections
+
+            @type  retries: int
+            @param retries: Attempts for each request
+
+            @type  expected_md5: str or None
+            @param expected_md5: Hex digest of the file
+
+            @type  on_progress: callable or None
+            @param on_progress: f(downloaded_bytes, total_bytes), called from
+                the thread which invoked `download` not more often
+                than `progress_interval` seconds. Total is None when unknown.
+        """
+        self.url = url
+        self.target_file = target_file
+        self.chunk_size = chunk_size
+        self.threads = threads
+        self.retries = retries
+        self.timeout = timeout
+        self.expected_md5 = expected_md5
+        self.on_progress = on_progress
+        self.progress_interval = progress_interval
+
+        self.size = None
+        self.accept_ranges = False
+        self.validator = None  # ETag or Last-Modified of the remote file
+
+        self.downloaded = 0
+        self._lock = threading.Lock()
+        self._errors = []
+        self._last_progress = 0
+
+    @property
+    def part_file(self):
+        return "%s.part" % self.target_file
+
+    @property
+    def state_file(self):
+        return "%s.part.json" % self.target_file
+
+    def download(self):
+        """
+            @return: Path to the downloaded file
+        """
+        self.probe()
+        if self.size and self.accept_ranges:
+            self.download_ranges()
+        else:
+            self.download_stream()
+
+        self.verify(self.part_file)
+        if os.path.exists(self.target_file):
+            os.remove(self.target_file)
+        os.rename(self.part_file, self.target_file)
+        if os.path.exists(self.state_file):
+            os.remove(self.state_file)
+        self.report_progress(force=True)
+        return self.target_file
+
+    def open(self, request):
+        last_error = None
+        for attempt in range(self.retries):
+            try:
+                return urllib2.urlopen(request, timeout=self.timeout)
+            except urllib2.HTTPError, e:
+                if e.code < 500:
+                    raise DownloadError("Failed to fetch %s: %s" % (self.url, e))
+                last_error = e
+            except (urllib2.URLError, IOError), e:
+                last_error = e
+            self.backoff(attempt)
+        raise DownloadError("Failed to fetch %s: %s" % (self.url, last_error))
+
+    def backoff(self, attempt):
+        if attempt + 1 < self.retries:
+            time.sleep(min(2 ** attempt, 30))
+
+    def probe(self):
+        """
+            Reads size and range support of the remote file
+        """
+        if not self.url.startswith(("http://", "https://")):
+            # e.g. ftp, urllib2 handles it as a stream
+            return
+        response = self.open(HeadRequest(self.url))
+        try:
+            headers = response.info()
+            length = headers.getheader("Content-Length")
+            self.size = int(length) if length else None
+            self.accept_ranges = "bytes" in (headers.getheader("Accept-Ranges") or "")
+            self.validator = headers.getheader("ETag") or headers.getheader("Last-Modified")
+
+            content_md5 = headers.getheader("Content-MD5")
+            if content_md5 and self.expected_md5 is None:
+                self.expected_md5 = base64.b64decode(content_md5).encode("hex")
+        finally:
+            response.close()
+
+    def load_state(self):
+        """
+            @rtype: set of int
+            @return: Chunks stored in part file by previous attempt
+        """
+        try:
+            with open(self.state_file) as inp:
+                state = json.load(inp)
+        except (IOError, ValueError):
+            return set()
+        if state.get("size") != self.size or \
+                state.get("chunk_size") != self.chunk_size or \
+                state.get("validator") != self.validator or \
+                not os.path.exists(self.part_file):
+            log.debug("Remote file %s was changed, restarting download", self.url)
+            return set()
+        return set(state["done"])
+
+    def store_state(self, done):
+        tmp_file = "%s.tmp" % self.state_file
+        with open(tmp_file, "w") as out:
+            json.dump({
+                "url": self.url,
+                "size": self.size,
+                "chunk_size": self.chunk_size,
+                "validator": self.validator,
+                "done": sorted(done),
+            }, out)
+        os.rename(tmp_file, self.state_file)
+
+    def download_ranges(self):
+        chunks_num = (self.size + self.chunk_size - 1) / self.chunk_size
+        done = self.load_state()
+        if not done:
+            with open(self.part_file, "wb") as out:
+                out.truncate(self.size)
+            self.store_state(done)
+
+        self.downloaded = sum(self.get_chunk_length(idx) for idx in done)
+        pending = Queue()
+        for idx in range(chunks_num):
+            if idx not in done:
+                pending.put(idx)
+        log.debug("Downloading %s: %s of %s chunks are pending",
+                  self.url, pending.qsize(), chunks_num)
+
+        workers = [
+            threading.Thread(target=self.range_worker, args=(pending, done))
+            for _ in range(min(self.threads, pending.qsize()))
+        ]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        for worker in workers:
+            while worker.is_alive():
+                worker.join(self.progress_interval)
+                self.report_progress()
+
+        if self._errors:
+            raise DownloadError("Failed to fetch %s, download could be resumed: %s" %
+                                (self.url, self._errors[0]))
+
+    def get_chunk_length(self, idx):
+        return min(self.chunk_size, self.size - idx * self.chunk_size)
+
+    def range_worker(self, pending, done):
+        with open(self.part_file, "r+b") as out:
+            while not self._errors:
+                try:
+                    idx = pending.get_nowait()
+                except Empty:
+                    return
+                try:
+                    self.fetch_chunk(idx, out)
+                except Exception, e:
+                    log.exception(e)
+                    self._errors.append(e)
+                    return
+                with self._lock:
+                    done.add(idx)
+                    self.store_state(done)
+
+    def fetch_chunk(self, idx, out):
+        start = idx * self.chunk_size
+        end = start + self.get_chunk_length(idx) - 1
+
+        last_error = None
+        for attempt in range(self.retries):
+            request = urllib2.Request(self.url, headers={"Range": "bytes=%s-%s" % (start, end)})
+            response = self.open(request)
+            written = 0
+            try:
+                if response.getcode() != 206:
+                    raise DownloadError("Server ignored range request for %s" % self.url)
+                out.seek(start)
+                for block in iter(lambda: response.read(BUFFER_SIZE), ""):
+                    out.write(block)
+                    written += len(block)
+                    with self._lock:
+                        self.downloaded += len(block)
+                if written == end - start + 1:
+                    out.flush()
+                    return
+                last_error = "got %s bytes instead of %s" % (written, end - start + 1)
+            except (IOError, urllib2.URLError), e:
+                last_error = e
+            finally:
+                response.close()
+            with self._lock:
+                self.downloaded -= written
+            self.backoff(attempt)
+        raise DownloadError("Failed to fetch chunk %s of %s: %s" % (idx, self.url, last_error))
+
+    def download_stream(self):
+        response = self.open(urllib2.Request(self.url))
+        self.downloaded = 0
+        try:
+            with open(self.part_file, "wb") as out:
+                for block in iter(lambda: response.read(BUFFER_SIZE), ""):
+                    out.write(block)
+                    self.downloaded += len(block)
+                    self.report_progress()
+        except (IOError, urllib2.URLError), e:
+            raise DownloadError("Failed to fetch %s: %s" % (self.url, e))
+        finally:
+            response.close()
+
+    def verify(self, filepath):
+        actual_size = os.path.getsize(filepath)
+        if actual_size == 0:
+            raise DownloadError("Got empty file from %s" % self.url)
+        if self.size is not None and actual_size != self.size:
+            raise DownloadError("Size of %s is %s, expected %s" % (self.url, actual_size, self.size))
+        try:
+            if self.expected_md5 is not None:
+                actual_md5 = file_md5(filepath)
+                if actual_md5 != self.expected_md5.lower():
+                    raise DownloadError("Checksum mismatch for %s: %s instead of %s" %
+                                        (self.url, actual_md5, self.expected_md5))
+            if self.target_file.endswith(".gz"):
+                verify_gzip(filepath)
+        except DownloadError:
+            # some chunks are broken, next attempt shouldn't resume from them
+            self.discard()
+            raise
+
+    def discard(self):
+        for filepath in [self.part_file, self.state_file]:
+            if os.path.exists(filepath):
+                os.remove(filepath)
+
+    def report_progress(self, force=False):
+        if self.on_progress is None:
+            return
+        now = time.time()
+        if not force and now - self._last_progress < self.progress_interval:
+            return
+        self._last_progress = now
+        try:
+            self.on_progress(self.downloaded, self.size)
+        except Exception, e:
+            log.exception("Progress callback failed: %s", e)
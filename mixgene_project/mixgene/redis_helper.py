@@ -36,6 +36,79 @@ class ExpKeys(object):
         """
         return "S_ESCP-%s-%s" % (exp_id, scope_name)
 
+    @staticmethod
+    def get_scope_blocks_key(exp_id, scope_name):
+        """
+            Set of block uuids in the given scope, including blocks
+             which are not listed in the experiment blocks list,
+             e.g. per-fold copies of meta block sub-scope
+        """
+        return "SBS-%s-%s" % (exp_id, scope_name)
+
+    @staticmethod
+    def get_block_deps_key(exp_id):
+        """
+            Hash "block_uuid" -> comma separated uuids of blocks providing inputs,
+             see webapp.models.encode_block_deps
+        """
+        return "BDH-%s" % exp_id
+
+    @staticmethod
+    def get_block_states_key(exp_id):
+        """
+            Hash "block_uuid" -> json of webapp.models.BlockState
+        """
+        return "BSTH-%s" % exp_id
+
+    @staticmethod
+    def get_execution_fingerprints_key(exp_id):
+        """
+            Hash "block_uuid" -> fingerprint of the last successful execution,
+             see workflow.blocks.generic.GenericBlock.get_execution_fingerprint
+        """
+        return "EFP-%s" % exp_id
+
+    @staticmethod
+    def get_execution_results_key(exp_id):
+        """
+            Hash "block_uuid" -> pickled outputs of the last successful execution
+        """
+        return "ERC-%s" % exp_id
+
+    @staticmethod
+    def get_scope_dag_versions_key(exp_id):
+        """
+            Hash "scope_name" -> counter incremented on every change of
+             the scope blocks or their dependencies
+        """
+        return "SDAGV-%s" % exp_id
+
+    @staticmethod
+    def get_scope_dag_key(exp_id, scope_name):
+        """
+            Pickled tuple (scope dag version, webapp.scope.DAG)
+        """
+        return "SDAG-%s-%s" % (exp_id, scope_name)
+
+    @staticmethod
+    def get_running_blocks_key(exp_id):
+        """
+            Set of blocks of the experiment, which are executed right now
+        """
+        return "RBS-%s" % exp_id
+
+    @staticmethod
+    def get_scope_running_blocks_key(exp_id, scope_name):
+        return "SRBS-%s-%s" % (exp_id, scope_name)
+
+    @staticmethod
+    def get_waiting_scopes_key(exp_id):
+        """
+            Set of scopes which have ready blocks postponed due to
+             execution limits
+        """
+        return "WSS-%s" % exp_id
+
     @staticmethod
     def get_auto_exec_task_lock_key(exp_id, scope_name):
         return "AETLK-%s-%s" % (exp_id, scope_name)
@@ -45,9 +118,47 @@ class ExpKeys(object):
         return "MBCLK-%s-%s" % (exp_id, block_uuid)
 
 
+class CacheKeys(object):
+    """
+        Keys of experiment independent caches, see webapp.models.CachedFile
+    """
+    @staticmethod
+    def get_cached_file_pins_key(uri_sha):
+        """
+            Sorted set: pin token -> expiration timestamp
+        """
+        return "CFP-%s" % uri_sha
+
+    @staticmethod
+    def get_cached_files_stats_key():
+        """
+            Hash: "hits", "misses", "evictions" -> counter
+        """
+        return "CFSTATS"
+
+    @staticmethod
+    def get_cached_files_eviction_lock_key():
+        return "CFELK"
+
+    @staticmethod
+    def get_single_flight_lock_key(key):
+        """
+            Token of the flight leader, see mixgene.single_flight
+        """
+        return "SFLK-%s" % key
+
+    @staticmethod
+    def get_single_flight_done_key(key, token):
+        """
+            List with completion status pushed by the flight leader
+        """
+        return "SFD-%s-%s" % (key, token)
+
+
 def register_sub_key(exp_id, key, redis_instance=None):
     if redis_instance is None:
         r = get_redis_instance()
     else:
         r = redis_instance
     r.sadd(ExpKeys.get_all_exp_keys_key(exp_id), key)
+
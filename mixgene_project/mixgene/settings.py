@@ -52,8 +52,42 @@ CELERY_IMPORTS = (
 CELERYD_HIJACK_ROOT_LOGGER = False
 CELERY_ACCEPT_CONTENT = ['pickle', 'json']
 
+# Tasks are routed to queues by class, see webapp.task_routing,
+#   workers for each queue are described in mixgene.celerysettings
+from kombu import Queue
+CELERY_QUEUES = (
+    Queue("control", routing_key="control"),
+    Queue("io", routing_key="io"),
+    Queue("cpu", routing_key="cpu"),
+    Queue("r", routing_key="r"),
+)
+CELERY_DEFAULT_QUEUE = "cpu"
+CELERY_DEFAULT_ROUTING_KEY = "cpu"
+CELERY_ROUTES = ("webapp.task_routing.TaskClassRouter", )
+
+# Task name or path of function passed to `wrapper_task` -> queue,
+#   unlisted tasks go to the "cpu" queue
+CELERY_TASK_CLASSES = {
+    "webapp.tasks.auto_exec": "control",
+    "webapp.tasks.halt_execution": "control",
+
+    "workflow.common_tasks.fetch_geo_gse": "io",
+    "workflow.common_tasks.preprocess_soft": "io",
+
+    "workflow.blocks.feature_selection.apply_ranking": "r",
+    "wrappers.gt.global_test_task": "r",
+    "wrappers.pca.pca_test": "r",
+}
+
 ## End celery settings
 
+# Memory budget of worker-local cache of loaded data frames, see environment.cache
+DATA_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Limits of concurrently executed blocks, see webapp.scope.ScopeRunner
+MAX_RUNNING_BLOCKS_PER_EXPERIMENT = 16
+MAX_RUNNING_BLOCKS_PER_SCOPE = 8
+
 #BASE_DIR = '/var/run/mixgene'  # from local settings
 # Absolute filesystem path to the directory that will hold user-uploaded files.
 # Example: "/var/www/example.com/media/"
@@ -93,6 +127,23 @@ USE_TZ = True
 
 MEDIA_ROOT = BASE_DIR + '/media'
 
+# Preprocessed GEO series shared between experiments, see environment.dataset_cache
+#   should be on the same file system as MEDIA_ROOT, so files are hard linked
+DATASETS_CACHE_DIR = MEDIA_ROOT + '/data/cache/datasets'
+
+# Size limit of downloaded files cache (MEDIA_ROOT/data/cache), see webapp.models.CachedFile,
+#   least recently used files are evicted, 0 disables the limit
+CACHED_FILES_QUOTA_BYTES = 20 * 1024 * 1024 * 1024
+# Seconds after which pin of the cached file by a dead fetch expires
+CACHED_FILE_PIN_TTL = 6 * 3600
+# Seconds after which concurrent fetch or preprocess waiting for a silent leader
+#   takes the work over, see mixgene.single_flight
+SINGLE_FLIGHT_TTL = 2 * 3600
+
+# Downloads of external files, see mixgene.downloader
+DOWNLOAD_THREADS = 4
+DOWNLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
 # URL that handles the media served from MEDIA_ROOT. Make sure to use a
 # trailing slash.
 # Examples: "http://example.com/media/", "http://media.example.com/"
@@ -141,6 +192,7 @@ MIDDLEWARE_CLASSES = (
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'webapp.middleware.RedisRoundTripsMiddleware',
     # Uncomment the next line for simple clickjacking protection:
     # 'django.middleware.clickjacking.XFrameOptionsMiddleware',
 
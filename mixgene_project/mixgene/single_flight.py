@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+    Deduplication of identical work started concurrently by several workers,
+     e.g. fetch of the same GEO series for different experiments.
+
+    The first caller becomes the leader: does the work and pushes completion
+     status. Others wait for the status and then read what leader produced.
+     When the leader dies without signal, its lock expires and one of the
+     waiting callers takes over.
+"""
+import logging
+import uuid
+
+from mixgene.redis_helper import CacheKeys
+from mixgene.util import get_redis_instance
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+STATUS_OK = "ok"
+STATUS_ERROR = "error"
+
+DEFAULT_TTL = 2 * 3600
+# followers recheck leader lock with this period, seconds
+POLL_INTERVAL = 5
+
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+class SingleFlightError(RuntimeError):
+    pass
+
+
+def get_ttl_setting():
+    try:
+        from django.conf import settings
+        return int(getattr(settings, "SINGLE_FLIGHT_TTL", DEFAULT_TTL))
+    except Exception:
+        return DEFAULT_TTL
+
+
+def single_flight(key, do_work, read_result, ttl=None, reuse_result=True,
+                  redis_instance=None):
+    """
+        @type  key: str
+        @param key: Identifies work, e.g. url of fetched file
+
+        @type  do_work: callable
+        @param do_work: Function without arguments, executed by the leader
+
+        @type  read_result: callable
+        @param read_result: Function without arguments, executed by followers
+            after leader success and by the leader before work. Should return
+            None when result isn't available (e.g. already evicted), then
+            caller tries to lead.
+
+        @type  ttl: int or None
+        @param ttl: Seconds after which leader is considered dead
+
+        @type  reuse_result: bool
+        @param reuse_result: When False leader does the work even if
+            result is already available, e.g. to refresh it
+
+        @return: Result of `do_work` or `read_result`
+    """
+    if redis_instance is None:
+        r = get_redis_instance()
+    else:
+        r = redis_instance
+    if ttl is None:
+        ttl = get_ttl_setting()
+
+    lock_key = CacheKeys.get_single_flight_lock_key(key)
+    while True:
+        token = uuid.uuid4().hex
+        if r.set(lock_key, token, nx=True, ex=ttl):
+            return _lead(r, key, lock_key, token, ttl, do_work,
+                         read_result if reuse_result else None)
+
+        leader_token = r.get(lock_key)
+        if leader_token is None:
+            # leader has just finished
+            continue
+
+        log.debug("Waiting for %s to be done by another worker", key)
+        status = _wait(r, key, lock_key, leader_token)
+        if status is None:
+            log.warning("Leader of %s has gone without result, taking over", key)
+            continue
+        if status == STATUS_ERROR:
+            raise SingleFlightError("Concurrent execution of %s has failed" % key)
+
+        result = read_result()
+        if result is not None:
+            return result
+        log.debug("Result of %s isn't available, repeating work", key)
+
+
+def _lead(r, key, lock_key, token, ttl, do_work, read_result):
+    status = STATUS_ERROR
+    try:
+        # another leader could finish between caller check and lock acquire
+        result = read_result() if read_result is not None else None
+        if result is None:
+            result = do_work()
+        else:
+            log.debug("Result of %s is already available, skipping work", key)
+        status = STATUS_OK
+        return result
+    finally:
+        done_key = CacheKeys.get_single_flight_done_key(key, token)
+        pipe = r.pipeline()
+        pipe.rpush(done_key, status)
+        pipe.expire(done_key, ttl)
+        pipe.execute()
+        r.eval(RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+
+
+def _wait(r, key, lock_key, leader_token):
+    """
+        @return: Status pushed by leader or None when leader is gone silently
+    """
+    done_key = CacheKeys.get_single_flight_done_key(key, leader_token)
+    while True:
+        # value is returned back, so every follower receives it
+        status = r.brpoplpush(done_key, done_key, timeout=POLL_INTERVAL)
+        if status is not None:
+            return status
+        if r.get(lock_key) != leader_token:
+            # lock could be released right after the status push
+            return r.lindex(done_key, 0)
@@ -1,8 +1,12 @@
 from collections import defaultdict
+import threading
+
 from redis import StrictRedis
+from redis.client import StrictPipeline
 from settings import REDIS_HOST, REDIS_PORT
 from subprocess import Popen, PIPE
 import os
+import shutil
 import time
 from contextlib import contextmanager
 from datetime import datetime
@@ -14,8 +18,54 @@ import logging
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
+class RedisStats(threading.local):
+    round_trips = 0
+
+redis_stats = RedisStats()
+
+
+def reset_redis_round_trips():
+    redis_stats.round_trips = 0
+
+
+def get_redis_round_trips():
+    """
+        @rtype: int
+        @return: Number of requests sent to redis by the current thread
+            since the last reset
+    """
+    return redis_stats.round_trips
+
+
+class CountingStrictPipeline(StrictPipeline):
+    def execute(self, raise_on_error=True):
+        if self.command_stack:
+            redis_stats.round_trips += 1
+        return super(CountingStrictPipeline, self).execute(raise_on_error)
+
+    def immediate_execute_command(self, *args, **options):
+        redis_stats.round_trips += 1
+        return super(CountingStrictPipeline, self).immediate_execute_command(*args, **options)
+
+
+class CountingStrictRedis(StrictRedis):
+    """
+        Redis client which counts round trips, see `get_redis_round_trips`
+    """
+    def execute_command(self, *args, **options):
+        redis_stats.round_trips += 1
+        return super(CountingStrictRedis, self).execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return CountingStrictPipeline(
+            self.connection_pool,
+            self.response_callbacks,
+            transaction,
+            shard_hint)
+
+
 def get_redis_instance():
-    return StrictRedis(host=REDIS_HOST, port=REDIS_PORT)
+    return CountingStrictRedis(host=REDIS_HOST, port=REDIS_PORT)
 
 
 def dyn_import(class_name):
@@ -33,21 +83,66 @@ def mkdir(path):
     retcode = output.wait()
 
 
-def fetch_file_from_url(url, target_file):
-    try:
-        os.rm(target_file)
-    except:
-        pass
-    args = ['wget', '-nv', '-t', '3', '-O', str(target_file), str(url)]
-    log.debug('Command to execute: %s' , ' '.join(args))
+def fetch_file_from_url(url, target_file, on_progress=None):
+    """
+        Downloads file, see `mixgene.downloader.Downloader`, interrupted
+         download is continued by the next call with the same arguments
+
+        @type  on_progress: callable or None
+        @param on_progress: f(downloaded_bytes, total_bytes)
+    """
+    from django.conf import settings
+    from mixgene.downloader import Downloader
+
+    log.debug('Fetching %s to %s', url, target_file)
+    with stopwatch(name="Fetching %s" % url, threshold=1):
+        Downloader(
+            url, str(target_file),
+            chunk_size=getattr(settings, "DOWNLOAD_CHUNK_SIZE", 8 * 1024 * 1024),
+            threads=getattr(settings, "DOWNLOAD_THREADS", 4),
+            on_progress=on_progress,
+        ).download()
 
-    output = Popen(args, stdout=PIPE, stderr=PIPE)
-    retcode = output.wait()
-    pipe = output.communicate()
-    log.debug("Return code: %s, stdout: %s", retcode, pipe)
 
-    if os.path.getsize(target_file) == 0:
-        raise RuntimeError("Got empty file, something bad happaned")
+def reflink(src, dst):
+    """
+        Copy on write clone of the file (btrfs, xfs, ...)
+
+        @rtype: bool
+        @return: False when file system doesn't support it
+    """
+    output = Popen(['cp', '--reflink=always', str(src), str(dst)], stdout=PIPE, stderr=PIPE)
+    output.communicate()
+    if output.returncode != 0:
+        try:
+            os.remove(dst)
+        except OSError:
+            pass
+        return False
+    return True
+
+
+def link_or_copy(src, dst):
+    """
+        Makes `dst` sharing content with `src` as cheap as file system allows:
+         hard link, reflink, or plain copy. Existing `dst` is replaced,
+         not overwritten, so other links to it keep the old content.
+
+        @rtype: str
+        @return: Used method: "link", "reflink" or "copy"
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+        return "link"
+    except OSError:
+        # e.g. different file systems
+        pass
+    if reflink(src, dst):
+        return "reflink"
+    shutil.copyfile(src, dst)
+    return "copy"
 
 
 def clean_GEO_file(src_path, target_path):
@@ -71,7 +166,8 @@ def geo_folder_name(prefix, uid):
         return prefix + suid[0:-3]  + 'nnn'
 
 
-NCBI_GEO_ROOT = "ftp://ftp.ncbi.nlm.nih.gov/geo"
+# served over https too, which allows range requests
+NCBI_GEO_ROOT = "https://ftp.ncbi.nlm.nih.gov/geo"
 NCBI_GEO_SERIES = NCBI_GEO_ROOT + "/series"
 
 
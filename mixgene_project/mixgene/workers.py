@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+    Starts celery worker for one of the pools declared in
+     `CELERY_WORKER_POOLS` setting (see mixgene.celerysettings)
+
+    Usage:
+        python -m mixgene.workers <pool_name> [extra celery worker options]
+"""
+from __future__ import absolute_import
+
+import os
+import sys
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mixgene.celerysettings')
+
+
+def build_worker_argv(pool_name, pool, extra_args=None):
+    """
+        @type  pool_name: str
+        @type  pool: dict
+        @param pool: Record from `CELERY_WORKER_POOLS`
+
+        @type  extra_args: list of str
+        @param extra_args: Options appended to the generated ones,
+            e.g. "-n r2@%h" to start another worker of the same pool
+
+        @rtype: list of str
+    """
+    argv = [
+        "--loglevel=%s" % pool.get("loglevel", "INFO"),
+        "--queues=%s" % ",".join(pool["queues"]),
+        "--pool=%s" % pool.get("pool", "prefork"),
+        "--concurrency=%s" % pool.get("concurrency", 1),
+        "--hostname=%s@%%h" % pool_name,
+    ]
+    if pool.get("fair"):
+        argv.append("-Ofair")
+    if pool.get("max_tasks_per_child"):
+        argv.append("--maxtasksperchild=%s" % pool["max_tasks_per_child"])
+    argv.extend(extra_args or [])
+    return argv
+
+
+def main(args):
+    from django.conf import settings
+    from mixgene.celery import app
+
+    if not args or args[0] not in settings.CELERY_WORKER_POOLS:
+        sys.stderr.write("Usage: python -m mixgene.workers <%s> [options]\n" %
+                         "|".join(sorted(settings.CELERY_WORKER_POOLS.keys())))
+        return 1
+
+    pool_name = args[0]
+    pool = settings.CELERY_WORKER_POOLS[pool_name]
+    # celery 3.1 has no command line option for prefetch
+    app.conf.CELERYD_PREFETCH_MULTIPLIER = pool.get("prefetch_multiplier", 1)
+    # first element is taken as program name
+    app.worker_main(["worker"] + build_worker_argv(pool_name, pool, args[1:]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -2,4 +2,4 @@
 
 export DJANGO_SETTINGS_MODULE=mixgene.settings
 
-nosetests test/structures.py
+nosetests test/structures.py test/cache.py test/scoring.py test/result_container.py test/scope.py test/blocks_fetch.py test/unit_of_work.py test/block_codec.py test/execution_cache.py test/meta_block.py test/tasks.py test/geo_soft.py test/dataset_cache.py test/cached_file.py test/single_flight.py test/downloader.py
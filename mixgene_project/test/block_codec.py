@@ -0,0 +1,33 @@
+import cPickle as pickle
+import unittest
+
+from webapp import block_codec
+from webapp.block_codec import dumps_block, loads_block
+
+
+class StoredObject(object):
+    def __init__(self, payload):
+        self.payload = payload
+
+
+class TestBlockCodec(unittest.TestCase):
+    def test_small_round_trip(self):
+        data = dumps_block(StoredObject("x" * 10))
+
+        self.assertTrue(data.startswith(block_codec.MAGIC))
+        self.assertEqual(loads_block(data).payload, "x" * 10)
+
+    def test_large_is_compressed(self):
+        payload = "mixgene" * block_codec.COMPRESS_THRESHOLD
+        data = dumps_block(StoredObject(payload))
+
+        self.assertLess(len(data), len(payload) / 10)
+        self.assertEqual(loads_block(data).payload, payload)
+
+    def test_legacy_pickle(self):
+        data = pickle.dumps(StoredObject([1, 2, 3]))
+        self.assertEqual(loads_block(data).payload, [1, 2, 3])
+
+    def test_unknown_version(self):
+        data = block_codec.HEADER.pack(block_codec.MAGIC, block_codec.FORMAT_VERSION + 1, 0)
+        self.assertRaises(ValueError, loads_block, data + pickle.dumps(None))
@@ -0,0 +1,68 @@
+import cPickle as pickle
+import unittest
+
+from redis import StrictRedis
+
+from mixgene.util import CountingStrictRedis, reset_redis_round_trips, \
+    get_redis_round_trips
+from mixgene.redis_helper import ExpKeys
+from webapp.models import Experiment, GET_BLOCKS_CHUNK_SIZE
+
+
+class InMemoryRedis(StrictRedis):
+    """
+        Answers GET/MGET/SET from dict instead of redis server
+    """
+    def __init__(self):
+        super(InMemoryRedis, self).__init__()
+        self.data = {}
+
+    def execute_command(self, *args, **options):
+        command, keys = args[0], args[1:]
+        if command == "SET":
+            self.data[keys[0]] = keys[1]
+            return True
+        if command == "GET":
+            return self.data.get(keys[0])
+        if command == "MGET":
+            return [self.data.get(key) for key in keys]
+        raise NotImplementedError(command)
+
+
+class CountingInMemoryRedis(CountingStrictRedis, InMemoryRedis):
+    pass
+
+
+class BrokenPickle(object):
+    def __reduce__(self):
+        return (int, ("not a number",))
+
+
+class TestGetBlocks(unittest.TestCase):
+    def setUp(self):
+        self.r = CountingInMemoryRedis()
+        self.uuids = ["block%s" % i for i in range(GET_BLOCKS_CHUNK_SIZE / 2)]
+        for uuid in self.uuids:
+            self.r.data[ExpKeys.get_block_key(uuid)] = pickle.dumps({"uuid": uuid})
+        reset_redis_round_trips()
+
+    def test_single_round_trip(self):
+        blocks = Experiment.get_blocks(self.uuids, self.r)
+
+        self.assertEqual(get_redis_round_trips(), 1)
+        self.assertEqual(len(blocks), len(self.uuids))
+        self.assertEqual([block["uuid"] for _, block in blocks], self.uuids)
+        self.assertEqual(dict(blocks)["block3"], {"uuid": "block3"})
+        self.assertEqual(get_redis_round_trips(), 1)
+
+    def test_empty(self):
+        self.assertEqual(list(Experiment.get_blocks([], self.r)), [])
+        self.assertEqual(get_redis_round_trips(), 0)
+
+    def test_lazy_unpickling(self):
+        self.r.data[ExpKeys.get_block_key("broken")] = pickle.dumps(BrokenPickle())
+        blocks = Experiment.get_blocks(["broken"] + self.uuids, self.r)
+
+        self.assertEqual(blocks.get("block1"), {"uuid": "block1"})
+        self.assertEqual(blocks[2], ("block1", {"uuid": "block1"}))
+        self.assertRaises(ValueError, blocks.get, "broken")
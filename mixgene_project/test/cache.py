@@ -0,0 +1,75 @@
+import os
+import unittest
+
+import pandas
+
+from environment.cache import DataCache
+
+
+class TestDataCache(unittest.TestCase):
+    test_filepath = "test/tmp/test_cache.txt"
+
+    def setUp(self):
+        with open(self.test_filepath, "w") as out:
+            out.write("1")
+        self.cache = DataCache(max_bytes=10 ** 6)
+        self.loads = 0
+
+    def loader(self):
+        self.loads += 1
+        return pandas.DataFrame({"a": range(10)})
+
+    def test_hit_returns_shared_read_only(self):
+        df = self.cache.load([self.test_filepath], self.loader)
+        df_2 = self.cache.load([self.test_filepath], self.loader)
+
+        self.assertIs(df, df_2)
+        self.assertFalse(df["a"].values.flags.writeable)
+        self.assertRaises(ValueError, df.values.__setitem__, 0, 1)
+        self.assertEqual(self.loads, 1)
+        self.assertEqual(self.cache.stats()["hits"], 1)
+        self.assertEqual(self.cache.stats()["misses"], 1)
+
+    def test_hit_returns_copy_on_request(self):
+        self.cache.load([self.test_filepath], self.loader)
+        df = self.cache.load([self.test_filepath], self.loader, copy=True)
+        df["a"] = 0
+        df_2 = self.cache.load([self.test_filepath], self.loader)
+
+        self.assertEqual(self.loads, 1)
+        self.assertEqual(df_2["a"].tolist(), range(10))
+
+    def test_mutable_object_is_copied(self):
+        loader = lambda: {"genes": ["A", "B"]}
+        gene_sets = self.cache.load([self.test_filepath], loader)
+        gene_sets["genes"].append("C")
+
+        self.assertEqual(self.cache.load([self.test_filepath], loader)["genes"], ["A", "B"])
+        self.assertEqual(self.cache.get([self.test_filepath])["genes"], ["A", "B"])
+
+    def test_immutable_object_is_shared(self):
+        loader = lambda: (("A", "B"), None)
+        labels = self.cache.load([self.test_filepath], loader)
+        self.assertIs(labels, self.cache.load([self.test_filepath], loader))
+
+    def test_file_change(self):
+        self.cache.load([self.test_filepath], self.loader)
+        with open(self.test_filepath, "w") as out:
+            out.write("22")
+        self.cache.load([self.test_filepath], self.loader)
+
+        self.assertEqual(self.loads, 2)
+
+    def test_eviction(self):
+        self.cache = DataCache(max_bytes=1000)
+        self.cache.load([self.test_filepath], self.loader, key_extra=1, size=600)
+        self.cache.load([self.test_filepath], self.loader, key_extra=2, size=600)
+
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+        self.assertEqual(self.cache.stats()["entries"], 1)
+
+    def tearDown(self):
+        try:
+            os.remove(self.test_filepath)
+        except:
+            pass
@@ -0,0 +1,97 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from mixgene.util import link_or_copy
+from webapp import models
+from webapp.models import CachedFile, select_cache_victims
+
+
+class Entry(object):
+    def __init__(self, name, size, pinned=False):
+        self.name = name
+        self.size = size
+        self.pinned = pinned
+
+
+class TestCacheEviction(unittest.TestCase):
+    def test_lru_skips_pinned(self):
+        entries = [Entry("a", 10, pinned=True), Entry("b", 10), Entry("c", 10), Entry("d", 10)]
+        victims = select_cache_victims(entries, 40, 25, lambda entry: entry.pinned)
+        self.assertEqual([entry.name for entry in victims], ["b", "c"])
+
+    def test_fits_quota(self):
+        entries = [Entry("a", 10), Entry("b", 10)]
+        self.assertEqual(select_cache_victims(entries, 20, 20, lambda entry: False), [])
+
+
+class TestLinkOrCopy(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(dir="test/tmp")
+        self.src = os.path.join(self.tmp_dir, "src")
+        self.dst = os.path.join(self.tmp_dir, "dst")
+        with open(self.src, "w") as out:
+            out.write("data")
+
+    def test_replace_keeps_other_links(self):
+        with open(self.dst, "w") as out:
+            out.write("old")
+        other = os.path.join(self.tmp_dir, "other")
+        os.link(self.dst, other)
+
+        self.assertEqual(link_or_copy(self.src, self.dst), "link")
+        self.assertEqual(open(self.dst).read(), "data")
+        self.assertEqual(open(other).read(), "old")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+
+class FakeManager(object):
+    def __init__(self):
+        self.saved = []
+
+    def filter(self, uri):
+        return [cf for cf in self.saved if cf.uri == uri]
+
+
+class TestUpdateCache(unittest.TestCase):
+    """
+        Database and redis aren't available, so the model is patched
+         to keep saved entries in memory
+    """
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(dir="test/tmp")
+        os.makedirs(os.path.join(self.tmp_dir, "data", "cache"))
+        self.src = os.path.join(self.tmp_dir, "src")
+        with open(self.src, "w") as out:
+            out.write("data")
+
+        self.manager = FakeManager()
+        self.patched = {
+            "objects": CachedFile.__dict__["objects"],
+            "save": CachedFile.__dict__["save"],
+            "evict": CachedFile.__dict__["evict"],
+        }
+        self.media_root = models.MEDIA_ROOT
+        models.MEDIA_ROOT = self.tmp_dir
+        CachedFile.objects = self.manager
+        CachedFile.save = lambda cf: self.manager.saved.append(cf)
+        CachedFile.evict = staticmethod(lambda: 0)
+
+    def test_new_uri(self):
+        CachedFile.update_cache("ftp://example.org/GSE1.soft.gz", self.src)
+
+        self.assertEqual(len(self.manager.saved), 1)
+        cf = self.manager.saved[0]
+        self.assertEqual(cf.uri_sha, CachedFile.get_uri_sha(cf.uri))
+        self.assertTrue(os.path.isfile(cf.get_file_path()))
+        self.assertEqual(open(cf.get_file_path()).read(), "data")
+        self.assertEqual(cf.size, 4)
+
+    def tearDown(self):
+        for name, value in self.patched.iteritems():
+            setattr(CachedFile, name, value)
+        models.MEDIA_ROOT = self.media_root
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
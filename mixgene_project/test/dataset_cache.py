@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import pandas as pd
+import pandas.util.testing as tm
+
+from environment.dataset_cache import GseDatasetCache
+from environment.structures import ExpressionSet, PlatformAnnotation, GS
+
+
+class TestGseDatasetCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(dir="test/tmp")
+        self.cache_root = os.path.join(self.tmp_dir, "cache")
+        self.exp_dir = os.path.join(self.tmp_dir, "exp1")
+        self.other_exp_dir = os.path.join(self.tmp_dir, "exp2")
+        os.mkdir(self.exp_dir)
+        os.mkdir(self.other_exp_dir)
+
+    def build_structures(self):
+        es = ExpressionSet(self.exp_dir, "block1_es")
+        self.assay_df = pd.DataFrame([[1.0, 2.0], [3.0, 4.0]],
+                                     index=["p1", "p2"], columns=["GSM1", "GSM2"])
+        es.store_assay_data_frame(self.assay_df)
+        es.store_pheno_data_frame(pd.DataFrame({"User_class": ["", ""]}, index=["GSM1", "GSM2"]))
+
+        ann = PlatformAnnotation("GPL1", self.exp_dir, "block1_annotation")
+        gs = GS()
+        gs.description["p1"] = ""
+        gs.genes["p1"] = ["101"]
+        ann.gene_sets.store_gs(gs)
+        return es, ann
+
+    def test_store_link(self):
+        cache = GseDatasetCache("gse1", 1, root=self.cache_root)
+        self.assertIsNone(cache.link(self.other_exp_dir, "block2"))
+
+        es, ann = self.build_structures()
+        self.assertTrue(cache.store(es, ann))
+        self.assertTrue(cache.is_ready())
+
+        linked_es, linked_ann = cache.link(self.other_exp_dir, "block2")
+        tm.assert_frame_equal(self.assay_df, linked_es.get_assay_data_frame())
+        self.assertEqual(linked_ann.gene_sets.get_gs().genes["p1"], ["101"])
+        self.assertEqual(linked_ann.name, "GPL1")
+
+        # source experiment keeps own writable files
+        self.assertNotEqual(os.stat(es.assay_data_storage.values_filepath).st_ino,
+                            os.stat(cache.get_file_path("es_assay.values.npy")).st_ino)
+        self.assertTrue(os.access(ann.gene_sets.storage.filepath, os.W_OK))
+
+        # matrix is shared, phenotype is own copy
+        self.assertEqual(os.stat(cache.get_file_path("es_assay.values.npy")).st_ino,
+                         os.stat(linked_es.assay_data_storage.values_filepath).st_ino)
+        self.assertNotEqual(os.stat(cache.get_file_path("es_pheno.csv.gz")).st_ino,
+                            os.stat(linked_es.pheno_data_storage.filepath).st_ino)
+
+        # rewriting linked files replaces them, cached copies stay intact
+        gs = GS()
+        gs.description["p2"] = ""
+        gs.genes["p2"] = ["102"]
+        linked_ann.gene_sets.store_gs(gs)
+        linked_es.store_assay_data_frame(self.assay_df * 2)
+        self.assertTrue(cache.is_ready())
+        relinked_es, relinked_ann = cache.link(self.other_exp_dir, "block3")
+        tm.assert_frame_equal(self.assay_df, relinked_es.get_assay_data_frame())
+        self.assertEqual(relinked_ann.gene_sets.get_gs().genes.keys(), ["p1"])
+
+        # another parser version is a miss
+        self.assertIsNone(GseDatasetCache("GSE1", 2, root=self.cache_root).link(self.other_exp_dir, "b3"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
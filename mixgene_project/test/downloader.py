@@ -0,0 +1,123 @@
+import BaseHTTPServer
+import gzip
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from StringIO import StringIO
+
+from mixgene.downloader import Downloader, DownloadError
+
+
+def build_payload():
+    buf = StringIO()
+    with gzip.GzipFile(fileobj=buf, mode="wb") as out:
+        out.write("".join("line %s\n" % i for i in range(20000)))
+    return buf.getvalue()
+
+PAYLOAD = build_payload()
+
+
+class RangeHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+        Serves PAYLOAD, supports HEAD and single range requests
+    """
+    def log_message(self, *args):
+        pass
+
+    def send_payload_headers(self, code, length, extra=None):
+        self.send_response(code)
+        self.send_header("Content-Length", str(length))
+        if self.server.accept_ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", '"v1"')
+        for name, value in (extra or {}).iteritems():
+            self.send_header(name, value)
+        self.end_headers()
+
+    def do_HEAD(self):
+        self.send_payload_headers(200, len(PAYLOAD))
+
+    def do_GET(self):
+        self.server.requests.append(self.headers.getheader("Range"))
+        range_header = self.headers.getheader("Range")
+        if range_header and self.server.accept_ranges:
+            start, end = map(int, range_header.split("=")[1].split("-"))
+            if self.server.fail_from is not None and start >= self.server.fail_from:
+                self.send_error(404)
+                return
+            data = PAYLOAD[start:end + 1]
+            self.send_payload_headers(206, len(data), {
+                "Content-Range": "bytes %s-%s/%s" % (start, end, len(PAYLOAD))
+            })
+        else:
+            data = PAYLOAD
+            self.send_payload_headers(200, len(data))
+        self.wfile.write(data)
+
+
+class TestDownloader(unittest.TestCase):
+    chunk_size = 16 * 1024
+
+    def setUp(self):
+        self.server = BaseHTTPServer.HTTPServer(("127.0.0.1", 0), RangeHandler)
+        self.server.accept_ranges = True
+        self.server.fail_from = None
+        self.server.requests = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+        self.url = "http://127.0.0.1:%s/GSE1_family.soft.gz" % self.server.server_port
+        self.tmp_dir = tempfile.mkdtemp(dir="test/tmp")
+        self.target = os.path.join(self.tmp_dir, "GSE1_family.soft.gz")
+
+    def build_downloader(self, **kwargs):
+        return Downloader(self.url, self.target, chunk_size=self.chunk_size,
+                          threads=3, retries=1, **kwargs)
+
+    def test_parallel_ranges(self):
+        progress = []
+        self.build_downloader(
+            expected_md5=hashlib.md5(PAYLOAD).hexdigest(),
+            on_progress=lambda done, total: progress.append((done, total))
+        ).download()
+
+        self.assertEqual(open(self.target, "rb").read(), PAYLOAD)
+        chunks_num = (len(PAYLOAD) + self.chunk_size - 1) / self.chunk_size
+        self.assertEqual(len(self.server.requests), chunks_num)
+        self.assertEqual(progress[-1], (len(PAYLOAD), len(PAYLOAD)))
+        self.assertFalse(os.path.exists(self.target + ".part.json"))
+
+    def test_resume(self):
+        self.server.fail_from = self.chunk_size * 2
+        self.assertRaises(DownloadError, self.build_downloader().download)
+        self.assertTrue(os.path.exists(self.target + ".part.json"))
+
+        self.server.fail_from = None
+        self.server.requests = []
+        self.build_downloader().download()
+
+        self.assertEqual(open(self.target, "rb").read(), PAYLOAD)
+        fetched_starts = [int(header.split("=")[1].split("-")[0])
+                          for header in self.server.requests]
+        self.assertTrue(all(start >= self.chunk_size * 2 for start in fetched_starts))
+
+    def test_stream_without_ranges(self):
+        self.server.accept_ranges = False
+        self.build_downloader().download()
+
+        self.assertEqual(open(self.target, "rb").read(), PAYLOAD)
+        self.assertEqual(self.server.requests, [None])
+
+    def test_checksum_mismatch(self):
+        self.assertRaises(DownloadError, self.build_downloader(expected_md5="0" * 32).download)
+        self.assertFalse(os.path.exists(self.target))
+        self.assertFalse(os.path.exists(self.target + ".part"))
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
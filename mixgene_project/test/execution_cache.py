@@ -0,0 +1,189 @@
+import unittest
+
+from webapp.models import Experiment
+from webapp.scope import BlockState, ScopeVar
+from workflow.blocks.fields import ParamField, InputType, FieldType
+from workflow.blocks.generic import GenericBlock
+from workflow.blocks.managers import IteratedInnerFieldManager
+from workflow.blocks.meta_block import UniformMetaBlock
+
+
+class FakeProcessingBlock(GenericBlock):
+    is_abstract = True
+    is_block_supports_auto_execution = True
+
+    threshold = ParamField("threshold", title="Threshold",
+                           input_type=InputType.TEXT, field_type=FieldType.FLOAT,
+                           init_val=0.5)
+
+
+class FakeMetaBlock(UniformMetaBlock):
+    is_abstract = True
+
+    def get_fold_labels(self):
+        return []
+
+
+def make_block(cls, uuid, scope_name, **kwargs):
+    """
+        Block constructor registers outputs in redis scope, so only
+         fields used by fingerprints are set here
+    """
+    block = cls.__new__(cls)
+    block.uuid = uuid
+    block.base_name = uuid
+    block.scope_name = scope_name
+    block.bound_inputs = {}
+    for p_name, param in cls._block_serializer.params.iteritems():
+        setattr(block, p_name, param.init_val)
+    block.__dict__.update(kwargs)
+    return block
+
+
+class FakeExperiment(object):
+    def __init__(self):
+        self.blocks = {}
+        self.fingerprints = {}
+
+    def add_block(self, block):
+        self.blocks[block.uuid] = block
+
+    def get_block(self, block_uuid):
+        return self.blocks[block_uuid]
+
+    def get_block_states(self, block_uuid_list):
+        return {
+            block_uuid: BlockState(
+                block_uuid,
+                scope_name=self.blocks[block_uuid].scope_name,
+                create_new_scope=self.blocks[block_uuid].create_new_scope)
+            for block_uuid in block_uuid_list
+        }
+
+    def get_execution_fingerprints(self, block_uuid_list):
+        return {
+            block_uuid: self.fingerprints[block_uuid]
+            for block_uuid in block_uuid_list
+            if block_uuid in self.fingerprints
+        }
+
+
+class FakePipeline(object):
+    def __init__(self, r):
+        self.r = r
+        self.commands = []
+
+    def __getattr__(self, name):
+        def command(*args):
+            self.commands.append((name, args))
+        return command
+
+    def execute(self):
+        return [getattr(self.r, name)(*args) for name, args in self.commands]
+
+
+class FakeRedis(object):
+    def __init__(self):
+        self.hashes = {}
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    def hset(self, key, field, value):
+        self.hashes.setdefault(key, {})[field] = value
+
+    def hget(self, key, field):
+        return self.hashes.get(key, {}).get(field)
+
+    def hdel(self, key, field):
+        return int(self.hashes.get(key, {}).pop(field, None) is not None)
+
+    def sadd(self, key, *values):
+        pass
+
+
+class TestExecutionFingerprint(unittest.TestCase):
+    def setUp(self):
+        self.exp = FakeExperiment()
+
+        self.source = make_block(FakeProcessingBlock, "B1", "root")
+        self.exp.add_block(self.source)
+        self.exp.fingerprints[self.source.uuid] = "source_v1"
+
+        self.block = make_block(FakeProcessingBlock, "B2", "root")
+        self.block.bound_inputs["es"] = ScopeVar(self.source.uuid, "es")
+        self.exp.add_block(self.block)
+
+    def test_follows_producer_and_params(self):
+        fingerprint = self.block.get_execution_fingerprint(self.exp)
+        self.assertIsNotNone(fingerprint)
+        self.assertEqual(fingerprint, self.block.get_execution_fingerprint(self.exp))
+
+        self.exp.fingerprints[self.source.uuid] = "source_v2"
+        changed_input = self.block.get_execution_fingerprint(self.exp)
+        self.assertNotEqual(fingerprint, changed_input)
+
+        self.block.threshold = 0.1
+        self.assertNotEqual(changed_input, self.block.get_execution_fingerprint(self.exp))
+
+    def test_producer_without_result(self):
+        del self.exp.fingerprints[self.source.uuid]
+        self.assertIsNone(self.block.get_execution_fingerprint(self.exp))
+
+    def test_disabled_cache(self):
+        self.block.use_execution_cache = False
+        self.assertIsNone(self.block.get_execution_fingerprint(self.exp))
+
+
+class TestInnerOutputFingerprint(unittest.TestCase):
+    def setUp(self):
+        self.exp = FakeExperiment()
+
+        self.meta = make_block(FakeMetaBlock, "B1", "root",
+                               sub_scope_name="root_B1",
+                               folds_fingerprint="folds_v1",
+                               inner_output_manager=IteratedInnerFieldManager())
+        self.meta.inner_output_manager.iterator = 0
+        self.exp.add_block(self.meta)
+
+        self.inner = make_block(FakeProcessingBlock, "B2", "root_B1")
+        self.inner.bound_inputs["es"] = ScopeVar(self.meta.uuid, "es_train")
+        self.exp.add_block(self.inner)
+
+    def test_follows_folds_generation(self):
+        # stored result of the previous meta block execution isn't used
+        self.exp.fingerprints[self.meta.uuid] = "volatile"
+        fingerprint = self.inner.get_execution_fingerprint(self.exp)
+        self.assertIsNotNone(fingerprint)
+
+        self.meta.folds_fingerprint = "folds_v2"
+        self.assertNotEqual(fingerprint, self.inner.get_execution_fingerprint(self.exp))
+
+    def test_follows_fold(self):
+        fingerprint = self.inner.get_execution_fingerprint(self.exp)
+        self.meta.inner_output_manager.iterator = 1
+        self.assertNotEqual(fingerprint, self.inner.get_execution_fingerprint(self.exp))
+
+        concurrent = ScopeVar(self.meta.uuid, "es_train", fold_idx=1)
+        self.assertEqual(self.meta.get_inner_output_fingerprint(concurrent),
+                         self.meta.get_inner_output_fingerprint(self.inner.bound_inputs["es"]))
+
+    def test_unknown_folds(self):
+        self.meta.folds_fingerprint = None
+        self.assertIsNone(self.inner.get_execution_fingerprint(self.exp))
+
+
+class TestExecutionResult(unittest.TestCase):
+    def setUp(self):
+        self.r = FakeRedis()
+        self.exp = Experiment(pk=1)
+
+    def test_reuse_and_clear(self):
+        self.exp.store_execution_result("B1", "fp", {"result": 1}, redis_instance=self.r)
+
+        self.assertEqual(self.exp.load_execution_result("B1", "fp", redis_instance=self.r),
+                         {"result": 1})
+        self.assertIsNone(self.exp.load_execution_result("B1", "other", redis_instance=self.r))
+
+        self.exp.clear_execution_result("B1", redis_instance=self.r)
+        self.assertIsNone(self.exp.load_execution_result("B1", "fp", redis_instance=self.r))
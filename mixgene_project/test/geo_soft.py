@@ -0,0 +1,74 @@
+import unittest
+
+import numpy as np
+
+from converters.geo_soft import GseSoftReader
+
+SOFT_LINES = """^DATABASE = GeoMiame
+!Database_name = Gene Expression Omnibus (GEO)
+^SERIES = GSE1
+!Series_title = Test series
+!Series_sample_id = GSM1
+!Series_sample_id = GSM2
+^PLATFORM = GPL1
+!Platform_title = Test platform
+#ID = Probe id
+#ENTREZ_GENE_ID = Entrez gene
+!platform_table_begin
+ID\tSEQUENCE\tENTREZ_GENE_ID
+p1\tACGT\t101
+p2\tACGT\t102 /// 103
+p3\tACGT\t
+!platform_table_end
+^SAMPLE = GSM1
+!Sample_geo_accession = GSM1
+!Sample_characteristics_ch1 = age: 10
+!Sample_characteristics_ch1 = sex: F
+!sample_table_begin
+ID_REF\tVALUE
+p2\t2.5
+p1\t1.5
+p3\tnull
+!sample_table_end
+^SAMPLE = GSM2
+!Sample_geo_accession = GSM2
+!Sample_characteristics_ch1 = age: 20
+!Sample_characteristics_ch1 = sex: M
+!sample_table_begin
+ID_REF\tVALUE
+p1\t3
+p4\t7
+!sample_table_end
+""".splitlines(True)
+
+
+class TestGseSoftReader(unittest.TestCase):
+    def test_read(self):
+        soft = GseSoftReader().read(SOFT_LINES)
+
+        self.assertEqual(soft.platform.probes, ["p1", "p2", "p3"])
+        self.assertEqual(soft.platform.get_column("ENTREZ_GENE_ID"), ["101", "102 /// 103", ""])
+        self.assertEqual(soft.sample_ids, ["GSM1", "GSM2"])
+        self.assertEqual(soft.sample_attributes[1]["Sample_characteristics_ch1"],
+                         ["age: 20", "sex: M"])
+        self.assertEqual(soft.unknown_probes_count, 1)
+
+        assay = soft.get_assay_array()
+        self.assertEqual(assay.shape, (3, 2))
+        np.testing.assert_array_equal(assay, [[1.5, 3], [2.5, np.nan], [np.nan, np.nan]])
+
+        df = soft.get_assay_data_frame()
+        self.assertEqual(df.index.tolist(), ["p1", "p2", "p3"])
+        self.assertEqual(df.columns.tolist(), ["GSM1", "GSM2"])
+
+    def test_grow_undeclared_samples(self):
+        lines = [line for line in SOFT_LINES if not line.startswith("!Series_sample_id")]
+        extra = "^SAMPLE = GSM%s\n!sample_table_begin\nID_REF\tVALUE\np1\t%s\n!sample_table_end\n"
+        for idx in range(3, 40):
+            lines.extend((extra % (idx, idx)).splitlines(True))
+
+        soft = GseSoftReader().read(lines)
+        assay = soft.get_assay_array()
+        self.assertEqual(assay.shape, (3, 39))
+        self.assertTrue(assay.flags.c_contiguous)
+        self.assertEqual(assay[0, 38], 39)
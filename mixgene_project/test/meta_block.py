@@ -0,0 +1,336 @@
+from contextlib import contextmanager
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from environment.structures import ClassifierResult
+from mixgene.redis_helper import ExpKeys
+from webapp.block_codec import dumps_block, loads_block
+from webapp.models import FetchedBlocks
+from webapp.scope import BlockState, ScopeVar
+from workflow.blocks import meta_block
+from workflow.blocks.fields import FieldType, OutputBlockField
+from workflow.blocks.generic import GenericBlock
+from workflow.blocks.meta_block import UniformMetaBlock
+
+
+class FakeScope(object):
+    def load(self, *args, **kwargs):
+        pass
+
+    def store(self, *args, **kwargs):
+        pass
+
+    def register_variable(self, scope_var):
+        pass
+
+    def get_parent_scope_list(self):
+        return []
+
+
+class FakeFoldBlock(GenericBlock):
+    is_abstract = True
+    is_block_supports_auto_execution = True
+
+    _result = OutputBlockField(name="result", provided_data_type="ClassifierResult",
+                               field_type=FieldType.HIDDEN, init_val=None)
+
+    def get_scope(self):
+        return FakeScope()
+
+    def do_action(self, action_name, exp, *args, **kwargs):
+        exp.actions.append((self.uuid, action_name))
+        self.state = "ready"
+        exp.store_block(self)
+
+
+class FakeMetaBlock(UniformMetaBlock):
+    is_abstract = True
+    block_base_name = "FAKE_META"
+
+    def get_fold_labels(self):
+        return ["fold_%s" % idx for idx in range(len(self.inner_output_manager.sequence))]
+
+    def get_scope(self):
+        return FakeScope()
+
+    def reset_execution_for_sub_blocks(self):
+        pass
+
+    def do_action(self, action_name, exp, *args, **kwargs):
+        exp.actions.append((self.uuid, action_name))
+        if action_name == "success":
+            self.state = "done"
+        exp.store_block(self)
+
+
+class FakePipeline(object):
+    def __init__(self, r):
+        self.r = r
+        self.commands = []
+
+    def __getattr__(self, name):
+        def command(*args):
+            self.commands.append((name, args))
+        return command
+
+    def execute(self):
+        return [getattr(self.r, name)(*args) for name, args in self.commands]
+
+
+class FakeRedis(object):
+    def __init__(self):
+        self.data = {}
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value):
+        self.data[key] = value
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def hset(self, key, field, value):
+        self.data.setdefault(key, {})[field] = value
+
+    def hdel(self, key, field):
+        self.data.get(key, {}).pop(field, None)
+
+    def hincrby(self, key, field, amount):
+        self.data.setdefault(key, {})
+        self.data[key][field] = self.data[key].get(field, 0) + amount
+
+    def sadd(self, key, *values):
+        self.data.setdefault(key, set()).update(values)
+
+    def srem(self, key, *values):
+        self.data.get(key, set()).difference_update(values)
+
+    def smembers(self, key):
+        return set(self.data.get(key, set()))
+
+
+class FakeExperiment(object):
+    pk = 1
+
+    def __init__(self, r, data_folder):
+        self.r = r
+        self.data_folder = data_folder
+        self.actions = []
+
+    def get_data_folder(self):
+        return self.data_folder
+
+    def store_block(self, block, new_block=False, redis_instance=None):
+        self.r.set(ExpKeys.get_block_key(block.uuid), dumps_block(block))
+
+    def get_block(self, block_uuid, redis_instance=None):
+        return loads_block(self.r.get(ExpKeys.get_block_key(block_uuid)))
+
+    def get_blocks(self, block_uuid_list, redis_instance=None):
+        block_uuid_list = list(block_uuid_list)
+        return FetchedBlocks(block_uuid_list, [
+            self.r.get(ExpKeys.get_block_key(block_uuid)) for block_uuid in block_uuid_list
+        ])
+
+    def get_block_states(self, block_uuid_list, redis_instance=None):
+        return {
+            block_uuid: BlockState.from_block(block)
+            for block_uuid, block in self.get_blocks(block_uuid_list)
+        }
+
+
+class FakeTask(object):
+    def __init__(self):
+        self.started_scopes = []
+
+    def s(self, exp_id, scope_name):
+        task = self
+
+        class Signature(object):
+            def apply_async(self):
+                task.started_scopes.append(scope_name)
+        return Signature()
+
+
+class FakeScopeRunner(object):
+    executed_scopes = []
+
+    def __init__(self, exp, scope_name):
+        self.scope_name = scope_name
+
+    def execute(self):
+        FakeScopeRunner.executed_scopes.append(self.scope_name)
+
+
+@contextmanager
+def fake_lock(redis_instance, lock_key):
+    yield
+
+
+class TestConcurrentFolds(unittest.TestCase):
+    folds_num = 3
+
+    def setUp(self):
+        self.r = FakeRedis()
+        self.task = FakeTask()
+        FakeScopeRunner.executed_scopes = []
+        self.patched = {
+            "get_redis_instance": meta_block.get_redis_instance,
+            "auto_exec_task": meta_block.auto_exec_task,
+            "exclusive_lock": meta_block.exclusive_lock,
+            "ScopeRunner": meta_block.ScopeRunner,
+        }
+        meta_block.get_redis_instance = lambda: self.r
+        meta_block.auto_exec_task = self.task
+        meta_block.exclusive_lock = fake_lock
+        meta_block.ScopeRunner = FakeScopeRunner
+
+        self.tmp_dir = tempfile.mkdtemp(dir="test/tmp")
+        self.exp = FakeExperiment(self.r, self.tmp_dir)
+
+        self.meta = FakeMetaBlock(exp_id=self.exp.pk, scope_name="root")
+        self.meta.uuid = "M"
+        self.meta.base_name = "cv"
+        self.meta.state = "sub_scope_executing"
+        self.meta.max_parallel_folds = 2
+        self.meta.inner_output_manager.sequence = [
+            {"es_train": "train_%s" % idx} for idx in range(self.folds_num)]
+        self.meta.inner_output_manager.next()
+        self.meta.res_seq.sequence = [{"__label__": label}
+                                      for label in self.meta.get_fold_labels()]
+
+        self.child = FakeFoldBlock(exp_id=self.exp.pk, scope_name=self.meta.sub_scope_name)
+        self.child.uuid = "C"
+        self.child.state = "ready"
+        self.child.bound_inputs["es"] = ScopeVar(self.meta.uuid, "es_train")
+        self.meta.children_blocks = [self.child.uuid]
+
+        self.meta.collector_spec.register(
+            "result", ScopeVar(self.child.uuid, "result", "ClassifierResult"))
+        self.meta.update_res_seq_fields()
+
+        self.exp.store_block(self.meta)
+        self.exp.store_block(self.child)
+
+    def tearDown(self):
+        for name, value in self.patched.iteritems():
+            setattr(meta_block, name, value)
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def finish_fold(self, fold_idx):
+        """
+            Marks copy of the child block as done with result unique for the fold
+        """
+        fold_block = self.exp.get_block(self.meta.get_fold_block_uuid(self.child.uuid, fold_idx))
+        cr = ClassifierResult("", "")
+        cr.y_true = np.array([fold_idx, 1])
+        cr.y_predicted = np.array([fold_idx, 0])
+        fold_block.set_out_var("result", cr)
+        fold_block.state = "done"
+        self.exp.store_block(fold_block)
+
+        self.exp.get_block(self.meta.uuid).on_fold_scope_done(
+            self.exp, self.meta.get_fold_scope_name(fold_idx))
+
+    def fold_block_keys(self):
+        return [key for key in self.r.data
+                if key.startswith(ExpKeys.get_block_key("C_f"))]
+
+    def test_fold_copies(self):
+        self.meta.run_sub_scope(self.exp)
+
+        fold_block = self.exp.get_block("C_f1")
+        self.assertEqual(fold_block.scope_name, "root_M_fold1")
+        self.assertEqual(fold_block.bound_inputs["es"].fold_idx, 1)
+        self.assertIn(("C_f1", "reset_execution"), self.exp.actions)
+        # original block is left untouched
+        self.assertIsNone(self.exp.get_block("C").bound_inputs["es"].fold_idx)
+
+    def test_pending_fold_starts_when_slot_frees(self):
+        self.meta.run_sub_scope(self.exp)
+        self.assertEqual(self.task.started_scopes, ["root_M_fold0", "root_M_fold1"])
+
+        self.finish_fold(1)
+        self.assertEqual(self.task.started_scopes,
+                         ["root_M_fold0", "root_M_fold1", "root_M_fold2"])
+        self.assertEqual(self.exp.get_block(self.meta.uuid).next_fold_idx, 3)
+
+        # repeated notification of the same fold is ignored
+        self.finish_fold(1)
+        self.assertEqual(len(self.task.started_scopes), 3)
+        self.assertEqual(self.exp.get_block(self.meta.uuid).folds_done, [1])
+
+    def test_ordered_collection(self):
+        self.meta.run_sub_scope(self.exp)
+        for fold_idx in [1, 2, 0]:
+            self.finish_fold(fold_idx)
+
+        meta = self.exp.get_block(self.meta.uuid)
+        self.assertEqual(meta.state, "done")
+        self.assertEqual([cell["__label__"] for cell in meta.res_seq.sequence],
+                         ["fold_0", "fold_1", "fold_2"])
+        self.assertEqual([cell["result"].y_true[0] for cell in meta.res_seq.sequence],
+                         [0, 1, 2])
+
+        rc = meta.get_out_var("results_container")
+        rc.load()
+        packed = rc.get_packed_labels()
+        fold_dim = rc.get_axis_dim("cv")
+        self.assertEqual(rc.labels_dict["cv"], ["fold_0", "fold_1", "fold_2"])
+        for fold_idx in range(self.folds_num):
+            cell_idx = rc.cell_index().take([fold_idx], axis=fold_dim).ravel()[0]
+            self.assertEqual(packed.cell(cell_idx)[0][0], fold_idx)
+
+    def test_cleanup_on_completion(self):
+        self.meta.run_sub_scope(self.exp)
+        self.finish_fold(0)
+        self.finish_fold(1)
+        self.assertEqual(len(self.fold_block_keys()), 3)
+
+        self.finish_fold(2)
+        self.assertEqual(self.fold_block_keys(), [])
+        self.assertEqual(self.r.data[ExpKeys.get_scope_creating_block_uuid_keys(1)], {})
+        for fold_idx in range(self.folds_num):
+            scope_name = self.meta.get_fold_scope_name(fold_idx)
+            self.assertNotIn(ExpKeys.get_scope_blocks_key(1, scope_name), self.r.data)
+            # cached DAGs of fold scopes are outdated
+            self.assertEqual(
+                self.r.data[ExpKeys.get_scope_dag_versions_key(1)][scope_name], 2)
+        self.assertEqual(self.exp.get_block(self.meta.uuid).fold_scopes, [])
+        self.assertEqual(self.r.smembers(ExpKeys.get_all_exp_keys_key(1)), set())
+
+    def test_cleanup_on_reset(self):
+        self.meta.run_sub_scope(self.exp)
+        self.assertEqual(len(self.fold_block_keys()), 2)
+
+        meta = self.exp.get_block(self.meta.uuid)
+        meta.reset_execution(self.exp)
+        self.assertEqual(self.fold_block_keys(), [])
+        self.assertEqual(self.r.data[ExpKeys.get_scope_creating_block_uuid_keys(1)], {})
+        self.assertEqual(self.r.smembers(ExpKeys.get_all_exp_keys_key(1)), set())
+
+    def test_sequential_mode(self):
+        self.meta.max_parallel_folds = 1
+        self.assertFalse(self.meta.is_concurrent_mode(self.exp))
+
+        self.meta.run_sub_scope(self.exp)
+        self.assertEqual(FakeScopeRunner.executed_scopes, [self.meta.sub_scope_name])
+        self.assertEqual(self.task.started_scopes, [])
+        self.assertEqual(self.fold_block_keys(), [])
+
+    def test_missing_fold_block(self):
+        self.meta.collector_spec.register(
+            "other", ScopeVar("X", "result", "ClassifierResult"))
+        self.exp.store_block(self.meta)
+        self.meta.run_sub_scope(self.exp)
+
+        with self.assertRaises(RuntimeError) as cm:
+            self.finish_fold(0)
+        self.assertIn("no copy of block X", str(cm.exception))
@@ -0,0 +1,156 @@
+import cPickle as pickle
+import gzip
+import os
+import unittest
+
+import numpy as np
+
+from environment.result_container import ResultsContainer
+from environment.structures import ClassifierResult
+
+
+class TestResultsContainer(unittest.TestCase):
+    base_dir = "test/tmp"
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.cells = np.empty((2, 3), dtype=object)
+        sub_rcs = []
+        for fold in range(3):
+            rc = ResultsContainer("", "")
+            rc.axis_list = ["classifiers"]
+            rc.labels_dict["classifiers"] = ["svm", "dt"]
+            rc.update_label_index()
+            rc.init_ar()
+            for cl in range(2):
+                cr = ClassifierResult("", "")
+                cr.y_true = rng.randint(0, 2, 10)
+                cr.y_predicted = rng.randint(0, 2, 10)
+                rc.ar[cl] = cr
+                self.cells[cl, fold] = cr
+            sub_rcs.append(rc)
+
+        self.rc = ResultsContainer(self.base_dir, "test_rc")
+        self.rc.add_dim_layer(sub_rcs, "folds", ["f1", "f2", "f3"])
+
+    def test_aggregate(self):
+        agg = self.rc.aggregate_prediction_vectors(["classifiers"])
+
+        self.assertEqual(agg.shape, (2,))
+        self.assertEqual(agg[1].y_true.tolist(), np.concatenate(
+            [self.cells[1, fold].y_true for fold in range(3)]).tolist())
+
+        agg = self.rc.aggregate_prediction_vectors(["folds", "classifiers"])
+        self.assertEqual(agg[2, 0].y_predicted.tolist(),
+                         self.cells[0, 2].y_predicted.tolist())
+
+    def test_store_load(self):
+        self.rc.store()
+        rc = ResultsContainer(self.base_dir, "test_rc")
+        rc.load()
+
+        self.assertEqual(rc.shape, (2, 3))
+        self.assertEqual(rc.get_packed_labels().y_true.tolist(),
+                         self.rc.get_packed_labels().y_true.tolist())
+        self.assertEqual(len(rc.get_flat_list_by_metric("accuracy")), 6)
+
+    def test_score_cache(self):
+        self.rc.store()
+        expected = self.rc.compute_score(["folds", "classifiers"], "accuracy")
+
+        rc = ResultsContainer(self.base_dir, "test_rc")
+        transposed = rc.compute_score(["classifiers", "folds"], "accuracy")
+        self.assertEqual(rc.version, self.rc.version)
+        self.assertIn((frozenset(["classifiers", "folds"]), "accuracy"), rc.score_cache)
+        self.assertTrue(np.allclose(expected.T, transposed))
+
+        self.rc.store()
+        self.assertFalse(os.path.exists(self.rc.scores_filepath))
+
+    def test_legacy_load(self):
+        with gzip.open(self.rc.filepath, "w") as out:
+            pickle.dump({
+                "ar": self.cells.tolist(),
+                "axis_list": self.rc.axis_list,
+                "labels_dict": self.rc.labels_dict,
+            }, out, 2)
+
+        rc = ResultsContainer(self.base_dir, "test_rc")
+        rc.load()
+        self.assertEqual(rc.get_packed_labels().y_true.tolist(),
+                         self.rc.get_packed_labels().y_true.tolist())
+
+    def test_legacy_pickled_scores(self):
+        # containers pickled within blocks before packed layout
+        with gzip.open(self.rc.filepath, "w") as out:
+            pickle.dump({
+                "ar": self.cells.tolist(),
+                "axis_list": self.rc.axis_list,
+                "labels_dict": self.rc.labels_dict,
+            }, out, 2)
+        expected = self.rc.compute_score(["classifiers"], "accuracy")
+
+        for ar in [self.cells, np.empty(shape=(), dtype=object)]:
+            rc = ResultsContainer.__new__(ResultsContainer)
+            rc.__setstate__({
+                "base_dir": self.base_dir,
+                "base_filename": "test_rc",
+                "filepath": self.rc.filepath,
+                "ar": ar,
+                "axis_list": self.rc.axis_list,
+                "labels_dict": self.rc.labels_dict,
+            })
+            rc.update_label_index()
+            self.assertTrue(np.allclose(rc.compute_score(["classifiers"], "accuracy"), expected))
+            self.assertEqual(rc.get_pandas_slice("folds", ["classifiers"], "accuracy").shape,
+                             (2, 3))
+        # legacy file has no version to validate scores against
+        self.assertFalse(os.path.exists(self.rc.scores_filepath))
+
+    def test_add_smaller_layer(self):
+        small = ResultsContainer("", "")
+        small.axis_list = ["classifiers"]
+        small.labels_dict["classifiers"] = ["svm"]
+        small.update_label_index()
+        small.init_ar()
+        small.ar[0] = self.cells[0, 0]
+
+        full = ResultsContainer("", "")
+        full.axis_list = ["classifiers"]
+        full.labels_dict["classifiers"] = ["svm", "dt"]
+        full.update_label_index()
+        full.init_ar()
+        full.ar[0], full.ar[1] = self.cells[0, 1], self.cells[1, 1]
+
+        rc = ResultsContainer(self.base_dir, "test_rc")
+        rc.add_dim_layer([full, small], "folds", ["f1", "f2"])
+
+        self.assertEqual(rc.shape, (2, 2))
+        self.assertEqual(rc.get_packed_labels().cell(1)[0].tolist(),
+                         self.cells[0, 0].y_true.tolist())
+        # cell absent in the smaller container is left empty
+        self.assertEqual(len(rc.get_packed_labels().cell(3)[0]), 0)
+
+    def test_scores_per_instance(self):
+        legacy_state = {
+            "base_dir": self.base_dir,
+            "base_filename": "test_rc",
+            "filepath": self.rc.filepath,
+            "ar": np.empty(shape=(), dtype=object),
+            "axis_list": [],
+            "labels_dict": {},
+        }
+        rcs = []
+        for _ in range(2):
+            rc = ResultsContainer.__new__(ResultsContainer)
+            rc.__setstate__(dict(legacy_state))
+            rcs.append(rc)
+        rcs[0].scores["accuracy"] = np.zeros(1)
+        self.assertNotIn("accuracy", rcs[1].scores)
+
+    def tearDown(self):
+        for filepath in [self.rc.filepath, self.rc.scores_filepath]:
+            try:
+                os.remove(filepath)
+            except:
+                pass
@@ -0,0 +1,252 @@
+import unittest
+
+from mixgene.redis_helper import ExpKeys
+from webapp import scope
+from webapp.scope import DAG, BlockState, ScopeRunner, \
+    ACQUIRE_SLOT_SCRIPT, RELEASE_SLOT_SCRIPT, acquire_execution_slot
+from workflow.blocks import generic
+from workflow.blocks.fields import ActionsList
+from workflow.blocks.generic import GenericBlock, execute_block_actions_list
+
+
+class TestDAG(unittest.TestCase):
+    def test_topological_order(self):
+        dag = DAG.from_deps({
+            "a": [],
+            "b": ["a"],
+            "c": ["a", "b"],
+            "d": ["c"],
+        })
+        self.assertEqual(dag.topological_order, ["a", "b", "c", "d"])
+        self.assertEqual(dag.roots, set(["a"]))
+
+    def test_deep_chain(self):
+        # recursive sort used to hit recursion limit here
+        size = 20000
+        deps = {i: [i - 1] for i in range(1, size)}
+        deps[0] = []
+        dag = DAG.from_deps(deps)
+        self.assertEqual(dag.topological_order, range(size))
+
+    def test_loop(self):
+        deps = {"a": [], "b": ["a", "d"], "c": ["b"], "d": ["c"]}
+        with self.assertRaises(RuntimeError) as cm:
+            DAG.from_deps(deps)
+        self.assertIn("b, c, d", str(cm.exception))
+
+
+class TestBlockState(unittest.TestCase):
+    def test_json_round_trip(self):
+        state = BlockState("uuid1", state="ready", exec_status="ready",
+                           scope_name="root", sub_scope_name="root_uuid1",
+                           create_new_scope=True,
+                           is_block_supports_auto_execution=True)
+        restored = BlockState.from_json("uuid1", state.to_json())
+
+        for field in BlockState.fields:
+            self.assertEqual(getattr(state, field), getattr(restored, field))
+        self.assertEqual(restored.get_exec_status(), "ready")
+
+
+class SlotsRedis(object):
+    """
+        Sets with python versions of the slot scripts, lua isn't available
+         without redis server
+    """
+    def __init__(self):
+        self.sets = {}
+
+    def smembers(self, key):
+        return set(self.sets.get(key, set()))
+
+    def eval(self, script, numkeys, *keys_and_args):
+        keys, args = keys_and_args[:numkeys], keys_and_args[numkeys:]
+        exp_running, scope_running, waiting = [self.sets.setdefault(key, set()) for key in keys]
+        if script == ACQUIRE_SLOT_SCRIPT:
+            block_uuid, max_per_exp, max_per_scope, scope_name = args
+            if block_uuid in exp_running:
+                return 1
+            if len(exp_running) >= int(max_per_exp) or len(scope_running) >= int(max_per_scope):
+                waiting.add(scope_name)
+                return 0
+            exp_running.add(block_uuid)
+            scope_running.add(block_uuid)
+            return 1
+        if script == RELEASE_SLOT_SCRIPT:
+            block_uuid, = args
+            if block_uuid not in exp_running:
+                return []
+            exp_running.discard(block_uuid)
+            scope_running.discard(block_uuid)
+            result = list(waiting)
+            waiting.clear()
+            return result
+        raise NotImplementedError(script)
+
+
+class FakeScope(object):
+    def load(self, *args, **kwargs):
+        pass
+
+    def store(self, *args, **kwargs):
+        pass
+
+    def register_variable(self, scope_var):
+        pass
+
+    def get_parent_scope_list(self):
+        return []
+
+
+class FakeRunningBlock(GenericBlock):
+    is_abstract = True
+    is_block_supports_auto_execution = True
+    use_execution_cache = False
+
+    _block_actions = ActionsList([])
+    _block_actions.extend(execute_block_actions_list)
+
+    def get_scope(self):
+        return FakeScope()
+
+    def execute(self, exp, *args, **kwargs):
+        exp.executed.append(self.uuid)
+
+    def success(self, exp, *args, **kwargs):
+        pass
+
+
+class FakeMetaBlock(FakeRunningBlock):
+    is_abstract = True
+    create_new_scope = True
+
+
+class FakeExperiment(object):
+    pk = 1
+
+    def __init__(self):
+        self.executed = []
+
+    def store_block(self, block, *args, **kwargs):
+        pass
+
+    def clear_execution_result(self, block_uuid):
+        pass
+
+    def store_execution_result(self, block_uuid, fingerprint, out_data=None):
+        pass
+
+
+class FakeTask(object):
+    def __init__(self):
+        self.started_scopes = []
+
+    def s(self, exp_id, scope_name):
+        task = self
+
+        class Signature(object):
+            def apply_async(self):
+                task.started_scopes.append(scope_name)
+        return Signature()
+
+
+class FakeNotification(object):
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def send(self):
+        pass
+
+
+class TestExecutionSlots(unittest.TestCase):
+    def setUp(self):
+        self.r = SlotsRedis()
+        self.task = FakeTask()
+        self.exp = FakeExperiment()
+        self.patched = [
+            (scope, "get_redis_instance", lambda: self.r),
+            (scope, "get_running_blocks_limits", lambda: (3, 2)),
+            (generic, "auto_exec_task", self.task),
+            (generic, "BlockUpdated", FakeNotification),
+        ]
+        self.originals = [(module, name, getattr(module, name))
+                          for module, name, _ in self.patched]
+        for module, name, value in self.patched:
+            setattr(module, name, value)
+
+    def tearDown(self):
+        for module, name, value in self.originals:
+            setattr(module, name, value)
+
+    def make_block(self, block_uuid, scope_name="root", cls=FakeRunningBlock):
+        block = cls(exp_id=self.exp.pk, scope_name=scope_name)
+        block.uuid = block_uuid
+        block.base_name = block_uuid
+        block.state = "ready"
+        return block
+
+    def running(self, scope_name=None):
+        if scope_name is None:
+            return self.r.smembers(ExpKeys.get_running_blocks_key(self.exp.pk))
+        return self.r.smembers(ExpKeys.get_scope_running_blocks_key(self.exp.pk, scope_name))
+
+    def waiting(self):
+        return self.r.smembers(ExpKeys.get_waiting_scopes_key(self.exp.pk))
+
+    def test_limits(self):
+        self.assertTrue(acquire_execution_slot(1, "root", "a", self.r))
+        self.assertTrue(acquire_execution_slot(1, "root", "b", self.r))
+        # scope limit
+        self.assertFalse(acquire_execution_slot(1, "root", "c", self.r))
+        self.assertTrue(acquire_execution_slot(1, "other", "d", self.r))
+        # experiment limit
+        self.assertFalse(acquire_execution_slot(1, "other", "e", self.r))
+
+        self.assertEqual(self.running(), set(["a", "b", "d"]))
+        self.assertEqual(self.waiting(), set(["root", "other"]))
+
+    def test_acquire_is_idempotent(self):
+        self.assertTrue(acquire_execution_slot(1, "root", "a", self.r))
+        self.assertTrue(acquire_execution_slot(1, "root", "b", self.r))
+        # block already holding a slot isn't stopped by the limit
+        self.assertTrue(acquire_execution_slot(1, "root", "a", self.r))
+        self.assertEqual(self.running("root"), set(["a", "b"]))
+        self.assertEqual(self.waiting(), set())
+
+    def test_dispatch_within_limit(self):
+        blocks = [self.make_block(uuid) for uuid in ["a", "b", "c"]]
+        ScopeRunner(self.exp, "root").dispatch(blocks)
+
+        self.assertEqual(self.exp.executed, ["a", "b"])
+        self.assertEqual(blocks[2].state, "ready")
+        self.assertEqual(self.waiting(), set(["root"]))
+
+    def test_postponed_scope_restarted_on_release(self):
+        scope.get_running_blocks_limits = lambda: (2, 2)
+        blocks = [self.make_block(uuid) for uuid in ["a", "b"]]
+        ScopeRunner(self.exp, "root").dispatch(blocks)
+        ScopeRunner(self.exp, "root_M").dispatch([self.make_block("c", "root_M")])
+        self.assertEqual(self.exp.executed, ["a", "b"])
+        self.assertEqual(self.waiting(), set(["root_M"]))
+
+        blocks[0].do_action("success", self.exp)
+        self.assertIn("root_M", self.task.started_scopes)
+        self.assertEqual(self.running(), set(["b"]))
+        self.assertEqual(self.waiting(), set())
+
+        ScopeRunner(self.exp, "root_M").dispatch([self.make_block("c", "root_M")])
+        self.assertEqual(self.exp.executed, ["a", "b", "c"])
+
+    def test_meta_blocks_dont_use_slots(self):
+        blocks = [self.make_block("m%s" % idx, cls=FakeMetaBlock) for idx in range(3)]
+        ScopeRunner(self.exp, "root").dispatch(blocks)
+
+        self.assertEqual(self.exp.executed, ["m0", "m1", "m2"])
+        self.assertEqual(self.running(), set())
+
+        # leaving working state doesn't free slots of other blocks
+        ScopeRunner(self.exp, "root").dispatch([self.make_block(uuid) for uuid in ["a", "b", "c"]])
+        blocks[0].do_action("success", self.exp)
+        self.assertEqual(self.running(), set(["a", "b"]))
+        # waiting scope is left for the block really holding a slot
+        self.assertEqual(self.waiting(), set(["root"]))
@@ -0,0 +1,51 @@
+import unittest
+
+import numpy as np
+
+from wrappers.scoring import PackedLabels, compute_packed_scores, metrics_dict
+
+
+class TestPackedScores(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.pairs = [
+            (rng.randint(0, 2, 25), rng.randint(0, 2, 25))
+            for _ in range(20)
+        ]
+        # degenerate cells: no predicted positives, all predicted positive
+        self.pairs.append((np.array([0, 1, 1, 0]), np.zeros(4, dtype=int)))
+        self.pairs.append((np.array([0, 1, 1, 0]), np.ones(4, dtype=int)))
+
+    def test_same_as_sklearn(self):
+        packed = PackedLabels.from_pairs(self.pairs)
+        for metric_name in ["accuracy", "hamming_loss", "f1", "recall_score",
+                            "MCC", "average_precision", "AUC", "jaccard_similarity"]:
+            metric = metrics_dict[metric_name]
+            scores = compute_packed_scores(packed, metric)
+            for idx, (y_true, y_predicted) in enumerate(self.pairs):
+                expected = metric.func(y_true, y_predicted)
+                if np.isnan(expected):
+                    self.assertTrue(np.isnan(scores[idx]), msg=metric_name)
+                else:
+                    self.assertAlmostEqual(scores[idx], expected, msg=metric_name)
+
+    def test_batched_path(self):
+        packed = PackedLabels.from_pairs(self.pairs)
+        for metric_name in ["average_precision", "AUC", "jaccard_similarity"]:
+            metric = metrics_dict[metric_name]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                _, valid = metric.confusion_func(packed.confusion())
+            self.assertTrue(valid[:20].all(), msg=metric_name)
+
+        # AP is ill-defined without predicted positives, sklearn scores it
+        with np.errstate(divide="ignore", invalid="ignore"):
+            _, valid = metrics_dict["average_precision"].confusion_func(
+                PackedLabels.from_pairs(self.pairs[20:]).confusion())
+        self.assertEqual(valid.tolist(), [False, True])
+
+    def test_missing_cell(self):
+        packed = PackedLabels.from_pairs([None, self.pairs[0]])
+        scores = compute_packed_scores(packed, metrics_dict["accuracy"])
+
+        self.assertTrue(np.isnan(scores[0]))
+        self.assertFalse(np.isnan(scores[1]))
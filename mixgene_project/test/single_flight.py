@@ -0,0 +1,83 @@
+import unittest
+
+from mixgene.redis_helper import CacheKeys
+from mixgene.single_flight import single_flight, SingleFlightError, \
+    STATUS_OK, STATUS_ERROR
+
+
+class InMemoryRedis(object):
+    """
+        Subset of commands used by single flight
+    """
+    def __init__(self):
+        self.data = {}
+
+    def set(self, name, value, ex=None, nx=False):
+        if nx and name in self.data:
+            return None
+        self.data[name] = value
+        return True
+
+    def get(self, name):
+        return self.data.get(name)
+
+    def rpush(self, name, value):
+        self.data.setdefault(name, []).append(value)
+
+    def expire(self, name, ttl):
+        pass
+
+    def lindex(self, name, idx):
+        values = self.data.get(name, [])
+        return values[idx] if values else None
+
+    def brpoplpush(self, src, dst, timeout=0):
+        return self.lindex(src, -1)
+
+    def eval(self, script, numkeys, key, token):
+        if self.data.get(key) == token:
+            del self.data[key]
+
+    def pipeline(self):
+        return self
+
+    def execute(self):
+        pass
+
+
+class TestSingleFlight(unittest.TestCase):
+    def setUp(self):
+        self.r = InMemoryRedis()
+        self.lock_key = CacheKeys.get_single_flight_lock_key("gse1")
+
+    def test_leader(self):
+        result = single_flight("gse1", lambda: "work", lambda: None, redis_instance=self.r)
+        self.assertEqual(result, "work")
+        self.assertNotIn(self.lock_key, self.r.data)
+
+    def test_leader_reads_ready_result(self):
+        def do_work():
+            raise AssertionError("work is already done")
+
+        result = single_flight("gse1", do_work, lambda: "read", redis_instance=self.r)
+        self.assertEqual(result, "read")
+        self.assertNotIn(self.lock_key, self.r.data)
+
+    def test_leader_refreshes_result(self):
+        result = single_flight("gse1", lambda: "work", lambda: "read",
+                               reuse_result=False, redis_instance=self.r)
+        self.assertEqual(result, "work")
+
+    def test_follower_reads_result(self):
+        self.r.set(self.lock_key, "leader")
+        self.r.rpush(CacheKeys.get_single_flight_done_key("gse1", "leader"), STATUS_OK)
+
+        result = single_flight("gse1", lambda: "work", lambda: "read", redis_instance=self.r)
+        self.assertEqual(result, "read")
+
+    def test_follower_after_failure(self):
+        self.r.set(self.lock_key, "leader")
+        self.r.rpush(CacheKeys.get_single_flight_done_key("gse1", "leader"), STATUS_ERROR)
+
+        self.assertRaises(SingleFlightError, single_flight, "gse1",
+                          lambda: "work", lambda: "read", redis_instance=self.r)
@@ -4,7 +4,9 @@ import unittest
 import pandas
 import pandas.util.testing as tm
 
-from workflow.structures import DataFrameStorage
+from environment.cache import data_cache
+from environment.structures import DataFrameStorage, BinaryDataFrameStorage, \
+    ExpressionSet, ExpressionSetView
 
 
 class TestDataFrameStorage(unittest.TestCase):
@@ -35,9 +37,140 @@ class TestDataFrameStorage(unittest.TestCase):
         self.assertEqual(len(df.index), 22283)
         self.assertEqual(len(df.columns), 13)
 
+    def test_load_shared(self):
+        dfs = DataFrameStorage(self.orig_filepath)
+        df = dfs.load()
+
+        self.assertIs(df, dfs.load())
+        self.assertFalse(df.values.flags.writeable)
+        self.assertTrue(dfs.load(copy=True).values.flags.writeable)
+
+    def test_load_positions_stops_after_last_row(self):
+        orig_df = DataFrameStorage(self.orig_filepath).load()
+        dfs = DataFrameStorage(self.test_filepath)
+        dfs.store(orig_df.iloc[:50])
+
+        df = dfs.load(row_positions=[7, 2])
+        tm.assert_frame_equal(orig_df.iloc[[7, 2]], df)
+        # only the first rows were parsed, so the file isn't cached
+        self.assertIsNone(data_cache.get([self.test_filepath]))
+
     def tearDown(self):
         # clean up after each test done
         try:
             os.remove(self.test_filepath)
         except:
             pass
+
+
+class TestBinaryDataFrameStorage(unittest.TestCase):
+    orig_filepath = "test/artifacts/es_assay.csv.gz"
+    test_filepath = "test/tmp/test_binary_df"
+
+    def setUp(self):
+        self.orig_df = DataFrameStorage(self.orig_filepath).load()
+
+    def test_store_load(self):
+        dfs = BinaryDataFrameStorage(self.test_filepath)
+        dfs.store(self.orig_df)
+        restored_df = dfs.load()
+
+        tm.assert_frame_equal(self.orig_df.astype(float), restored_df)
+
+    def test_load_nrows(self):
+        dfs = BinaryDataFrameStorage(self.test_filepath)
+        dfs.store(self.orig_df)
+        df = dfs.load(nrows=20)
+
+        self.assertEqual(len(df.index), 20)
+        self.assertEqual(df.index.tolist(), self.orig_df.index[:20].tolist())
+
+    def test_load_labels_own_copy(self):
+        dfs = BinaryDataFrameStorage(self.test_filepath)
+        dfs.store(self.orig_df)
+        dfs.load_labels()["index"].append("no_such_probe")
+
+        self.assertEqual(dfs.load_labels()["index"], self.orig_df.index.tolist())
+
+    def test_load_array_mmap(self):
+        dfs = BinaryDataFrameStorage(self.test_filepath)
+        dfs.store(self.orig_df)
+        values = dfs.load_array(mmap=True)
+
+        self.assertEqual(values.shape, self.orig_df.shape)
+        self.assertFalse(values.flags.writeable)
+        self.assertTrue((values[:5] == self.orig_df.values[:5]).all())
+
+    def test_load_subset(self):
+        dfs = BinaryDataFrameStorage(self.test_filepath)
+        dfs.store(self.orig_df)
+
+        rows = self.orig_df.index[[10, 3, 7]].tolist()
+        cols = self.orig_df.columns[[2, 0]].tolist()
+        df = dfs.load(rows=rows, cols=cols)
+        tm.assert_frame_equal(self.orig_df.astype(float).loc[rows, cols], df)
+
+        df = dfs.load(row_positions=[1, 5], col_positions=[4])
+        tm.assert_frame_equal(self.orig_df.astype(float).iloc[[1, 5], [4]], df)
+
+        self.assertRaises(KeyError, dfs.load, rows=["no_such_probe"])
+
+    def test_legacy_load_subset(self):
+        dfs = BinaryDataFrameStorage("test/artifacts/es_assay")
+        cols = self.orig_df.columns[[2, 0]].tolist()
+        df = dfs.load(row_positions=[1, 5], cols=cols)
+
+        tm.assert_frame_equal(self.orig_df.iloc[[1, 5]][cols], df)
+
+    def test_legacy_fallback(self):
+        # prefix of the legacy `es_assay.csv.gz` file
+        dfs = BinaryDataFrameStorage("test/artifacts/es_assay")
+        df = dfs.load()
+
+        self.assertFalse(dfs.is_binary_stored())
+        self.assertEqual(len(df.index), 22283)
+        self.assertEqual(len(df.columns), 13)
+
+    def tearDown(self):
+        for filepath in [
+            "%s.values.npy" % self.test_filepath,
+            "%s.labels.pkl.gz" % self.test_filepath,
+        ]:
+            try:
+                os.remove(filepath)
+            except:
+                pass
+
+
+class TestExpressionSetView(unittest.TestCase):
+    orig_filepath = "test/artifacts/es_assay.csv.gz"
+    base_dir = "test/tmp"
+
+    def setUp(self):
+        self.orig_df = DataFrameStorage(self.orig_filepath).load().astype(float)
+        self.es = ExpressionSet(self.base_dir, "test_view_parent")
+        self.es.store_assay_data_frame(self.orig_df)
+        self.es.store_pheno_data_frame(pandas.DataFrame(
+            {"User_class": range(len(self.orig_df.columns))},
+            index=self.orig_df.columns
+        ))
+
+    def test_resolve_from_parent(self):
+        samples = self.orig_df.columns[[5, 1, 2]].tolist()
+        view = ExpressionSetView(self.es, "test_view", samples)
+
+        tm.assert_frame_equal(self.orig_df[samples], view.get_assay_data_frame())
+        self.assertTrue((view.get_assay_array() == self.orig_df[samples].values).all())
+        self.assertEqual(view.get_pheno_data_frame()["User_class"].tolist(), [5, 1, 2])
+        self.assertIsNone(view.assay_data_storage)
+
+    def tearDown(self):
+        for filepath in [
+            "%s/test_view_parent_assay.values.npy" % self.base_dir,
+            "%s/test_view_parent_assay.labels.pkl.gz" % self.base_dir,
+            "%s/test_view_parent_pheno.csv.gz" % self.base_dir,
+        ]:
+            try:
+                os.remove(filepath)
+            except:
+                pass
@@ -0,0 +1,51 @@
+import unittest
+
+from webapp.tasks import BlockInput, resolve_block_inputs
+
+
+class FakeGeneSets(object):
+    gene_sets = ["gs1"]
+
+
+class FakeBlock(object):
+    inputs = {"es": "es_value", "ann": FakeGeneSets()}
+
+    def get_input_var(self, name):
+        return self.inputs[name]
+
+
+class TestBlockInput(unittest.TestCase):
+    def test_resolve_nested(self):
+        block = FakeBlock()
+        resolved = resolve_block_inputs({
+            "es_dict": {"es": BlockInput("es")},
+            "args": (BlockInput("ann", attr="gene_sets"), 5),
+            "name": "plain",
+        }, block)
+
+        self.assertEqual(resolved, {
+            "es_dict": {"es": "es_value"},
+            "args": (["gs1"], 5),
+            "name": "plain",
+        })
+
+
+def ranking_stub(exp, block):
+    pass
+
+
+class TestTaskClassRouter(unittest.TestCase):
+    def test_route_by_wrapped_function(self):
+        from django.test.utils import override_settings
+        from webapp.task_routing import TaskClassRouter
+
+        router = TaskClassRouter()
+        task_classes = {
+            "webapp.tasks.auto_exec": "control",
+            "%s.ranking_stub" % __name__: "r",
+        }
+        with override_settings(CELERY_TASK_CLASSES=task_classes):
+            self.assertEqual(router.route_for_task("webapp.tasks.auto_exec", (1, "root"))["queue"], "control")
+            self.assertEqual(router.route_for_task("webapp.tasks.wrapper_task", (ranking_stub, ))["queue"], "r")
+            self.assertEqual(router.route_for_task("webapp.tasks.wrapper_task", (), {"func": ranking_stub})["queue"], "r")
+            self.assertEqual(router.route_for_task("webapp.tasks.wrapper_task", (len, ))["queue"], "cpu")
@@ -0,0 +1,84 @@
+import unittest
+
+from webapp import unit_of_work
+
+
+class FakePipeline(object):
+    def __init__(self):
+        self.executed = 0
+
+    def execute(self):
+        self.executed += 1
+
+
+class FakeRedis(object):
+    def __init__(self):
+        self.pipelines = []
+
+    def pipeline(self):
+        pipe = FakePipeline()
+        self.pipelines.append(pipe)
+        return pipe
+
+
+class FakeExperiment(object):
+    pk = 1
+
+    def __init__(self):
+        self.stored = []
+
+    def store_block(self, block, redis_instance=None, dont_execute_pipe=False):
+        if unit_of_work.is_active() and redis_instance is None:
+            unit_of_work.mark_dirty(self, block)
+            return
+        self.stored.append(block)
+
+
+class FakeBlock(object):
+    def __init__(self, uuid):
+        self.uuid = uuid
+
+
+class TestUnitOfWork(unittest.TestCase):
+    def setUp(self):
+        self.r = FakeRedis()
+        self.orig_get_redis_instance = unit_of_work.get_redis_instance
+        unit_of_work.get_redis_instance = lambda: self.r
+
+    def tearDown(self):
+        unit_of_work.get_redis_instance = self.orig_get_redis_instance
+
+    def test_coalesce_nested(self):
+        exp = FakeExperiment()
+        block_a, block_b = FakeBlock("a"), FakeBlock("b")
+        with unit_of_work.unit_of_work():
+            exp.store_block(block_a)
+            with unit_of_work.unit_of_work():
+                exp.store_block(block_b)
+                exp.store_block(block_a)
+            self.assertEqual(exp.stored, [])
+
+        self.assertEqual(exp.stored, [block_b, block_a])
+        self.assertEqual(len(self.r.pipelines), 1)
+        self.assertEqual(self.r.pipelines[0].executed, 1)
+
+    def test_store_outside_unit(self):
+        exp = FakeExperiment()
+        block = FakeBlock("a")
+        exp.store_block(block)
+
+        self.assertEqual(exp.stored, [block])
+        self.assertEqual(self.r.pipelines, [])
+
+    def test_flush_on_error(self):
+        exp = FakeExperiment()
+        block = FakeBlock("a")
+        try:
+            with unit_of_work.unit_of_work():
+                exp.store_block(block)
+                raise ValueError()
+        except ValueError:
+            pass
+
+        self.assertEqual(exp.stored, [block])
+        self.assertFalse(unit_of_work.is_active())
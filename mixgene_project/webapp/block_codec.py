@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+    Persistence format of blocks stored in redis.
+
+    Layout: magic, format version, flags, pickled block.
+    Pickle uses the highest binary protocol, payloads above
+     `COMPRESS_THRESHOLD` are compressed with zlib.
+    Values without the magic prefix are legacy protocol 0 pickles.
+"""
+import cPickle as pickle
+import struct
+import zlib
+
+MAGIC = "MXB"
+FORMAT_VERSION = 1
+
+FLAG_ZLIB = 1
+
+HEADER = struct.Struct("!3sBB")
+
+# bytes, smaller blocks aren't worth compression time
+COMPRESS_THRESHOLD = 16 * 1024
+COMPRESS_LEVEL = 1
+
+
+def dumps_block(block):
+    """
+        @type block: workflow.blocks.generic.GenericBlock
+        @rtype: str
+    """
+    payload = pickle.dumps(block, protocol=pickle.HIGHEST_PROTOCOL)
+    flags = 0
+    if len(payload) > COMPRESS_THRESHOLD:
+        payload = zlib.compress(payload, COMPRESS_LEVEL)
+        flags |= FLAG_ZLIB
+    return HEADER.pack(MAGIC, FORMAT_VERSION, flags) + payload
+
+
+def loads_block(data):
+    """
+        @type data: str
+        @rtype: workflow.blocks.generic.GenericBlock
+    """
+    if not data.startswith(MAGIC):
+        return pickle.loads(data)
+
+    _, version, flags = HEADER.unpack_from(data)
+    if version > FORMAT_VERSION:
+        raise ValueError("Block was stored in unknown format version: %s" % version)
+
+    payload = data[HEADER.size:]
+    if flags & FLAG_ZLIB:
+        payload = zlib.decompress(payload)
+    return pickle.loads(payload)
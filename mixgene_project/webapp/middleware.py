@@ -0,0 +1,24 @@
+import logging
+
+from django.conf import settings
+
+from mixgene.util import reset_redis_round_trips, get_redis_round_trips
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+
+class RedisRoundTripsMiddleware(object):
+    """
+        Counts requests to redis made while processing a http request,
+         in DEBUG mode the number is exposed in the `X-Redis-Round-Trips` header
+    """
+    def process_request(self, request):
+        reset_redis_round_trips()
+
+    def process_response(self, request, response):
+        round_trips = get_redis_round_trips()
+        log.debug("%s %s: %s redis round trips", request.method, request.path, round_trips)
+        if settings.DEBUG:
+            response["X-Redis-Round-Trips"] = str(round_trips)
+        return response
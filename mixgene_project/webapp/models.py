@@ -4,62 +4,308 @@ import gzip
 import os
 import shutil
 import cPickle as pickle
+from contextlib import contextmanager
 import hashlib
 import logging
+import time
+import uuid
 
 import pandas as pd
 
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 from redis.client import StrictPipeline
+import redis_lock
 
 
 from mixgene.settings import MEDIA_ROOT
-from mixgene.util import get_redis_instance, log_timing
-from mixgene.redis_helper import ExpKeys
+from mixgene.util import get_redis_instance, log_timing, link_or_copy
+from mixgene.redis_helper import ExpKeys, CacheKeys
 
 from environment.structures import GmtStorage, GeneSets
-from webapp.scope import Scope
+from webapp.block_codec import dumps_block, loads_block
+from webapp.scope import Scope, BlockState
 from webapp.tasks import auto_exec_task
+from webapp import unit_of_work
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
+# value in the block dependencies hash for blocks with unbound required inputs
+UNBOUND_DEPS = "!"
+# field of the block dependencies hash, present when index covers all blocks
+BLOCK_INDEX_MARKER = "!indexed"
+
+
+# maximum number of keys requested by a single MGET
+GET_BLOCKS_CHUNK_SIZE = 100
+
+
+class FetchedBlocks(object):
+    """
+        Result of `Experiment.get_blocks`, behaves like a list of
+         (uuid, block) pairs. Blocks are unpickled on first access,
+         so callers that need only some of them don't pay for the rest.
+    """
+    def __init__(self, block_uuids, pickled_blocks):
+        self.uuids = list(block_uuids)
+        self._pickled = dict(zip(self.uuids, pickled_blocks))
+        self._blocks = {}
+
+    def get(self, block_uuid, default=None):
+        """
+            @rtype: workflow.blocks.generic.GenericBlock
+        """
+        if block_uuid in self._blocks:
+            return self._blocks[block_uuid]
+        if block_uuid not in self._pickled:
+            return default
+
+        pickled = self._pickled[block_uuid]
+        if pickled is None:
+            raise KeyError("Block wasn't found in redis: %s" % block_uuid)
+        block = loads_block(pickled)
+        self._blocks[block_uuid] = block
+        del self._pickled[block_uuid]
+        return block
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [(block_uuid, self.get(block_uuid)) for block_uuid in self.uuids[idx]]
+        block_uuid = self.uuids[idx]
+        return block_uuid, self.get(block_uuid)
+
+    def __iter__(self):
+        for block_uuid in self.uuids:
+            yield block_uuid, self.get(block_uuid)
+
+    def __len__(self):
+        return len(self.uuids)
+
+
+def encode_block_deps(block):
+    """
+        @type block: workflow.blocks.generic.GenericBlock
+        @return: Comma separated uuids of blocks providing inputs
+        @rtype: str
+    """
+    try:
+        return ",".join(map(str, block.get_input_blocks()))
+    except RuntimeError:
+        return UNBOUND_DEPS
+
+
+def get_cached_files_quota():
+    """
+        @rtype: int
+        @return: Bytes allowed for raw files cache, 0 means unlimited
+    """
+    from django.conf import settings
+    return int(getattr(settings, "CACHED_FILES_QUOTA_BYTES", 0))
+
+
+def select_cache_victims(entries, total_size, quota, is_pinned):
+    """
+        @param entries: Cache entries ordered from least recently used,
+            objects with `size` attribute
+
+        @type  is_pinned: callable
+        @param is_pinned: entry -> bool, pinned entries are never evicted
+
+        @return: Entries to be removed to fit into the quota
+    """
+    victims = []
+    for entry in entries:
+        if total_size <= quota:
+            break
+        if is_pinned(entry):
+            continue
+        victims.append(entry)
+        total_size -= entry.size
+    return victims
+
 
 class CachedFile(models.Model):
+    """
+        Files downloaded from external sources, shared between experiments.
+
+        Total size of files is kept under `CACHED_FILES_QUOTA_BYTES`,
+         least recently used entries are evicted. Entries used by running
+         fetch are pinned in redis, see `CachedFile.pinned`.
+    """
     uri = models.TextField(default="")
     uri_sha = models.CharField(max_length=127, default="")
     dt_updated = models.DateTimeField(auto_now=True)
 
+    size = models.BigIntegerField(default=0)
+    dt_last_access = models.DateTimeField(null=True, db_index=True)
+
     def __unicode__(self):
         return u"cached file of %s, updated at %s" % (self.uri, self.dt_updated)
 
+    @staticmethod
+    def get_uri_sha(uri):
+        return hashlib.sha256(uri).hexdigest()
+
     def get_file_path(self):
         return '/'.join(map(str, [MEDIA_ROOT, 'data', 'cache', self.uri_sha]))
 
     def save(self, *args, **kwargs):
-        self.uri_sha = hashlib.sha256(self.uri).hexdigest()
+        self.uri_sha = CachedFile.get_uri_sha(self.uri)
         super(CachedFile, self).save(*args, **kwargs)
 
+    def link_to(self, target_path):
+        """
+            Gives file to experiment without copying it when file system allows
+
+            @rtype: str
+            @return: Used method, see `mixgene.util.link_or_copy`
+        """
+        method = link_or_copy(self.get_file_path(), target_path)
+        CachedFile.objects.filter(pk=self.pk).update(dt_last_access=timezone.now())
+        return method
+
     @staticmethod
     def update_cache(uri, path_to_real_file):
         res = CachedFile.objects.filter(uri=uri)
         if len(res) == 0:
             cf = CachedFile()
             cf.uri = uri
-            cf.save()
+            # file path is derived from the hash, which is otherwise set only on save
+            cf.uri_sha = CachedFile.get_uri_sha(uri)
         else:
             cf = res[0]
 
-        shutil.copy(path_to_real_file, cf.get_file_path())
+        # replace rather than overwrite, experiments may hold links to the old file
+        link_or_copy(path_to_real_file, cf.get_file_path())
+        cf.size = os.path.getsize(cf.get_file_path())
+        cf.dt_last_access = timezone.now()
+        cf.save()
+
+        CachedFile.evict()
 
     @staticmethod
-    def look_up(uri):
+    def look_up(uri, redis_instance=None):
+        """
+            @rtype: CachedFile or None
+        """
+        if redis_instance is None:
+            r = get_redis_instance()
+        else:
+            r = redis_instance
+
+        stats_key = CacheKeys.get_cached_files_stats_key()
         res = CachedFile.objects.filter(uri=uri)
         if len(res) == 0:
+            r.hincrby(stats_key, "misses", 1)
             return None
+
+        cf = res[0]
+        if not os.path.exists(cf.get_file_path()):
+            log.warning("Cached file of %s is absent, dropping the entry", uri)
+            cf.delete()
+            r.hincrby(stats_key, "misses", 1)
+            return None
+
+        r.hincrby(stats_key, "hits", 1)
+        return cf
+
+    @staticmethod
+    @contextmanager
+    def pinned(uri, ttl=None, redis_instance=None):
+        """
+            Protects entry of the `uri` from eviction inside the section.
+             Pin expires after `ttl` seconds in case the holder dies.
+        """
+        if redis_instance is None:
+            r = get_redis_instance()
         else:
-            return res[0]
+            r = redis_instance
+        if ttl is None:
+            from django.conf import settings
+            ttl = getattr(settings, "CACHED_FILE_PIN_TTL", 6 * 3600)
+
+        key = CacheKeys.get_cached_file_pins_key(CachedFile.get_uri_sha(uri))
+        token = uuid.uuid4().hex
+        r.zadd(key, time.time() + ttl, token)
+        r.expire(key, ttl)
+        try:
+            yield
+        finally:
+            r.zrem(key, token)
+
+    @staticmethod
+    def is_pinned(uri_sha, redis_instance=None):
+        if redis_instance is None:
+            r = get_redis_instance()
+        else:
+            r = redis_instance
+        key = CacheKeys.get_cached_file_pins_key(uri_sha)
+        return r.zcount(key, time.time(), "+inf") > 0
+
+    @staticmethod
+    def get_total_size():
+        return CachedFile.objects.aggregate(total=models.Sum("size"))["total"] or 0
+
+    @staticmethod
+    def evict(quota=None, redis_instance=None):
+        """
+            Removes least recently used files until cache fits into the quota
+
+            @rtype: int
+            @return: Number of evicted entries
+        """
+        if redis_instance is None:
+            r = get_redis_instance()
+        else:
+            r = redis_instance
+        if quota is None:
+            quota = get_cached_files_quota()
+        if quota <= 0:
+            return 0
+
+        with redis_lock.Lock(r, CacheKeys.get_cached_files_eviction_lock_key()):
+            total_size = CachedFile.get_total_size()
+            if total_size <= quota:
+                return 0
+
+            # entries never accessed after migration are the first candidates
+            entries = CachedFile.objects.order_by("dt_last_access", "id")
+            victims = select_cache_victims(
+                entries.iterator(), total_size, quota,
+                lambda entry: CachedFile.is_pinned(entry.uri_sha, r)
+            )
+            for cf in victims:
+                try:
+                    os.remove(cf.get_file_path())
+                except OSError:
+                    pass
+                cf.delete()
+                log.debug("Evicted cached file of %s, %s bytes", cf.uri, cf.size)
+
+            if victims:
+                r.hincrby(CacheKeys.get_cached_files_stats_key(), "evictions", len(victims))
+            return len(victims)
+
+    @staticmethod
+    def get_stats(redis_instance=None):
+        """
+            @rtype: dict
+        """
+        if redis_instance is None:
+            r = get_redis_instance()
+        else:
+            r = redis_instance
+        counters = r.hgetall(CacheKeys.get_cached_files_stats_key())
+        stats = dict((name, int(counters.get(name, 0)))
+                     for name in ["hits", "misses", "evictions"])
+        stats.update({
+            "entries": CachedFile.objects.count(),
+            "size": CachedFile.get_total_size(),
+            "quota": get_cached_files_quota(),
+        })
+        return stats
 
 
 class Article(models.Model):
@@ -123,7 +369,7 @@ class Experiment(models.Model):
         return Experiment.objects.get(pk=_pk)
 
     def execute(self):
-        auto_exec_task.s(self, "root", is_init=True).apply_async()
+        auto_exec_task.s(self.pk, "root", is_init=True).apply_async()
 
     def post_init(self, redis_instance=None):
         ## TODO: RENAME TO init experiment and invoke on first save
@@ -176,6 +422,12 @@ class Experiment(models.Model):
 
     @log_timing
     def store_block(self, block, new_block=False, redis_instance=None, dont_execute_pipe=False):
+        if unit_of_work.is_active() and not new_block \
+                and not isinstance(redis_instance, StrictPipeline):
+            # written once when the outermost action finishes
+            unit_of_work.mark_dirty(self, block)
+            return
+
         if redis_instance is None:
             r = get_redis_instance()
         else:
@@ -208,7 +460,23 @@ class Experiment(models.Model):
                                  redis_instance=pipe,
                                  dont_execute_pipe=True)
 
-        pipe.set(block_key, pickle.dumps(block))
+        scope_blocks_key = ExpKeys.get_scope_blocks_key(self.pk, block.scope_name)
+        pipe.sadd(scope_blocks_key, block.uuid)
+        pipe.hset(ExpKeys.get_block_deps_key(self.pk), block.uuid, encode_block_deps(block))
+        pipe.hset(ExpKeys.get_block_states_key(self.pk), block.uuid,
+                  BlockState.from_block(block).to_json())
+        if new_block:
+            pipe.sadd(ExpKeys.get_all_exp_keys_key(self.pk),
+                      scope_blocks_key, ExpKeys.get_block_deps_key(self.pk),
+                      ExpKeys.get_block_states_key(self.pk))
+
+        # flag is set by GenericBlock.bind_input_var and shouldn't be persisted
+        if block.__dict__.pop("_dag_outdated", False) or new_block:
+            versions_key = ExpKeys.get_scope_dag_versions_key(self.pk)
+            pipe.hincrby(versions_key, block.scope_name, 1)
+            pipe.sadd(ExpKeys.get_all_exp_keys_key(self.pk), versions_key)
+
+        pipe.set(block_key, dumps_block(block))
 
         if not dont_execute_pipe:
             pipe.execute()
@@ -248,6 +516,7 @@ class Experiment(models.Model):
             for f_name, bound_var in other_block.bound_inputs.items():
                 if bound_var.block_uuid == block.uuid:
                     other_block.bound_inputs.pop(f_name)
+                    other_block._dag_outdated = True
 
             self.store_block(other_block)
 
@@ -255,10 +524,16 @@ class Experiment(models.Model):
         pipe.lrem(ExpKeys.get_exp_blocks_list_key(self.pk), 0, block.uuid)
         pipe.srem(ExpKeys.get_all_exp_keys_key(self.pk), block_key)
         pipe.hdel(ExpKeys.get_blocks_uuid_by_alias(self.pk), block.base_name)
+        pipe.srem(ExpKeys.get_scope_blocks_key(self.pk, block.scope_name), block.uuid)
+        pipe.hdel(ExpKeys.get_block_deps_key(self.pk), block.uuid)
+        pipe.hdel(ExpKeys.get_block_states_key(self.pk), block.uuid)
+        pipe.hdel(ExpKeys.get_execution_fingerprints_key(self.pk), block.uuid)
+        pipe.hdel(ExpKeys.get_execution_results_key(self.pk), block.uuid)
 
         scope = Scope(self, block.scope_name)
         scope.remove_vars_from_block(block)
 
+        pipe.hincrby(ExpKeys.get_scope_dag_versions_key(self.pk), block.scope_name, 1)
         pipe.execute()
 
 
@@ -298,12 +573,13 @@ class Experiment(models.Model):
             @rtype: GenericBlock
             @return: Block instance
         """
+        unit_of_work.flush()
         if redis_instance is None:
             r = get_redis_instance()
         else:
             r = redis_instance
 
-        return pickle.loads(r.get(ExpKeys.get_block_key(block_uuid)))
+        return loads_block(r.get(ExpKeys.get_block_key(block_uuid)))
 
     def get_scope_var_value(self, scope_var, redis_instance=None):
         """
@@ -315,6 +591,8 @@ class Experiment(models.Model):
             r = redis_instance
 
         block = self.get_block(scope_var.block_uuid, r)
+        if scope_var.fold_idx is not None:
+            return block.get_fold_out_var(scope_var.var_name, scope_var.fold_idx)
         return block.get_out_var(scope_var.var_name)
 
     @staticmethod
@@ -326,16 +604,152 @@ class Experiment(models.Model):
             @type  redis_instance: Redis
             @param redis_instance: Instance of redis client
 
-            @rtype: GenericBlock
-            @return: Block instance
+            @rtype: FetchedBlocks
+            @return: List like sequence of (uuid, block instance),
+                all blocks are fetched in one round trip
+        """
+        unit_of_work.flush()
+        if redis_instance is None:
+            r = get_redis_instance()
+        else:
+            r = redis_instance
+
+        block_uuid_list = list(block_uuid_list)
+        keys = [ExpKeys.get_block_key(uuid) for uuid in block_uuid_list]
+        if not keys:
+            pickled_blocks = []
+        elif len(keys) <= GET_BLOCKS_CHUNK_SIZE:
+            pickled_blocks = r.mget(keys)
+        else:
+            pipe = r.pipeline(transaction=False)
+            for start in range(0, len(keys), GET_BLOCKS_CHUNK_SIZE):
+                pipe.mget(keys[start:start + GET_BLOCKS_CHUNK_SIZE])
+            pickled_blocks = [pickled
+                              for chunk in pipe.execute()
+                              for pickled in chunk]
+
+        return FetchedBlocks(block_uuid_list, pickled_blocks)
+
+    def get_block_states(self, block_uuid_list, redis_instance=None):
+        """
+            @type  block_uuid_list: list
+            @param block_uuid_list: List of Block instance identifier
+
+            @rtype: dict
+            @return: { uuid -> BlockState }, missing entries are restored
+                from pickled blocks
+        """
+        unit_of_work.flush()
+        if redis_instance is None:
+            r = get_redis_instance()
+        else:
+            r = redis_instance
+
+        block_uuid_list = list(block_uuid_list)
+        if not block_uuid_list:
+            return {}
+
+        states_key = ExpKeys.get_block_states_key(self.pk)
+        result = {}
+        missing = []
+        for block_uuid, raw in zip(block_uuid_list, r.hmget(states_key, block_uuid_list)):
+            if raw is None:
+                missing.append(block_uuid)
+            else:
+                result[block_uuid] = BlockState.from_json(block_uuid, raw)
+
+        if missing:
+            log.debug("Restoring block states of exp %s: %s", self.pk, missing)
+            pipe = r.pipeline()
+            for block_uuid, block in self.get_blocks(missing, r):
+                state = BlockState.from_block(block)
+                pipe.hset(states_key, block_uuid, state.to_json())
+                result[block_uuid] = state
+            pipe.sadd(ExpKeys.get_all_exp_keys_key(self.pk), states_key)
+            pipe.execute()
+
+        return result
+
+    def get_execution_fingerprints(self, block_uuid_list, redis_instance=None):
+        """
+            @rtype: dict
+            @return: { uuid -> fingerprint }, blocks without successful
+                execution are omitted
+        """
+        if redis_instance is None:
+            r = get_redis_instance()
+        else:
+            r = redis_instance
+
+        block_uuid_list = list(block_uuid_list)
+        if not block_uuid_list:
+            return {}
+
+        fingerprints = r.hmget(ExpKeys.get_execution_fingerprints_key(self.pk), block_uuid_list)
+        return {
+            block_uuid: fingerprint
+            for block_uuid, fingerprint in zip(block_uuid_list, fingerprints)
+            if fingerprint is not None
+        }
+
+    def store_execution_result(self, block_uuid, fingerprint, out_data=None, redis_instance=None):
+        """
+            @param fingerprint: Fingerprint of the finished execution
+
+            @type  out_data: dict or None
+            @param out_data: Block outputs to be reused, None when
+                the result can't be reused
         """
         if redis_instance is None:
             r = get_redis_instance()
         else:
             r = redis_instance
 
-        return [(uuid, pickle.loads(r.get(ExpKeys.get_block_key(uuid))))
-                for uuid in block_uuid_list]
+        fingerprints_key = ExpKeys.get_execution_fingerprints_key(self.pk)
+        results_key = ExpKeys.get_execution_results_key(self.pk)
+
+        pipe = r.pipeline()
+        pipe.hset(fingerprints_key, block_uuid, fingerprint)
+        if out_data is None:
+            pipe.hdel(results_key, block_uuid)
+        else:
+            pipe.hset(results_key, block_uuid,
+                      pickle.dumps(out_data, protocol=pickle.HIGHEST_PROTOCOL))
+        pipe.sadd(ExpKeys.get_all_exp_keys_key(self.pk), fingerprints_key, results_key)
+        pipe.execute()
+
+    def clear_execution_result(self, block_uuid, redis_instance=None):
+        """
+            Forgets the last successful execution, e.g. when block starts
+             a new one and outputs of the previous are no longer on disk
+        """
+        if redis_instance is None:
+            r = get_redis_instance()
+        else:
+            r = redis_instance
+
+        pipe = r.pipeline()
+        pipe.hdel(ExpKeys.get_execution_fingerprints_key(self.pk), block_uuid)
+        pipe.hdel(ExpKeys.get_execution_results_key(self.pk), block_uuid)
+        pipe.execute()
+
+    def load_execution_result(self, block_uuid, fingerprint, redis_instance=None):
+        """
+            @return: Outputs stored by `store_execution_result` or None
+                when fingerprint of the last execution differs
+        """
+        if redis_instance is None:
+            r = get_redis_instance()
+        else:
+            r = redis_instance
+
+        pipe = r.pipeline()
+        pipe.hget(ExpKeys.get_execution_fingerprints_key(self.pk), block_uuid)
+        pipe.hget(ExpKeys.get_execution_results_key(self.pk), block_uuid)
+        stored_fingerprint, pickled = pipe.execute()
+        if stored_fingerprint != fingerprint or pickled is None:
+            return None
+        return pickle.loads(pickled)
 
     def get_all_block_uuids(self, redis_instance=None):
         """
@@ -375,16 +789,58 @@ class Experiment(models.Model):
         """
             @return: { block: [ dependencies] }, root blocks have empty list as dependency
         """
+        unit_of_work.flush()
+        r = get_redis_instance()
+        deps_key = ExpKeys.get_block_deps_key(self.pk)
+        if not r.hexists(deps_key, BLOCK_INDEX_MARKER):
+            self.rebuild_block_index(r)
+
+        block_uuids = list(r.smembers(ExpKeys.get_scope_blocks_key(self.pk, scope_name)))
+        if not block_uuids:
+            return {}
+
         dependencies = {}
-        # TODO: store in redis block uuids by scope
-        for uuid, block in self.get_blocks(self.get_all_block_uuids()):
-            if block.scope_name != scope_name:
-                continue
-            else:
-                dependencies[str(block.uuid)] = map(str, block.get_input_blocks())
+        for block_uuid, encoded in zip(block_uuids, r.hmget(deps_key, block_uuids)):
+            if encoded is None:
+                # block was stored before index update, e.g. by an old worker
+                block = self.get_block(block_uuid, r)
+                encoded = encode_block_deps(block)
+                r.hset(deps_key, block_uuid, encoded)
+            if encoded == UNBOUND_DEPS:
+                raise RuntimeError("Not all required inputs are bound")
+
+            dependencies[str(block_uuid)] = encoded.split(",") if encoded else []
 
         return dependencies
 
+    def rebuild_block_index(self, redis_instance=None):
+        """
+            Fills blocks by scope sets and dependencies hash
+             for experiments created before they were introduced
+        """
+        if redis_instance is None:
+            r = get_redis_instance()
+        else:
+            r = redis_instance
+
+        log.debug("Rebuilding block index of exp: %s", self.pk)
+        deps_key = ExpKeys.get_block_deps_key(self.pk)
+        pipe = r.pipeline()
+        pipe.sadd(ExpKeys.get_all_exp_keys_key(self.pk), deps_key)
+        versions_key = ExpKeys.get_scope_dag_versions_key(self.pk)
+        for block_uuid, block in self.get_blocks(self.get_all_block_uuids(r), r):
+            scope_blocks_key = ExpKeys.get_scope_blocks_key(self.pk, block.scope_name)
+            pipe.hincrby(versions_key, block.scope_name, 1)
+            pipe.sadd(scope_blocks_key, block_uuid)
+            pipe.sadd(ExpKeys.get_all_exp_keys_key(self.pk), scope_blocks_key)
+            pipe.hset(deps_key, block_uuid, encode_block_deps(block))
+            pipe.hset(ExpKeys.get_block_states_key(self.pk), block_uuid,
+                      BlockState.from_block(block).to_json())
+        pipe.sadd(ExpKeys.get_all_exp_keys_key(self.pk), ExpKeys.get_block_states_key(self.pk))
+        pipe.hset(deps_key, BLOCK_INDEX_MARKER, 1)
+        pipe.sadd(ExpKeys.get_all_exp_keys_key(self.pk), versions_key)
+        pipe.execute()
+
     def get_meta_block_by_sub_scope(self, scope_name, redis_instance=None):
         if redis_instance is None:
             r = get_redis_instance()
@@ -3,6 +3,7 @@ import json
 import logging
 from mixgene.util import get_redis_instance
 from mixgene.redis_helper import ExpKeys
+from webapp import unit_of_work
 
 log = logging.getLogger("mixgene.notify")
 log.setLevel(logging.DEBUG)
@@ -12,6 +13,7 @@ class NotifyType(object):
     ALL = "updated_all"
     BLOCK = "updated_block"
     SCOPE = "updated_scope"
+    PROGRESS = "block_progress"
 
 
 class NotifyMode(object):
@@ -31,6 +33,8 @@ class Notification(object):
         self.comment = comment
 
     def send(self):
+        # client reloads blocks as soon as it receives notification
+        unit_of_work.flush()
         msg = self.to_dict()
         r = get_redis_instance()
         r.publish(ExpKeys.get_exp_notify_publish_key(self.exp_id),
@@ -66,3 +70,30 @@ class BlockUpdated(Notification):
 class AllUpdated(Notification):
     def __init__(self, exp_id, **kwargs):
         super(AllUpdated, self).__init__(exp_id, type_=NotifyType.ALL, **kwargs)
+
+
+class BlockProgress(Notification):
+    """
+        Progress of long operation, e.g. download, client doesn't reload block
+    """
+    def __init__(self, exp_id, block_uuid, done, total=None, **kwargs):
+        """
+            @type  done: int
+            @param done: Processed amount, e.g. downloaded bytes
+
+            @type  total: int or None
+            @param total: Expected amount when it's known
+        """
+        super(BlockProgress, self).__init__(exp_id, type_=NotifyType.PROGRESS, **kwargs)
+        self.block_uuid = block_uuid
+        self.done = done
+        self.total = total
+
+    def to_dict(self):
+        res = super(BlockProgress, self).to_dict()
+        res["block_uuid"] = self.block_uuid
+        res["done"] = self.done
+        res["total"] = self.total
+        if self.total:
+            res["percent"] = int(100 * self.done / self.total)
+        return res
@@ -1,6 +1,7 @@
-from collections import defaultdict
+from collections import defaultdict, deque
 import copy
 import cPickle as pickle
+import json
 import logging
 
 from mixgene.redis_helper import ExpKeys
@@ -14,16 +15,121 @@ log.setLevel(logging.DEBUG)
 
 LOCK_TIME = 60*10 # 10 minutes
 
+DEFAULT_MAX_RUNNING_BLOCKS_PER_EXPERIMENT = 16
+DEFAULT_MAX_RUNNING_BLOCKS_PER_SCOPE = 8
+
+# KEYS: experiment running set, scope running set, waiting scopes set
+# ARGV: block uuid, experiment limit, scope limit, scope name
+ACQUIRE_SLOT_SCRIPT = """
+if redis.call('sismember', KEYS[1], ARGV[1]) == 1 then
+    return 1
+end
+if redis.call('scard', KEYS[1]) >= tonumber(ARGV[2]) or
+        redis.call('scard', KEYS[2]) >= tonumber(ARGV[3]) then
+    redis.call('sadd', KEYS[3], ARGV[4])
+    return 0
+end
+redis.call('sadd', KEYS[1], ARGV[1])
+redis.call('sadd', KEYS[2], ARGV[1])
+return 1
+"""
+
+# KEYS: experiment running set, scope running set, waiting scopes set
+# ARGV: block uuid
+# Waiting scopes are taken only when the block really held a slot,
+#   e.g. meta blocks leave `working` state without acquiring one
+RELEASE_SLOT_SCRIPT = """
+if redis.call('srem', KEYS[1], ARGV[1]) == 0 then
+    return {}
+end
+redis.call('srem', KEYS[2], ARGV[1])
+local waiting = redis.call('smembers', KEYS[3])
+redis.call('del', KEYS[3])
+return waiting
+"""
+
+
+def get_running_blocks_limits():
+    """
+        @return: (limit per experiment, limit per scope)
+    """
+    from django.conf import settings
+    return (
+        getattr(settings, "MAX_RUNNING_BLOCKS_PER_EXPERIMENT",
+                DEFAULT_MAX_RUNNING_BLOCKS_PER_EXPERIMENT),
+        getattr(settings, "MAX_RUNNING_BLOCKS_PER_SCOPE",
+                DEFAULT_MAX_RUNNING_BLOCKS_PER_SCOPE),
+    )
+
+
+def acquire_execution_slot(exp_id, scope_name, block_uuid, redis_instance=None):
+    """
+        @return: True if block can be started without exceeding limits
+        @rtype: bool
+    """
+    if redis_instance is None:
+        r = get_redis_instance()
+    else:
+        r = redis_instance
+
+    max_per_exp, max_per_scope = get_running_blocks_limits()
+    acquired = r.eval(
+        ACQUIRE_SLOT_SCRIPT, 3,
+        ExpKeys.get_running_blocks_key(exp_id),
+        ExpKeys.get_scope_running_blocks_key(exp_id, scope_name),
+        ExpKeys.get_waiting_scopes_key(exp_id),
+        block_uuid, max_per_exp, max_per_scope, scope_name
+    )
+    return bool(acquired)
+
+
+def release_execution_slot(exp_id, scope_name, block_uuid, redis_instance=None):
+    """
+        @return: Scopes waiting for free slots, should be scheduled again
+        @rtype: list
+    """
+    if redis_instance is None:
+        r = get_redis_instance()
+    else:
+        r = redis_instance
+
+    waiting_scopes = r.eval(
+        RELEASE_SLOT_SCRIPT, 3,
+        ExpKeys.get_running_blocks_key(exp_id),
+        ExpKeys.get_scope_running_blocks_key(exp_id, scope_name),
+        ExpKeys.get_waiting_scopes_key(exp_id),
+        block_uuid
+    )
+    return list(waiting_scopes or [])
+
+
+def clean_execution_slots(exp, redis_instance=None):
+    if redis_instance is None:
+        r = get_redis_instance()
+    else:
+        r = redis_instance
+
+    pipe = r.pipeline()
+    pipe.delete(ExpKeys.get_running_blocks_key(exp.pk))
+    pipe.delete(ExpKeys.get_waiting_scopes_key(exp.pk))
+    for scope_name in exp.get_all_scopes_with_block_uuids(r).keys():
+        pipe.delete(ExpKeys.get_scope_running_blocks_key(exp.pk, scope_name))
+    pipe.execute()
+
 
 class ScopeVar(object):
+    # Set for inner outputs of meta block bound in the isolated fold scope
+    fold_idx = None
+
     def __init__(self, block_uuid, var_name,
                  data_type=None, block_alias=None,
-                 scope_name=None):
+                 scope_name=None, fold_idx=None):
         self.block_uuid = block_uuid
         self.var_name = var_name
         self.data_type = data_type
         self.block_alias = block_alias
         self.scope_name = scope_name
+        self.fold_idx = fold_idx
 
     @property
     def title(self):
@@ -58,6 +164,54 @@ class ScopeVar(object):
         return ":".join(map(str, [self.block_uuid, self.var_name]))
 
 
+class BlockState(object):
+    """
+        Hot fields of a block, mirrored in the redis hash next to the pickled
+         block, so scheduling doesn't need to unpickle whole blocks
+    """
+    fields = ["state", "exec_status", "scope_name", "sub_scope_name",
+              "create_new_scope", "is_block_supports_auto_execution"]
+
+    def __init__(self, uuid, state=None, exec_status=None, scope_name=None,
+                 sub_scope_name="", create_new_scope=False,
+                 is_block_supports_auto_execution=False):
+        self.uuid = uuid
+        self.state = state
+        self.exec_status = exec_status
+        self.scope_name = scope_name
+        self.sub_scope_name = sub_scope_name
+        self.create_new_scope = create_new_scope
+        self.is_block_supports_auto_execution = is_block_supports_auto_execution
+
+    def get_exec_status(self):
+        return self.exec_status
+
+    @staticmethod
+    def from_block(block):
+        """
+            @type block: workflow.blocks.generic.GenericBlock
+            @rtype: BlockState
+        """
+        return BlockState(
+            block.uuid,
+            state=block.state,
+            exec_status=block.get_exec_status(),
+            scope_name=block.scope_name,
+            sub_scope_name=block.sub_scope_name,
+            create_new_scope=bool(block.create_new_scope),
+            is_block_supports_auto_execution=block.is_block_supports_auto_execution,
+        )
+
+    def to_json(self):
+        return json.dumps({field: getattr(self, field) for field in self.fields})
+
+    @staticmethod
+    def from_json(uuid, raw):
+        return BlockState(uuid, **{
+            str(field): value for field, value in json.loads(raw).iteritems()
+        })
+
+
 class DAG(object):
     def __init__(self):
         self.graph = defaultdict(set)  # parent -> [children list]
@@ -65,7 +219,6 @@ class DAG(object):
         self.roots = set()
 
         self.topological_order = None
-        self.marks = {}
 
     def reverse_add(self, node, parents=None):
         if node not in self.graph:
@@ -76,7 +229,7 @@ class DAG(object):
             self.parents[node].update(parents)
             for parent in parents:
                 self.graph[parent].add(node)
-                if parent not in self.parents.keys():
+                if parent not in self.parents:
                     self.parents[parent] = set()
 
     def get_children(self, node):
@@ -102,30 +255,32 @@ class DAG(object):
             if not parents:
                 self.roots.add(node)
 
-    def get_unmarked(self):
-        for node, mark in self.marks.iteritems():
-            if mark == "unmarked":
-                return node
-        return None
-
     def sort_graph(self):
-        # http://en.wikipedia.org/wiki/Topological_sorting
-        # TODO( low priority): change to iterative version
-        self.topological_order = []
-        self.marks = {node: "unmarked" for node in self.graph.keys()}
-        while self.get_unmarked():
-            n = self.get_unmarked()
-            self.visit(n)
-
-    def visit(self, n):
-        if self.marks[n] == "temp":
-            raise RuntimeError("Contains loop")
-        if self.marks[n] == "unmarked":
-            self.marks[n] = "temp"
-            for child in self.graph[n]:
-                self.visit(child)
-            self.marks[n] = "perm"
-            self.topological_order.insert(0, n)
+        """
+            Kahn's algorithm, http://en.wikipedia.org/wiki/Topological_sorting
+
+            @raise RuntimeError: when graph contains loop
+        """
+        in_degree = dict((node, 0) for node in self.graph)
+        for children in self.graph.itervalues():
+            for child in children:
+                in_degree[child] += 1
+
+        queue = deque(sorted(node for node, degree in in_degree.iteritems() if degree == 0))
+        order = []
+        while queue:
+            node = queue.popleft()
+            order.append(node)
+            for child in sorted(self.graph[node]):
+                in_degree[child] -= 1
+                if in_degree[child] == 0:
+                    queue.append(child)
+
+        if len(order) < len(in_degree):
+            looped = sorted(node for node, degree in in_degree.iteritems() if degree > 0)
+            raise RuntimeError("Contains loop, involved nodes: %s" % ", ".join(map(str, looped)))
+
+        self.topological_order = order
 
 
 class ScopeRunner(object):
@@ -138,15 +293,20 @@ class ScopeRunner(object):
         self.scope_name = scope_name
         self.dag = None
 
-    def is_block_inputs_are_satisfied(self, block_uuid, blocks_dict):
+    def is_block_inputs_are_satisfied(self, block_uuid, states):
+        """
+            @type states: dict
+            @param states: { uuid -> webapp.models.BlockState }
+        """
         result = True
         for p_uuid in self.dag.get_parents(block_uuid):
             # TODO: Fix this add hoc code to ignore meta block status
-            if blocks_dict[p_uuid].create_new_scope and\
-                    blocks_dict[p_uuid].sub_scope_name in self.scope_name:
+            parent = states[p_uuid]
+            if parent.create_new_scope and\
+                    parent.sub_scope_name in self.scope_name:
                 continue
 
-            parent_status = blocks_dict[p_uuid].get_exec_status()
+            parent_status = parent.get_exec_status()
             if parent_status != "done":
                 result = False
                 break
@@ -154,30 +314,44 @@ class ScopeRunner(object):
         return result
 
     def execute(self, is_init_action=False):
-        self.build_dag(self.exp.build_block_dependencies_by_scope(self.scope_name))
+        self.load_dag()
 
         blocks_to_execute = []
         working_blocks = []
 
-        blocks_dict = dict(self.exp.get_blocks(self.exp.get_all_block_uuids()))
+        if is_init_action:
+            clean_execution_slots(self.exp)
+
+        # full blocks are loaded only to run an action on them
+        states = self.exp.get_block_states(self.dag.graph.keys())
         for block_uuid in self.dag.topological_order:
-            block = blocks_dict[block_uuid]
-            if is_init_action and block.is_block_supports_auto_execution and block.get_exec_status() == "done":
+            state = states[block_uuid]
+            if state.scope_name != self.scope_name:
+                # parents from outer scopes are not managed here
+                continue
+
+            if is_init_action and state.is_block_supports_auto_execution and state.get_exec_status() == "done":
+                block = self.exp.get_block(block_uuid)
                 block.do_action("reset_execution", self.exp)
+                state = states[block_uuid] = BlockState.from_block(block)
 
-            if block.get_exec_status() == "ready" and \
-                    self.is_block_inputs_are_satisfied(block_uuid, blocks_dict):
-                blocks_to_execute.append(block)
-            if block.get_exec_status() == "working" and \
-                    self.is_block_inputs_are_satisfied(block_uuid, blocks_dict):
-                working_blocks.append(block)
+            if state.get_exec_status() == "ready" and \
+                    self.is_block_inputs_are_satisfied(block_uuid, states):
+                blocks_to_execute.append(block_uuid)
+            if state.get_exec_status() == "working" and \
+                    self.is_block_inputs_are_satisfied(block_uuid, states):
+                working_blocks.append(block_uuid)
 
         if not blocks_to_execute and not working_blocks:
             log.debug("Nothing to execute in scope `%s` for exp `%s`",
                       self.scope_name, self.exp.pk)
             if self.scope_name != "root":
                 block = self.exp.get_meta_block_by_sub_scope(self.scope_name)
-                block.do_action("on_sub_scope_done", self.exp)
+                if block.sub_scope_name == self.scope_name:
+                    block.do_action("on_sub_scope_done", self.exp)
+                else:
+                    # isolated scope of a single fold
+                    block.on_fold_scope_done(self.exp, self.scope_name)
             else:
                 AllUpdated(
                     self.exp.pk,
@@ -186,22 +360,62 @@ class ScopeRunner(object):
                     silent=False
                 ).send()
         elif blocks_to_execute:
-            # for block in blocks_to_execute:
-            #     block.do_action("execute", self.exp
-            blocks_to_execute[0].do_action("execute", self.exp)
+            self.dispatch([block for _, block in self.exp.get_blocks(blocks_to_execute)])
+
+    def dispatch(self, blocks_to_execute):
+        """
+            Starts all given blocks within limits of concurrently running blocks.
+            Blocks left behind are started when some running block finishes.
+        """
+        r = get_redis_instance()
+        for block in blocks_to_execute:
+            if block.try_use_cached_result(self.exp):
+                continue
+
+            # Meta blocks only coordinate sub-scope and don't occupy workers
+            if not block.create_new_scope and \
+                    not acquire_execution_slot(self.exp.pk, self.scope_name, block.uuid, r):
+                log.debug("Execution limit reached in scope `%s` for exp `%s`, postponed: %s",
+                          self.scope_name, self.exp.pk, block.base_name)
+                break
+
+            block.do_action("execute", self.exp)
 
     def build_dag(self, block_dependencies):
         """
             @type block_dependencies: dict
             @param block_dependencies: {block -> parents}
         """
-        self.dag = DAG()
-        for node, parents in block_dependencies.iteritems():
-            self.dag.reverse_add(node, parents)
+        self.dag = DAG.from_deps(block_dependencies)
+
+    def load_dag(self, redis_instance=None):
+        """
+            Uses DAG cached in redis, while scope structure version
+             remains the same. Otherwise rebuilds and caches DAG.
+        """
+        if redis_instance is None:
+            r = get_redis_instance()
+        else:
+            r = redis_instance
+
+        dag_key = ExpKeys.get_scope_dag_key(self.exp.pk, self.scope_name)
+        # version should be read before blocks, so a concurrent change
+        #  leaves cache with already outdated version
+        version = int(r.hget(ExpKeys.get_scope_dag_versions_key(self.exp.pk),
+                             self.scope_name) or 0)
+        pickled = r.get(dag_key)
+        if pickled is not None:
+            cached_version, dag = pickle.loads(pickled)
+            if cached_version == version:
+                self.dag = dag
+                return
+
+        self.build_dag(self.exp.build_block_dependencies_by_scope(self.scope_name))
 
-        self.dag.update_roots()
-        self.dag.sort_graph()
-        # self.dag.p1()
+        pipe = r.pipeline()
+        pipe.set(dag_key, pickle.dumps((version, self.dag), protocol=pickle.HIGHEST_PROTOCOL))
+        pipe.sadd(ExpKeys.get_all_exp_keys_key(self.exp.pk), dag_key)
+        pipe.execute()
 
 
 class Scope(object):
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+    Routing of celery tasks to queues by task class.
+
+    Block computations are sent through the single `wrapper_task`, so the
+     class is determined by the wrapped function rather than by task name.
+     Classes are declared in `CELERY_TASK_CLASSES` setting, keys are either
+     task names or dotted paths of functions passed to `wrapper_task`.
+"""
+import logging
+
+from django.conf import settings
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+
+class TaskClass(object):
+    # rpy2 calls: embedded R is single threaded and isn't fork safe
+    R = "r"
+    # numpy/sklearn computations
+    CPU = "cpu"
+    # downloads and parsing of external data
+    IO = "io"
+    # scope scheduling, should never wait behind computations
+    CONTROL = "control"
+
+    values = [R, CPU, IO, CONTROL]
+
+WRAPPER_TASK_NAME = "webapp.tasks.wrapper_task"
+
+
+def get_func_path(func):
+    """
+        @rtype: str
+        @return: Dotted path of function or name of celery task
+    """
+    name = getattr(func, "name", None)
+    if isinstance(name, basestring):
+        # celery task instance
+        return name
+    return "%s.%s" % (getattr(func, "__module__", None), getattr(func, "__name__", None))
+
+
+def get_task_class(task, args=None, kwargs=None):
+    """
+        @type  task: str
+        @param task: Task name
+
+        @rtype: str
+        @return: One of `TaskClass` values
+    """
+    task_classes = getattr(settings, "CELERY_TASK_CLASSES", {})
+    if task == WRAPPER_TASK_NAME:
+        func = args[0] if args else (kwargs or {}).get("func")
+        if func is not None:
+            task_class = task_classes.get(get_func_path(func))
+            if task_class is not None:
+                return task_class
+    return task_classes.get(task, TaskClass.CPU)
+
+
+class TaskClassRouter(object):
+    """
+        Celery router, to be listed in `CELERY_ROUTES`
+    """
+    def route_for_task(self, task, args=None, kwargs=None):
+        task_class = get_task_class(task, args, kwargs)
+        return {
+            "queue": task_class,
+            "routing_key": task_class,
+        }
@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
+import cPickle as pickle
 import logging
 import redis_lock
 from time import time
+from celery.signals import before_task_publish
 from celery.task import task
 from mixgene.redis_helper import ExpKeys
 from mixgene.util import get_redis_instance
@@ -11,8 +13,71 @@ from webapp.notification import AllUpdated, NotifyMode
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
+# Tasks should receive identifiers, not data, see `BlockInput`
+TASK_PAYLOAD_WARN_BYTES = 64 * 1024
+
+
+class BlockInput(object):
+    """
+        Placeholder for the block input variable in task arguments,
+         worker resolves it by `block.get_input_var`
+    """
+    def __init__(self, name, attr=None):
+        """
+            @type  name: str
+            @param name: Input port name
+
+            @type  attr: str or None
+            @param attr: Attribute of the input variable to be passed instead
+        """
+        self.name = name
+        self.attr = attr
+
+    def resolve(self, block):
+        value = block.get_input_var(self.name)
+        if self.attr is not None:
+            value = getattr(value, self.attr)
+        return value
+
+
+def resolve_block_inputs(value, block):
+    if isinstance(value, BlockInput):
+        return value.resolve(block)
+    if isinstance(value, dict):
+        return {key: resolve_block_inputs(val, block) for key, val in value.iteritems()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(resolve_block_inputs(val, block) for val in value)
+    return value
+
+
+def get_experiment(exp):
+    """
+        Tasks receive experiment id, instances are accepted for messages
+         sent before the switch to identifiers
+
+        @rtype: webapp.models.Experiment
+    """
+    from webapp.models import Experiment
+    if isinstance(exp, Experiment):
+        return exp
+    return Experiment.get_exp_by_id(exp)
+
+
+def check_payload_size(body=None, **kwargs):
+    if body is None:
+        return
+    size = len(pickle.dumps(body, protocol=pickle.HIGHEST_PROTOCOL))
+    if size > TASK_PAYLOAD_WARN_BYTES:
+        log.warning("Task %s has oversize payload: %s bytes, args: %s",
+                    body.get("task"), size,
+                    [type(arg).__name__ for arg in body.get("args", [])])
+
+before_task_publish.connect(check_payload_size)
+
+
 @task(name="webapp.tasks.auto_exec")
-def auto_exec_task(exp, scope_name, is_init=False):
+def auto_exec_task(exp_id, scope_name, is_init=False):
+    exp = get_experiment(exp_id)
     r = get_redis_instance()
 
     lock_key = ExpKeys.get_auto_exec_task_lock_key(exp.pk, scope_name)
@@ -24,9 +89,10 @@ def auto_exec_task(exp, scope_name, is_init=False):
             log.exception(e)
 
 @task(name="webapp.tasks.halt_execution")
-def halt_execution_task(exp, scope_name):
+def halt_execution_task(exp_id, scope_name):
     log.debug("halt execution invoked")
 
+    exp = get_experiment(exp_id)
     r = get_redis_instance()
 
     lock_key = ExpKeys.get_auto_exec_task_lock_key(exp.pk, scope_name)
@@ -51,14 +117,27 @@ def wrapper_task(func, exp, block,
              # success_action="success", error_action="error",
              *args, **kwargs
     ):
+    """
+        @param exp: Experiment id
+        @param block: Block uuid, block is loaded from redis by the worker
+
+        Instances of `BlockInput` in args and kwargs are replaced
+         with block input variables
+    """
     success_action = kwargs.pop("success_action", "success")
     error_action = kwargs.pop("error_action", "error")
     # log = wrapper_task.get_logger()
 
+    exp = get_experiment(exp)
+    if isinstance(block, basestring):
+        block = exp.get_block(block)
+
     try:
         log.info("trying to apply: %s", func)
+        args = resolve_block_inputs(args, block)
+        kwargs = resolve_block_inputs(kwargs, block)
         result_list, key_result = func(exp, block, *args, **kwargs)
         block.do_action(success_action, exp, *result_list, **key_result)
     except Exception, e:
         log.exception(e)
-        block.do_action(error_action, exp, e)
\ No newline at end of file
+        block.do_action(error_action, exp, e)
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+    Coalescing of block writes made during an action.
+
+    While unit of work is active `Experiment.store_block` only marks
+     block as dirty. Dirty blocks are written once, in one pipeline, when
+     the outermost unit finishes. Pending writes are flushed earlier when
+     somebody else could observe them: before reading blocks from redis,
+     before entering a lock section, before publishing a celery task
+     or a notification.
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+import logging
+import threading
+
+from celery.signals import before_task_publish, task_prerun
+import redis_lock
+
+from mixgene.util import get_redis_instance
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+
+class UnitOfWorkState(threading.local):
+    def __init__(self):
+        self.depth = 0
+        self.dirty = OrderedDict()  # (exp_id, block_uuid) -> (exp, block)
+
+_state = UnitOfWorkState()
+
+
+def is_active():
+    return _state.depth > 0
+
+
+def mark_dirty(exp, block):
+    """
+        @type exp: webapp.models.Experiment
+        @type block: workflow.blocks.generic.GenericBlock
+    """
+    key = (exp.pk, block.uuid)
+    # keep order of the last modification
+    _state.dirty.pop(key, None)
+    _state.dirty[key] = (exp, block)
+
+
+def flush():
+    """
+        Writes all dirty blocks in one pipeline
+    """
+    if not _state.dirty:
+        return
+
+    dirty = _state.dirty
+    _state.dirty = OrderedDict()
+
+    pipe = get_redis_instance().pipeline()
+    for exp, block in dirty.itervalues():
+        exp.store_block(block, redis_instance=pipe, dont_execute_pipe=True)
+    pipe.execute()
+    log.debug("Flushed %s blocks", len(dirty))
+
+
+@contextmanager
+def unit_of_work():
+    _state.depth += 1
+    try:
+        yield
+    finally:
+        _state.depth -= 1
+        if _state.depth == 0:
+            flush()
+
+
+@contextmanager
+def exclusive_lock(redis_instance, lock_key):
+    """
+        Replacement for `redis_lock.Lock` section: pending writes are flushed
+         before acquiring the lock and blocks stored inside the section are
+         written before the lock is released.
+    """
+    flush()
+    depth = _state.depth
+    _state.depth = 0
+    try:
+        with redis_lock.Lock(redis_instance, lock_key):
+            yield
+    finally:
+        _state.depth = depth
+
+
+def flush_before_task(*args, **kwargs):
+    flush()
+
+before_task_publish.connect(flush_before_task)
+# eagerly applied tasks aren't published
+task_prerun.connect(flush_before_task)
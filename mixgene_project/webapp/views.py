@@ -144,11 +144,11 @@ def blocks_resource(request, exp_id):
 
     # TODO: Move to model logic
     blocks_uuids = exp.get_all_block_uuids(redis_instance=r)
-    blocks = exp.get_blocks(blocks_uuids, redis_instance=r)
+    block_states = exp.get_block_states(blocks_uuids, redis_instance=r)
 
     blocks_by_bscope = defaultdict(list)
-    for uuid, block in blocks:
-        blocks_by_bscope[block.scope_name].append(uuid)
+    for uuid in blocks_uuids:
+        blocks_by_bscope[block_states[uuid].scope_name].append(uuid)
 
     aliases_map = exp.get_block_aliases_map(redis_instance=r)
 
@@ -1,6 +1,6 @@
 import pandas as pd
 
-from webapp.tasks import wrapper_task
+from webapp.tasks import wrapper_task, BlockInput
 from workflow.blocks.blocks_pallet import GroupType
 from workflow.blocks.fields import ActionsList, ActionRecord, InputBlockField, ParamField, InputType, FieldType, \
     OutputBlockField
@@ -83,15 +83,12 @@ class GeneSetAgg(GenericBlock):
 
     def execute(self, exp, *args, **kwargs):
         self.clean_errors()
-        es = self.get_input_var("es")
-        gs = self.get_input_var("gs")
-
         base_filename = "%s_gs_agg" % (self.uuid, )
 
         self.celery_task = wrapper_task.s(
             do_gs_agg,
-            exp, self,
-            es, gs, self.agg_method,
+            exp.pk, self.uuid,
+            BlockInput("es"), BlockInput("gs"), self.agg_method,
             base_filename
         )
 
@@ -137,18 +134,14 @@ class SvdSubAgg(GenericBlock):
 
     def execute(self, exp, *args, **kwargs):
         self.clean_errors()
-        mRNA_es = self.get_input_var("mRNA_es")
-        miRNA_es = self.get_input_var("miRNA_es")
-        interaction_matrix = self.get_input_var("interaction")
-
         self.celery_task = wrapper_task.s(
             aggregation_task,
-            exp, self,
+            exp.pk, self.uuid,
             mode=self.mode,
             c=self.c,
-            m_rna_es=mRNA_es,
-            mi_rna_es=miRNA_es,
-            interaction_matrix=interaction_matrix,
+            m_rna_es=BlockInput("mRNA_es"),
+            mi_rna_es=BlockInput("miRNA_es"),
+            interaction_matrix=BlockInput("interaction"),
             base_filename="%s_%s_agg" % (self.uuid, self.mode)
         )
         exp.store_block(self)
@@ -63,8 +63,6 @@ class BoxPlot(RcVisualizer):
         rc = self.rc
 
         if compare_axis_by_boxplot and rc:
-            rc.load()
-
             df = rc.get_pandas_slice_for_boxplot(
                 compare_axis_by_boxplot,
                 agg_axis_for_scoring or [],
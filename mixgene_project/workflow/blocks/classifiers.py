@@ -3,7 +3,7 @@ from abc import abstractmethod
 import logging
 
 from environment.structures import TableResult
-from webapp.tasks import wrapper_task
+from webapp.tasks import wrapper_task, BlockInput
 from workflow.blocks.blocks_pallet import GroupType
 from workflow.blocks.fields import FieldType, BlockField, OutputBlockField, InputBlockField, InputType, ParamField, \
     ActionRecord, ActionsList
@@ -81,14 +81,11 @@ class GenericClassifier(GenericBlock):
         self.set_out_var("result", None)
         self.collect_options()
 
-        train_es = self.get_input_var("train_es")
-        test_es = self.get_input_var("test_es")
-
         self.celery_task = wrapper_task.s(
             apply_classifier,
-            exp=exp, block=self,
+            exp=exp.pk, block=self.uuid,
 
-            train_es=train_es, test_es=test_es,
+            train_es=BlockInput("train_es"), test_es=BlockInput("test_es"),
 
             classifier_name=self.classifier_name,
             classifier_options=self.classifier_options,
@@ -5,7 +5,7 @@ from mixgene.redis_helper import ExpKeys
 from webapp.models import Experiment
 from environment.structures import SequenceContainer
 from webapp.scope import ScopeRunner, ScopeVar
-from webapp.tasks import wrapper_task
+from webapp.tasks import wrapper_task, BlockInput
 from workflow.blocks.blocks_pallet import GroupType
 from workflow.blocks.fields import FieldType, BlockField, OutputBlockField, InnerOutputField, InputBlockField, InputType, \
     ParamField, ActionRecord, ActionsList
@@ -72,13 +72,13 @@ class CrossValidation(UniformMetaBlock):
 
         self.inner_output_manager.reset()
         es_dict = {
-            inp_name: self.get_input_var(inp_name)
+            inp_name: BlockInput(inp_name)
             for inp_name in self.es_inputs
         }
 
         self.celery_task = wrapper_task.s(
             generate_cv_folds,
-            exp, self,
+            exp.pk, self.uuid,
             folds_num=self.folds_num,
             repeats_num=self.repeats_num,
             es_dict=es_dict,
@@ -151,6 +151,9 @@ class CustomIterator(UniformMetaBlock):
     def get_fold_labels(self):
         return [cell.label for cell in self.cells.cells]
 
+    def get_fingerprint_extra(self):
+        return [(cell.label, cell.inputs_list) for cell in self.cells.cells]
+
     def execute(self, exp, *args, **kwargs):
         self.inner_output_manager.reset()
         seq = []
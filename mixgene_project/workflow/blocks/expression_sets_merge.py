@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import pandas as pd
-from webapp.tasks import wrapper_task
+from webapp.tasks import wrapper_task, BlockInput
 from workflow.blocks.blocks_pallet import GroupType
 from workflow.blocks.fields import FieldType, BlockField, OutputBlockField, InputBlockField, InputType, ParamField, \
     ActionRecord, ActionsList
@@ -61,9 +61,9 @@ class MergeExpressionSets(GenericBlock):
         # import ipdb; ipdb.set_trace()
         self.celery_task = wrapper_task.s(
             merge_two_es,
-            exp, self,
-            es_1 = self.get_input_var("es_1"),
-            es_2 = self.get_input_var("es_2"),
+            exp.pk, self.uuid,
+            es_1=BlockInput("es_1"),
+            es_2=BlockInput("es_2"),
             base_filename="%s_merged" % self.uuid,
         )
         exp.store_block(self)
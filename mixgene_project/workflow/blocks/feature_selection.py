@@ -12,7 +12,7 @@ from mixgene.util import log_timing, stopwatch
 from environment.structures import TableResult
 from webapp.models import Experiment
 
-from webapp.tasks import wrapper_task
+from webapp.tasks import wrapper_task, BlockInput
 from workflow.blocks.blocks_pallet import GroupType
 from workflow.blocks.fields import FieldType, BlockField, OutputBlockField, InputBlockField, InputType, ParamField, \
     ActionRecord, ActionsList
@@ -117,8 +117,8 @@ class GenericRankingBlock(GenericBlock):
 
         self.celery_task = wrapper_task.s(
             apply_ranking,
-            exp=exp, block=self,
-            es=self.get_input_var("es"),
+            exp=exp.pk, block=self.uuid,
+            es=BlockInput("es"),
             ranking_name=self.ranking_name,
             result_table=self.result,
             options=self.ranking_options
@@ -227,7 +227,6 @@ def feature_selection_by_cut(
         @param compare: either {"<", "<=", ">=", ">"}
     """
 
-    df = src_es.get_assay_data_frame()
     es = src_es.clone(base_filename)
     es.store_pheno_data_frame(src_es.get_pheno_data_frame())
 
@@ -235,7 +234,13 @@ def feature_selection_by_cut(
 
     selection = rank_df[cut_property]
     mask = cmp_func(cut_direction)(selection, threshold)
-    new_df = df[mask]
+    selected = set(selection.index[mask.values])
+
+    # Read only selected features, preserving order of the source set
+    new_df = src_es.get_assay_data_frame(rows=[
+        name for name in src_es.get_assay_labels()["index"]
+        if name in selected
+    ])
 
     es.store_assay_data_frame(new_df)
 
@@ -324,9 +329,9 @@ class FeatureSelectionByCut(GenericBlock):
         self.clean_errors()
         self.celery_task = wrapper_task.s(
             feature_selection_by_cut,
-            exp=exp, block=self,
-            src_es=self.get_input_var("es"),
-            rank_table=self.get_input_var("rank_table"),
+            exp=exp.pk, block=self.uuid,
+            src_es=BlockInput("es"),
+            rank_table=BlockInput("rank_table"),
             cut_property=self.cut_property,
             threshold=self.threshold,
             cut_direction=self.cut_direction,
@@ -125,7 +125,7 @@ class FetchGSE(GenericBlock):
         """
         self.clean_errors()
         self.celery_task_fetch = wrapper_task.s(
-            fetch_geo_gse, exp, self,
+            fetch_geo_gse, exp.pk, self.uuid,
             geo_uid=self.geo_uid,
             success_action="successful_fetch", error_action="error_during_fetch",
             ignore_cache=False
@@ -145,7 +145,7 @@ class FetchGSE(GenericBlock):
     def start_preprocess(self, exp, *args, **kwargs):
         self.celery_task_preprocess = wrapper_task.s(
             preprocess_soft,
-            exp, self,
+            exp.pk, self.uuid,
             source_file=self.source_file,
             success_action="successful_preprocess",
             error_action="error_during_preprocess"
@@ -175,7 +175,7 @@ class FetchGSE(GenericBlock):
     def update_user_classes_assignment(self, exp, request, *args, **kwargs):
         #TODO: unify code with user upload
         es = self.get_out_var("expression_set")
-        pheno_df = es.get_pheno_data_frame()
+        pheno_df = es.get_pheno_data_frame(copy=True)
 
         received = json.loads(request.body)
         es.pheno_metadata["user_class_title"] = received["user_class_title"]
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 
-from webapp.tasks import wrapper_task
+from webapp.tasks import wrapper_task, BlockInput
 from workflow.blocks.blocks_pallet import GroupType
 from workflow.blocks.fields import FieldType, BlockField, OutputBlockField, InputBlockField, InputType, ParamField, \
     ActionRecord, ActionsList
@@ -16,15 +16,20 @@ def filter_by_bi(
     base_filename
 ):
 
-    m_rna_df = m_rna_es.get_assay_data_frame()
-    mi_rna_df = mi_rna_es.get_assay_data_frame()
     targets_matrix = interaction_matrix.load_matrix()
 
-    allowed_m_rna_index_set = set(targets_matrix.columns) & set(m_rna_df.index)
-    m_rna_df_filtered = m_rna_df.loc[allowed_m_rna_index_set, :]
+    # Only rows present in the interaction matrix are read from storage
+    allowed_m_rna_index_set = set(targets_matrix.columns)
+    m_rna_df_filtered = m_rna_es.get_assay_data_frame(rows=[
+        name for name in m_rna_es.get_assay_labels()["index"]
+        if name in allowed_m_rna_index_set
+    ])
 
-    allowed_mi_rna_index_set = set(targets_matrix.index) & set(mi_rna_df.index)
-    mi_rna_df_filtered = mi_rna_df.loc[allowed_mi_rna_index_set, :]
+    allowed_mi_rna_index_set = set(targets_matrix.index)
+    mi_rna_df_filtered = mi_rna_es.get_assay_data_frame(rows=[
+        name for name in mi_rna_es.get_assay_labels()["index"]
+        if name in allowed_mi_rna_index_set
+    ])
 
     #result_df = agg_func(m_rna, mi_rna, targets_matrix, c)
     m_rna_result = m_rna_es.clone(base_filename + "_mRNA")
@@ -69,17 +74,13 @@ class FilterByInteraction(GenericBlock):
 
     def execute(self, exp, *args, **kwargs):
         self.clean_errors()
-        mRNA_es = self.get_input_var("mRNA_es")
-        miRNA_es = self.get_input_var("miRNA_es")
-        interaction_matrix = self.get_input_var("interaction")
-
         self.celery_task = wrapper_task.s(
             filter_by_bi,
-            exp, self,
+            exp.pk, self.uuid,
 
-            m_rna_es=mRNA_es,
-            mi_rna_es=miRNA_es,
-            interaction_matrix=interaction_matrix,
+            m_rna_es=BlockInput("mRNA_es"),
+            mi_rna_es=BlockInput("miRNA_es"),
+            interaction_matrix=BlockInput("interaction"),
             base_filename="%s_filtered_by_BI" % self.uuid,
         )
         exp.store_block(self)
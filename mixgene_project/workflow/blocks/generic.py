@@ -1,18 +1,21 @@
 import abc
+import cPickle as pickle
+import hashlib
 import logging
 import collections
+import copy
 import itertools
 from collections import defaultdict
-from uuid import uuid1
+from uuid import uuid1, uuid4
 import json
 
-import redis_lock
 from mixgene.redis_helper import ExpKeys
 from mixgene.util import log_timing, get_redis_instance
 from webapp.models import Experiment, UploadedData, UploadedFileWrapper
 from webapp.notification import BlockUpdated
-from webapp.scope import Scope, ScopeVar
+from webapp.scope import Scope, ScopeVar, release_execution_slot
 from webapp.tasks import auto_exec_task, halt_execution_task
+from webapp.unit_of_work import unit_of_work, exclusive_lock
 from workflow.blocks.fields import FieldType, BlockField, InputBlockField, \
     ActionRecord, ActionsList, MultiUploadField
 from workflow.blocks.managers import TransSystem, BlockSerializer, OutManager, InputManager
@@ -110,6 +113,12 @@ class GenericBlock(BaseBlock):
 
     is_block_supports_auto_execution = False
 
+    # Block results are reused while class, params and inputs are the same,
+    #  should be disabled for blocks with side effects or random results
+    is_execution_cacheable = True
+    _use_execution_cache = BlockField("use_execution_cache", FieldType.BOOLEAN, init_val=True)
+    use_execution_cache = True
+
     _errors = BlockField("errors", FieldType.SIMPLE_LIST, list())
     _warnings = BlockField("warnings", FieldType.SIMPLE_LIST, list())
     _bound_inputs = BlockField("bound_inputs", FieldType.SIMPLE_DICT, defaultdict())
@@ -118,9 +127,6 @@ class GenericBlock(BaseBlock):
         """
             Building block for workflow
         """
-        # TODO: due to dynamic inputs, find better solution
-        self._block_serializer = BlockSerializer.clone(self.__class__._block_serializer)
-
         self.state = "created"
         self.uuid = "B" + uuid1().hex[:8]
 
@@ -151,7 +157,8 @@ class GenericBlock(BaseBlock):
             #if f_name not in self.__dict__ and not f.is_a_property:
             if not f.is_a_property and not hasattr(self, f_name):
                 try:
-                    setattr(self, f_name, f.init_val)
+                    # descriptors are shared by all blocks, so mutable init values too
+                    setattr(self, f_name, copy.deepcopy(f.init_val))
                 except:
                     import ipdb; ipdb.set_trace()
 
@@ -179,6 +186,39 @@ class GenericBlock(BaseBlock):
         for f_name, f in self._block_serializer.inputs.iteritems():
             self.input_manager.register(f)
 
+    def register_instance_field(self, field):
+        """
+            Registers field or port only for this block instance,
+             class level serializer is shared by all blocks of the class
+        """
+        if "_block_serializer" not in self.__dict__:
+            self._block_serializer = BlockSerializer.clone(self.__class__._block_serializer)
+        self._block_serializer.register(field)
+
+    def __getstate__(self):
+        """
+            Class level serializer isn't persisted, only ports and fields
+             registered for this instance, see `register_instance_field`
+        """
+        state = self.__dict__.copy()
+        instance_serializer = state.pop("_block_serializer", None)
+        if instance_serializer is not None:
+            class_serializer = self.__class__._block_serializer
+            state["_serializer_extra"] = [
+                field
+                for group in ["fields", "params", "outputs", "inner_outputs", "inputs"]
+                for name, field in getattr(instance_serializer, group).iteritems()
+                if name not in getattr(class_serializer, group)
+            ]
+        return state
+
+    def __setstate__(self, state):
+        # blocks stored in the legacy format carry the whole serializer
+        extra = state.pop("_serializer_extra", None)
+        self.__dict__.update(state)
+        for field in extra or []:
+            self.register_instance_field(field)
+
     def on_remove(self, *args, **kwargs):
         """
             Cleanup all created files
@@ -194,6 +234,8 @@ class GenericBlock(BaseBlock):
             return "error"
         if self.state in self.auto_exec_status_ready:
             return "ready"
+        if self.state in self.auto_exec_status_working:
+            return "working"
 
         return "not_ready"
 
@@ -201,6 +243,7 @@ class GenericBlock(BaseBlock):
         log.debug("bound input %s to %s in block: %s, exp: %s",
                   input_name, bound_var, self.base_name, self.exp_id)
         self.bound_inputs[input_name] = bound_var
+        self._dag_outdated = True
 
     def get_input_var(self, name):
         try:
@@ -294,7 +337,11 @@ class GenericBlock(BaseBlock):
         old_exec_state = self.get_exec_status()
         next_state = self._trans.next_state(self.state, action_name)
 
-        if next_state is not None:
+        if next_state is None:
+            raise RuntimeError("Action %s isn't available for block %s in state %s" %
+                               (action_name, self.base_name, self.state))
+
+        with unit_of_work():
             log.debug("Do action: %s in block %s from state %s -> %s",
                       action_name, self.base_name, self.state, next_state)
             self.state = next_state
@@ -305,26 +352,33 @@ class GenericBlock(BaseBlock):
                                  block_uuid=self.uuid, block_alias=self.base_name,
                                  silent=True).send()
             exp.store_block(self)
+            if old_exec_state != "working" and self.get_exec_status() == "working":
+                # output files are going to be overwritten
+                exp.clear_execution_result(self.uuid)
+            if old_exec_state == "working" and self.get_exec_status() != "working":
+                for scope_name in release_execution_slot(self.exp_id, self.scope_name, self.uuid):
+                    auto_exec_task.s(exp.pk, scope_name).apply_async()
+
             getattr(self, action_name)(exp, *args, **kwargs)
 
             if ar.reload_block_in_client:
                 BlockUpdated(self.exp_id, self.uuid, self.base_name).send()
 
+            if old_exec_state != "done" and self.get_exec_status() == "done" \
+                    and action_name != "use_cached_result":
+                self.remember_execution_result(exp)
+
             # TODO: Check if self.scope_name is actually set to auto execution
             #
             if old_exec_state != "done" and self.get_exec_status() == "done" \
                     and ar.propagate_auto_execution \
                     and self.is_block_supports_auto_execution:
                 log.debug("Propagate execution: %s ", self.base_name)
-                auto_exec_task.s(exp, self.scope_name).apply_async()
+                auto_exec_task.s(exp.pk, self.scope_name).apply_async()
             elif self.state in self.auto_exec_status_error \
                     and self.is_block_supports_auto_execution:
                 log.debug("Detected error during automated workflow execution")
-                halt_execution_task.s(exp, self.scope_name).apply_async()
-
-        else:
-            raise RuntimeError("Action %s isn't available for block %s in state %s" %
-                               (action_name, self.base_name, self.state))
+                halt_execution_task.s(exp.pk, self.scope_name).apply_async()
 
     def change_base_name(self, exp, received_block, *args, **kwargs):
         # TODO: check if the name is correct
@@ -337,6 +391,117 @@ class GenericBlock(BaseBlock):
         self.ui_folded = received_block["ui_folded"]
         exp.store_block(self)
 
+    def toggle_execution_cache(self, exp, received_block, *args, **kwargs):
+        self.use_execution_cache = received_block["use_execution_cache"]
+        exp.store_block(self)
+
+    def get_execution_fingerprint(self, exp):
+        """
+            Fingerprint of block class, params and bound inputs,
+             see `compute_inputs_fingerprint`
+
+            @rtype: str or None
+            @return: None if block result shouldn't be reused
+        """
+        if not self.is_execution_cacheable or not self.use_execution_cache \
+                or not self.is_block_supports_auto_execution or self.create_new_scope:
+            return None
+        return self.compute_inputs_fingerprint(exp)
+
+    def compute_inputs_fingerprint(self, exp):
+        """
+            Inputs provided by ordinary blocks are represented by fingerprints
+             of their executions, inner outputs of meta blocks by fingerprint
+             of folds generation and position of the fold.
+
+            @rtype: str or None
+            @return: None when some input has no fingerprint
+        """
+        try:
+            params = sorted(
+                (p_name, getattr(self, p_name))
+                for p_name in self._block_serializer.params
+            )
+            bound_inputs = sorted(self.bound_inputs.items())
+            producers = [scope_var.block_uuid for _, scope_var in bound_inputs]
+            producer_states = exp.get_block_states(producers)
+            producer_fingerprints = exp.get_execution_fingerprints(producers)
+
+            inputs = []
+            for input_name, scope_var in bound_inputs:
+                producer_state = producer_states[scope_var.block_uuid]
+                if producer_state.create_new_scope and \
+                        producer_state.scope_name != self.scope_name:
+                    # meta block is still running, its outputs are inner ones
+                    fingerprint = exp.get_block(scope_var.block_uuid)\
+                        .get_inner_output_fingerprint(scope_var)
+                else:
+                    fingerprint = producer_fingerprints.get(scope_var.block_uuid)
+                if fingerprint is None:
+                    return None
+                inputs.append((input_name, scope_var.block_uuid, scope_var.var_name, fingerprint))
+
+            return hashlib.sha1(pickle.dumps(
+                (self.__class__.__module__, self.__class__.__name__, self.uuid,
+                 params, self.get_fingerprint_extra(), inputs),
+                protocol=pickle.HIGHEST_PROTOCOL
+            )).hexdigest()
+        except Exception, e:
+            log.warning("Failed to compute execution fingerprint of block %s: %s",
+                        self.base_name, e)
+            return None
+
+    def get_fingerprint_extra(self):
+        """
+            @return: Picklable block data, which isn't a param but affects
+                results, e.g. user defined cells of iterator
+        """
+        return None
+
+    def get_inner_output_fingerprint(self, scope_var):
+        """
+            @type scope_var: webapp.scope.ScopeVar
+            @return: Fingerprint of inner output value, None when unknown
+        """
+        return None
+
+    def remember_execution_result(self, exp):
+        """
+            Called when block reaches `done` status.
+            Blocks which results can't be reused get unique fingerprint,
+             so dependent blocks are always recomputed.
+        """
+        fingerprint = self.get_execution_fingerprint(exp)
+        if fingerprint is None:
+            exp.store_execution_result(self.uuid, "volatile_%s" % uuid4().hex)
+        else:
+            exp.store_execution_result(self.uuid, fingerprint, self._out_data)
+
+    def try_use_cached_result(self, exp):
+        """
+            @return: True if outputs of the previous execution with the same
+                fingerprint were restored instead of execution
+        """
+        if not self._trans.is_action_available(self.state, "use_cached_result"):
+            return False
+
+        fingerprint = self.get_execution_fingerprint(exp)
+        if fingerprint is None:
+            return False
+
+        out_data = exp.load_execution_result(self.uuid, fingerprint)
+        if out_data is None:
+            return False
+
+        log.debug("Reusing result of the previous execution of block %s", self.base_name)
+        self.do_action("use_cached_result", exp, out_data)
+        return True
+
+    def use_cached_result(self, exp, out_data, *args, **kwargs):
+        self.clean_errors()
+        self._out_data = out_data
+        exp.store_block(self)
+
     def save_params(self, exp, received_block=None, *args, **kwargs):
         self._block_serializer.save_params(self, received_block)
         exp.store_block(self)
@@ -380,7 +545,7 @@ class GenericBlock(BaseBlock):
             ufw.orig_name = orig_name
 
             r = get_redis_instance()
-            with redis_lock.Lock(r, ExpKeys.get_block_global_lock_key(self.exp_id, self.uuid)):
+            with exclusive_lock(r, ExpKeys.get_block_global_lock_key(self.exp_id, self.uuid)):
                 log.debug("Enter lock, file: %s", orig_name)
                 block = exp.get_block(self.uuid)
                 attr = getattr(block, field_name)
@@ -415,7 +580,7 @@ class GenericBlock(BaseBlock):
         pass
 
     def add_input_port(self, new_port):
-        self._block_serializer.register(new_port)
+        self.register_instance_field(new_port)
         self.input_manager.register(new_port)
 
     def add_dyn_input(self, exp, received_block, *args, **kwargs):
@@ -504,6 +669,7 @@ save_params_actions_list = ActionsList([
 execute_block_actions_list = ActionsList([
     ActionRecord("execute", ["ready"], "working", user_title="Run block"),
     ActionRecord("success", ["working"], "done", propagate_auto_execution=True),
+    ActionRecord("use_cached_result", ["ready"], "done", propagate_auto_execution=True),
     ActionRecord("error", ["*", "ready", "working"], "execution_error"),
     ActionRecord("reset_execution", ["*", "done", "execution_error", "ready", "working"], "ready",
                  user_title="Reset execution")
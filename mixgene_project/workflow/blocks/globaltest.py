@@ -1,6 +1,6 @@
 from environment.structures import TableResult
 from webapp.models import Experiment
-from webapp.tasks import wrapper_task
+from webapp.tasks import wrapper_task, BlockInput
 from workflow.blocks.blocks_pallet import GroupType
 from workflow.blocks.fields import FieldType, BlockField, OutputBlockField, InputBlockField, InputType, ParamField, \
     ActionRecord, ActionsList
@@ -50,9 +50,9 @@ class GlobalTest(GenericBlock):
         self.clean_errors()
         self.celery_task = wrapper_task.s(
             global_test_task,
-            exp, self,
-            es=self.get_input_var("es"),
-            gene_sets=self.get_input_var("gs"),
+            exp.pk, self.uuid,
+            es=BlockInput("es"),
+            gene_sets=BlockInput("gs"),
             table_result=self.result
         )
         exp.store_block(self)
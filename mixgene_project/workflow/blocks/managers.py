@@ -1,6 +1,5 @@
 # -*- coding: utf-8 -*-
 from collections import defaultdict
-import copy
 import itertools
 import logging
 from mixgene.util import log_timing, stopwatch
@@ -30,10 +29,14 @@ class TransSystem(object):
             @rtype: TransSystem
         """
         trans = TransSystem()
-        trans.action_records_by_name = copy.deepcopy(other.action_records_by_name)
-        trans.states_to_actions = copy.deepcopy(other.states_to_actions)
-        trans.action_to_state = copy.deepcopy(other.action_to_state)
-        trans.is_action_visible = copy.deepcopy(other.is_action_visible)
+        # action records are immutable and shared between block classes
+        trans.action_records_by_name = dict(other.action_records_by_name)
+        trans.states_to_actions = defaultdict(list, (
+            (state, list(actions))
+            for state, actions in other.states_to_actions.iteritems()
+        ))
+        trans.action_to_state = dict(other.action_to_state)
+        trans.is_action_visible = dict(other.is_action_visible)
         return trans
 
     def register(self, ar):
@@ -107,12 +110,18 @@ class BlockSerializer(object):
 
     @staticmethod
     def clone(other):
+        """
+            Field descriptors are immutable and shared, only registries are copied
+
+            @type other: BlockSerializer
+            @rtype: BlockSerializer
+        """
         bs = BlockSerializer()
-        bs.fields = copy.deepcopy(other.fields)
-        bs.params = copy.deepcopy(other.params)
-        bs.outputs = copy.deepcopy(other.outputs)
-        bs.inner_outputs = copy.deepcopy(other.inner_outputs)
-        bs.inputs = copy.deepcopy(other.inputs)
+        bs.fields = dict(other.fields)
+        bs.params = dict(other.params)
+        bs.outputs = dict(other.outputs)
+        bs.inner_outputs = dict(other.inner_outputs)
+        bs.inputs = dict(other.inputs)
         return bs
 
     @log_timing
@@ -4,6 +4,7 @@ import json
 import logging
 import traceback
 import sys
+from uuid import uuid4
 
 import pandas as pd
 
@@ -69,6 +70,8 @@ class MassUpload(UniformMetaBlock):
         self.pheno_by_es_names = {}
         self.labels = []
         self.seq = []
+        # changed on every processing, since stored sets are overwritten
+        self.upload_token = None
 
         self.register_inner_output_variables([InnerOutputField(
             name="es",
@@ -84,6 +87,9 @@ class MassUpload(UniformMetaBlock):
     def get_fold_labels(self):
         return self.labels
 
+    def get_fingerprint_extra(self):
+        return getattr(self, "upload_token", None)
+
     def error_on_processing(self, *args, **kwargs):
         pass
 
@@ -133,6 +139,7 @@ class MassUpload(UniformMetaBlock):
                 seq.append({"es": es, "__label__": es_name})
 
             self.seq = seq
+            self.upload_token = uuid4().hex
             exp.store_block(self)
             self.do_action("processing_done", exp, seq)
         except Exception as e:
@@ -1,4 +1,4 @@
-from webapp.tasks import wrapper_task
+from webapp.tasks import wrapper_task, BlockInput
 from workflow.blocks.blocks_pallet import GroupType
 from workflow.blocks.fields import FieldType, BlockField, OutputBlockField, InputBlockField, InputType, ParamField, \
     ActionRecord, ActionsList
@@ -36,15 +36,14 @@ class MergeGeneSetWithPlatformAnnotation(GenericBlock):
 
     def execute(self, exp, *args, **kwargs):
         self.clean_errors()
-        gs, ann = self.get_input_var("gs"), self.get_input_var("ann")
         # import ipdb; ipdb.set_trace()
         self.celery_task = wrapper_task.s(
             map_gene_sets_to_probes,
-            exp, self,
+            exp.pk, self.uuid,
             base_dir=exp.get_data_folder(),
             base_filename="%s_merged" % self.uuid,
-            ann_gene_sets=ann.gene_sets,
-            src_gene_sets=gs
+            ann_gene_sets=BlockInput("ann", attr="gene_sets"),
+            src_gene_sets=BlockInput("gs")
 
         )
         exp.store_block(self)
@@ -2,11 +2,12 @@
 from abc import abstractmethod
 
 from copy import deepcopy
+import cPickle as pickle
+import hashlib
 import logging
 
-import redis_lock
 
-from mixgene.redis_helper import ExpKeys
+from mixgene.redis_helper import ExpKeys, register_sub_key
 from mixgene.util import get_redis_instance
 from webapp.models import Experiment
 
@@ -14,6 +15,8 @@ from environment.structures import SequenceContainer
 from environment.result_container import ResultsContainer
 
 from webapp.scope import ScopeRunner, ScopeVar
+from webapp.tasks import auto_exec_task
+from webapp.unit_of_work import exclusive_lock
 from workflow.blocks.blocks_pallet import GroupType
 
 from workflow.blocks.errors import PortError
@@ -75,7 +78,7 @@ class UniformMetaBlock(GenericBlock):
         ActionRecord("run_sub_scope", ["ready_to_run_sub_scope"], "sub_scope_executing"),
         ActionRecord("on_sub_scope_done", ["sub_scope_executing"], "ready_to_run_sub_scope"),
 
-        ActionRecord("success", ["working", "ready_to_run_sub_scope"], "done",
+        ActionRecord("success", ["working", "ready_to_run_sub_scope", "sub_scope_executing"], "done",
                      propagate_auto_execution=True, reload_block_in_client=True),
         ActionRecord("error", ["*", "ready", "working", "sub_scope_executing",
                                "generating_folds", "ready_to_run_sub_scope"],
@@ -95,6 +98,12 @@ class UniformMetaBlock(GenericBlock):
     res_seq = BlockField(name="res_seq", provided_data_type="SequenceContainer",
                          field_type=FieldType.HIDDEN, init_val=None)
 
+    max_parallel_folds = ParamField(
+        name="max_parallel_folds", title="Folds to run at once", order_num=100,
+        input_type=InputType.TEXT, field_type=FieldType.INT, init_val=1,
+        required=False
+    )
+
     _results_container = OutputBlockField(
         name="results_container",
         provided_data_type="ResultsContainer",
@@ -117,6 +126,15 @@ class UniformMetaBlock(GenericBlock):
         self.set_out_var("results_container", None)
         self.res_seq = SequenceContainer()
 
+        # Concurrent mode bookkeeping
+        self.fold_scopes = []
+        self.folds_done = []
+        self.next_fold_idx = 0
+
+        # Fingerprint of the block state folds were generated from,
+        #  inner outputs of the same fold are equal while it's unchanged
+        self.folds_fingerprint = None
+
     @property
     def is_sub_pages_visible(self):
         if self.state in ['valid_params', 'done', 'ready']:
@@ -130,13 +148,228 @@ class UniformMetaBlock(GenericBlock):
     def get_inner_out_var(self, name):
         return self.inner_output_manager.get_var(name)
 
+    def get_fold_out_var(self, name, fold_idx):
+        return self.inner_output_manager.sequence[fold_idx][name]
+
+    def get_inner_output_fingerprint(self, scope_var):
+        folds_fingerprint = getattr(self, "folds_fingerprint", None)
+        if folds_fingerprint is None:
+            return None
+
+        if scope_var.fold_idx is not None:
+            fold_idx = scope_var.fold_idx
+        else:
+            fold_idx = self.inner_output_manager.iterator
+        return hashlib.sha1(pickle.dumps(
+            (folds_fingerprint, scope_var.var_name, fold_idx),
+            protocol=pickle.HIGHEST_PROTOCOL
+        )).hexdigest()
+
     def run_sub_scope(self, exp, *args, **kwargs):
+        if self.is_concurrent_mode(exp):
+            self.start_concurrent_folds(exp)
+            return
+
         self.reset_execution_for_sub_blocks()
 
         exp.store_block(self)
         sr = ScopeRunner(exp, self.sub_scope_name)
         sr.execute()
 
+    def is_concurrent_mode(self, exp):
+        """
+            Folds are executed concurrently in isolated scopes, when user allows
+             more then one fold at once and sub-scope doesn't contain meta blocks
+        """
+        if (getattr(self, "max_parallel_folds", None) or 1) <= 1:
+            return False
+        for _, block in exp.get_blocks(self.children_blocks):
+            if block.create_new_scope:
+                log.debug("Meta block %s contains nested meta block, folds run sequentially",
+                          self.base_name)
+                return False
+        return True
+
+    def get_fold_scope_name(self, fold_idx):
+        return "%s_fold%s" % (self.sub_scope_name, fold_idx)
+
+    def get_fold_idx_by_scope(self, scope_name):
+        return int(scope_name[len(self.sub_scope_name) + len("_fold"):])
+
+    def get_fold_block_uuid(self, block_uuid, fold_idx):
+        return "%s_f%s" % (block_uuid, fold_idx)
+
+    def start_concurrent_folds(self, exp):
+        self.remove_fold_blocks(exp)
+        self.folds_done = []
+        self.next_fold_idx = 0
+
+        folds_to_start = []
+        while self.next_fold_idx < len(self.inner_output_manager.sequence) and \
+                len(folds_to_start) < self.max_parallel_folds:
+            folds_to_start.append(self.next_fold_idx)
+            self.next_fold_idx += 1
+        self.fold_scopes = [self.get_fold_scope_name(fold_idx)
+                            for fold_idx in range(len(self.inner_output_manager.sequence))]
+        exp.store_block(self)
+
+        for fold_idx in folds_to_start:
+            self.start_fold(exp, fold_idx)
+
+    def start_fold(self, exp, fold_idx):
+        """
+            Creates isolated copies of sub-scope blocks for the fold and
+             schedules their execution
+        """
+        r = get_redis_instance()
+        fold_scope_name = self.get_fold_scope_name(fold_idx)
+        uuid_map = {
+            block_uuid: self.get_fold_block_uuid(block_uuid, fold_idx)
+            for block_uuid in self.children_blocks
+        }
+
+        pipe = r.pipeline()
+        pipe.hset(ExpKeys.get_scope_creating_block_uuid_keys(self.exp_id),
+                  fold_scope_name, self.uuid)
+        fold_blocks = []
+        for block_uuid, block in exp.get_blocks(self.children_blocks, r):
+            fold_block = pickle.loads(pickle.dumps(block, protocol=pickle.HIGHEST_PROTOCOL))
+            fold_block.uuid = uuid_map[block_uuid]
+            fold_block.scope_name = fold_scope_name
+            for input_name, scope_var in fold_block.bound_inputs.items():
+                if scope_var.block_uuid == self.uuid:
+                    fold_block.bound_inputs[input_name] = ScopeVar(
+                        self.uuid, scope_var.var_name, scope_var.data_type,
+                        scope_var.block_alias, fold_scope_name, fold_idx=fold_idx)
+                elif scope_var.block_uuid in uuid_map:
+                    fold_block.bound_inputs[input_name] = ScopeVar(
+                        uuid_map[scope_var.block_uuid], scope_var.var_name,
+                        scope_var.data_type, scope_var.block_alias, fold_scope_name)
+
+            pipe.sadd(ExpKeys.get_scope_blocks_key(self.exp_id, fold_scope_name),
+                      fold_block.uuid)
+            pipe.sadd(ExpKeys.get_all_exp_keys_key(self.exp_id),
+                      ExpKeys.get_block_key(fold_block.uuid))
+            fold_blocks.append(fold_block)
+        pipe.hincrby(ExpKeys.get_scope_dag_versions_key(self.exp_id), fold_scope_name, 1)
+        pipe.execute()
+        register_sub_key(self.exp_id, ExpKeys.get_scope_blocks_key(self.exp_id, fold_scope_name), r)
+
+        for fold_block in fold_blocks:
+            exp.store_block(fold_block, redis_instance=r)
+            try:
+                fold_block.do_action("reset_execution", exp)
+            except RuntimeError:
+                # block doesn't participate in execution
+                pass
+
+        log.debug("Starting fold %s of meta block %s", fold_idx, self.base_name)
+        auto_exec_task.s(exp.pk, fold_scope_name).apply_async()
+
+    def on_fold_scope_done(self, exp, scope_name):
+        """
+            @type exp: Experiment
+
+            Called by ScopeRunner when blocks of fold's isolated scope have
+             nothing more to execute. Block is re-read under the lock,
+             since folds finish concurrently.
+        """
+        fold_idx = self.get_fold_idx_by_scope(scope_name)
+        r = get_redis_instance()
+        with exclusive_lock(r, ExpKeys.get_block_global_lock_key(self.exp_id, self.uuid)):
+            block = exp.get_block(self.uuid, r)
+            if block.state != "sub_scope_executing" or fold_idx in block.folds_done:
+                return
+
+            fold_states = exp.get_block_states([
+                block.get_fold_block_uuid(block_uuid, fold_idx)
+                for block_uuid in block.children_blocks
+            ], r)
+            for fold_state in fold_states.values():
+                if fold_state.is_block_supports_auto_execution and \
+                        fold_state.get_exec_status() != "done":
+                    log.debug("Fold %s of %s still has unfinished blocks", fold_idx, block.base_name)
+                    return
+
+            # only blocks providing collected variables are unpickled
+            fold_blocks = exp.get_blocks(fold_states.keys(), r)
+
+            cell = block.res_seq.sequence[fold_idx]
+            for name, scope_var in block.collector_spec.bound.iteritems():
+                if scope_var.block_uuid == block.uuid:
+                    var = block.get_fold_out_var(scope_var.var_name, fold_idx)
+                else:
+                    fold_block = fold_blocks.get(
+                        block.get_fold_block_uuid(scope_var.block_uuid, fold_idx))
+                    if fold_block is None:
+                        raise RuntimeError(
+                            "Fold %s of %s has no copy of block %s, collected variable "
+                            "`%s` should be provided by a block of the sub-scope" %
+                            (fold_idx, block.base_name, scope_var.block_uuid, name))
+                    var = fold_block.get_out_var(scope_var.var_name)
+                log.debug("Collected %s from %s in fold %s", var, scope_var.title, fold_idx)
+                if var is not None:
+                    if hasattr(var, "clone"):
+                        cell[name] = var.clone("%s_%s" % (block.uuid, fold_idx))
+                    else:
+                        cell[name] = deepcopy(var)
+            block.res_seq.sequence[fold_idx] = cell
+            block.folds_done.append(fold_idx)
+
+            next_fold_idx = None
+            if block.next_fold_idx < len(block.inner_output_manager.sequence):
+                next_fold_idx = block.next_fold_idx
+                block.next_fold_idx += 1
+
+            is_finished = len(block.folds_done) == len(block.inner_output_manager.sequence)
+            exp.store_block(block, redis_instance=r)
+
+        if next_fold_idx is not None:
+            block.start_fold(exp, next_fold_idx)
+
+        if is_finished:
+            # All folds was processed without errors
+            block.remove_fold_blocks(exp)
+            block.build_result_collection(exp)
+            block.do_action("success", exp)
+
+    def remove_fold_blocks(self, exp):
+        """
+            Drops blocks of isolated fold scopes created in concurrent mode
+        """
+        fold_scopes = getattr(self, "fold_scopes", None)
+        if not fold_scopes:
+            return
+
+        r = get_redis_instance()
+        pipe = r.pipeline()
+        for scope_name in fold_scopes:
+            scope_blocks_key = ExpKeys.get_scope_blocks_key(self.exp_id, scope_name)
+            for fold_block_uuid in r.smembers(scope_blocks_key):
+                pipe.delete(ExpKeys.get_block_key(fold_block_uuid))
+                pipe.srem(ExpKeys.get_all_exp_keys_key(self.exp_id),
+                          ExpKeys.get_block_key(fold_block_uuid))
+                pipe.hdel(ExpKeys.get_block_deps_key(self.exp_id), fold_block_uuid)
+                pipe.hdel(ExpKeys.get_block_states_key(self.exp_id), fold_block_uuid)
+                pipe.hdel(ExpKeys.get_execution_fingerprints_key(self.exp_id), fold_block_uuid)
+                pipe.hdel(ExpKeys.get_execution_results_key(self.exp_id), fold_block_uuid)
+            scope_dag_key = ExpKeys.get_scope_dag_key(self.exp_id, scope_name)
+            pipe.delete(scope_blocks_key)
+            pipe.delete(scope_dag_key)
+            pipe.srem(ExpKeys.get_all_exp_keys_key(self.exp_id), scope_blocks_key, scope_dag_key)
+            pipe.hdel(ExpKeys.get_scope_creating_block_uuid_keys(self.exp_id), scope_name)
+            pipe.hincrby(ExpKeys.get_scope_dag_versions_key(self.exp_id), scope_name, 1)
+        pipe.execute()
+        self.fold_scopes = []
+
+    def reset_execution(self, exp, *args, **kwargs):
+        self.remove_fold_blocks(exp)
+        super(UniformMetaBlock, self).reset_execution(exp, *args, **kwargs)
+
+    def on_remove(self, exp, *args, **kwargs):
+        self.remove_fold_blocks(exp)
+        super(UniformMetaBlock, self).on_remove(exp, *args, **kwargs)
+
     def on_sub_scope_done(self, exp, *args, **kwargs):
         """
             @type exp: Experiment
@@ -145,7 +378,7 @@ class UniformMetaBlock(GenericBlock):
             when all blocks in sub-scope have exec status == done
         """
         r = get_redis_instance()
-        with redis_lock.Lock(r, ExpKeys.get_block_global_lock_key(self.exp_id, self.uuid)):
+        with exclusive_lock(r, ExpKeys.get_block_global_lock_key(self.exp_id, self.uuid)):
 
             cell = self.res_seq.sequence[self.inner_output_manager.iterator]
             for name, scope_var in self.collector_spec.bound.iteritems():
@@ -228,7 +461,7 @@ class UniformMetaBlock(GenericBlock):
                             " Instead got: %s" % data_type)
 
         rc.store()
-        rc.ar = None
+        rc.unload()
         self.set_out_var("results_container", rc)
 
         # self.do_action("success", exp)
@@ -239,6 +472,11 @@ class UniformMetaBlock(GenericBlock):
     def on_folds_generation_success(self, exp, sequence, *args, **kwargs):
         self.inner_output_manager.sequence = sequence
         self.inner_output_manager.next()
+        if self.use_execution_cache:
+            # folds are built deterministically from params and inputs
+            self.folds_fingerprint = self.compute_inputs_fingerprint(exp)
+        else:
+            self.folds_fingerprint = None
 
         self.res_seq.clean_content()
         self.res_seq.sequence = [{"__label__": label} for label in self.get_fold_labels()]
@@ -293,7 +531,7 @@ class UniformMetaBlock(GenericBlock):
 
         for new_inner_output in inner_outputs_list:
             self.inner_output_manager.register(new_inner_output)
-            self._block_serializer.register(new_inner_output)
+            self.register_instance_field(new_inner_output)
             scope.register_variable(ScopeVar(
                 self.uuid, new_inner_output.name, new_inner_output.provided_data_type))
 
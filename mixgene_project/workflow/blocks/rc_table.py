@@ -55,7 +55,6 @@ class RenderTable(RcVisualizer):
         rc = self.rc
         to = TableObj()
         if rc:
-            rc.load()
             header_axis = self.table_config.get("header_axis")
             index_axis_list = []
             for axis, flag in self.table_config.get("multi_index_axis_dict", {}).iteritems():
@@ -83,7 +83,7 @@ class UserUpload(GenericBlock):
 
     def update_user_classes_assignment(self, exp, request, *args, **kwargs):
         es = self.get_out_var("expression_set")
-        pheno_df = es.get_pheno_data_frame()
+        pheno_df = es.get_pheno_data_frame(copy=True)
 
         received = json.loads(request.body)
         es.pheno_metadata["user_class_title"] = received["user_class_title"]
@@ -292,7 +292,7 @@ class UserUploadComplex(GenericBlock):
         if es is None:
             raise Exception("No data was stored before")
 
-        pheno_df = es.get_pheno_data_frame()
+        pheno_df = es.get_pheno_data_frame(copy=True)
 
         received = json.loads(request.body)
 
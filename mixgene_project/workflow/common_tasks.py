@@ -1,19 +1,21 @@
 import logging
-import shutil
 import gzip
 
 import pandas as pd
 from pandas import Series, DataFrame
 from sklearn import cross_validation
-from Bio.Geo import parse as parse_geo
 
 
+from converters.geo_soft import GseSoftReader, PARSER_VERSION
+from environment.dataset_cache import GseDatasetCache
+from mixgene.single_flight import single_flight
 from mixgene.util import prepare_GEO_ftp_url, fetch_file_from_url
 
 from webapp.models import CachedFile
+from webapp.notification import BlockProgress
 from environment.units import GeneUnits
 from environment.structures import ExpressionSet, PlatformAnnotation, \
-    GS, FileInputVar
+    GS, FileInputVar, ExpressionSetView
 
 from itertools import repeat, chain
 
@@ -43,38 +45,91 @@ def fetch_geo_gse(exp, block, geo_uid, ignore_cache=False):
     fi.file_format = file_format
     fi.set_file_type("ncbi_geo")
 
-    mb_cached = CachedFile.look_up(url)
-    if mb_cached is None or ignore_cache:
+    def report_progress(done, total):
+        BlockProgress(exp.pk, block.uuid, done, total,
+                      comment=u"Downloading %s" % geo_uid).send()
+
+    def fetch():
         #FIME: grrrrrr...
         dir_path = exp.get_data_folder()
-        fetch_file_from_url(url, "%s/%s" % (dir_path, compressed_filename))
+        fetch_file_from_url(url, "%s/%s" % (dir_path, compressed_filename),
+                            on_progress=report_progress)
 
         CachedFile.update_cache(url, fi.filepath)
-    else:
-        shutil.copy(mb_cached.get_file_path(), fi.filepath)
-        log.debug("File for %s was copied file from cache", url)
+        return fi
+
+    def take_from_cache():
+        mb_cached = CachedFile.look_up(url)
+        if mb_cached is None:
+            return None
+        method = mb_cached.link_to(fi.filepath)
+        log.debug("File for %s was taken from cache by %s", url, method)
+        return fi
+
+    with CachedFile.pinned(url):
+        if ignore_cache or take_from_cache() is None:
+            # the same series could be requested by other experiments right now
+            single_flight("fetch-%s" % url, fetch, take_from_cache,
+                          reuse_result=not ignore_cache)
 
     return [fi], {}
 
 
-def preprocess_soft(exp, block, source_file):
+def preprocess_soft(exp, block, source_file, ignore_cache=False):
+    if not getattr(source_file, "geo_uid", None):
+        return list(parse_soft(exp, block, source_file)), {}
+
+    dataset_cache = GseDatasetCache(source_file.geo_uid, PARSER_VERSION)
+
+    def link_from_cache():
+        return dataset_cache.link(exp.get_data_folder(), block.uuid)
+
+    def parse():
+        expression_set, platform_annotation = parse_soft(exp, block, source_file)
+        try:
+            dataset_cache.store(expression_set, platform_annotation)
+        except Exception, e:
+            # cache is optional, experiment already has its data
+            log.exception("Failed to cache preprocessed %s: %s", source_file.geo_uid, e)
+        return expression_set, platform_annotation
+
+    cached = None if ignore_cache else link_from_cache()
+    if cached is not None:
+        return list(cached), {}
+
+    # other experiments could preprocess the same series right now
+    result = single_flight(
+        "preprocess-%s_v%s" % (dataset_cache.geo_uid, PARSER_VERSION),
+        parse, link_from_cache, reuse_result=not ignore_cache
+    )
+    return list(result), {}
+
+
+def parse_soft(exp, block, source_file):
+    """
+        @rtype: (ExpressionSet, PlatformAnnotation)
+    """
     #TODO: now we assume that we get GSE file
     try:
-        soft = list(parse_geo(gzip.open(source_file.filepath)))
-    except:
+        with gzip.open(source_file.filepath) as source:
+            soft = GseSoftReader().read(source)
+    except RuntimeError:
+        raise
+    except Exception:
         raise RuntimeError("Bad source file, can't read")
 
-    assert soft[2].entity_type == "PLATFORM"
-
-    pl = soft[2].table_rows
-    id_idx = pl[0].index('ID')
-    entrez_idx = pl[0].index('ENTREZ_GENE_ID')
+    if soft.platform is None:
+        raise RuntimeError("Platform description is absent in the source file")
+    if soft.unknown_probes_count:
+        log.warning("Skipped %s sample values of probes absent in platform %s",
+                    soft.unknown_probes_count, soft.platform.entity_id)
 
     #TODO bug here
     probe_to_genes_GS = GS()
-    for row in pl[1:]:
-        probe_to_genes_GS.description[row[id_idx]] = ""
-        probe_to_genes_GS.genes[row[id_idx]] = row[entrez_idx].split(" /// ")
+    for probe, entrez in zip(soft.platform.probes,
+                             soft.platform.get_column("ENTREZ_GENE_ID")):
+        probe_to_genes_GS.description[probe] = ""
+        probe_to_genes_GS.genes[probe] = entrez.split(" /// ")
 
     platform_annotation = PlatformAnnotation(
         "TODO:GET NAME FROM SOFT",
@@ -86,21 +141,10 @@ def preprocess_soft(exp, block, source_file):
     platform_annotation.gene_sets.metadata["set_units"] = GeneUnits.PROBE_ID
     platform_annotation.gene_sets.store_gs(probe_to_genes_GS)
 
-    id_ref_idx = soft[3].table_rows[0].index("ID_REF")
-    value_idx = soft[3].table_rows[0].index("VALUE")
-    assay_df = DataFrame(dict([
-        (
-            soft[i].entity_attributes['Sample_geo_accession'],
-            Series(dict([(row[id_ref_idx], row[value_idx]) for row in soft[i].table_rows[1:]]))
-        )
-        for i in range(3, len(soft))
-    ]))
-
     expression_set = ExpressionSet(exp.get_data_folder(), "%s_es" % block.uuid)
-    expression_set.store_assay_data_frame(assay_df)
+    expression_set.store_assay_data_frame(soft.get_assay_data_frame())
 
-    raw_factors = [soft[i].entity_attributes
-               for i in range(3, len(soft))]
+    raw_factors = soft.sample_attributes
     pheno_index = []
 
     # Here we trying to guess sub columns
@@ -152,7 +196,7 @@ def preprocess_soft(exp, block, source_file):
     pheno_df.index.name = 'Sample_geo_accession'
     expression_set.store_pheno_data_frame(pheno_df)
 
-    return [expression_set, platform_annotation], {}
+    return expression_set, platform_annotation
 
 
 def generate_cv_folds(
@@ -193,20 +237,17 @@ def generate_cv_folds(
         for input_name, output_names in inner_output_es_names_map.iteritems():
             es_train_name, es_test_name = output_names
             es = es_dict[input_name]
-            assay_df = es.get_assay_data_frame()
-
-            # Reorder columns to be compatible to phenotype
-            assay_df = assay_df[pheno_df.index]
-            # Removing unused samples
-            assay_df = assay_df[assay_df.columns[mask]]
-
-            train_es = es.clone("%s_%s_train_%s" % (es_0.base_filename, input_name, i))
-            train_es.store_assay_data_frame(assay_df[train_idx])
-            train_es.store_pheno_data_frame(masked_pheno_df.iloc[train_idx])
 
-            test_es = es.clone("%s_%s_test_%s" % (es_0.base_filename, input_name, i))
-            test_es.store_assay_data_frame(assay_df[test_idx])
-            test_es.store_pheno_data_frame(masked_pheno_df.iloc[test_idx])
+            # Folds only reference samples of the source set, assay is
+            #  compatible to phenotype and unused samples are skipped
+            train_es = ExpressionSetView(
+                es, "%s_%s_train_%s" % (es_0.base_filename, input_name, i),
+                masked_pheno_df.index[train_idx], pheno_source=es_0
+            )
+            test_es = ExpressionSetView(
+                es, "%s_%s_test_%s" % (es_0.base_filename, input_name, i),
+                masked_pheno_df.index[test_idx], pheno_source=es_0
+            )
 
             cell[es_train_name] = train_es
             cell[es_test_name] = test_es
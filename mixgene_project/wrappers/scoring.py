@@ -1,19 +1,179 @@
+from distutils.version import LooseVersion
+
+import sklearn
 from sklearn.metrics import accuracy_score, \
     average_precision_score, confusion_matrix, roc_auc_score, \
     f1_score, recall_score, matthews_corrcoef, hamming_loss, jaccard_similarity_score
 
+import numpy as np
+
 import logging
 log = logging.getLogger(__name__)
 
 
+class PackedLabels(object):
+    def __init__(self, y_true, y_predicted, offsets):
+        """
+            Prediction vectors of many cells concatenated into flat arrays.
+            Cell `i` occupies positions [offsets[i], offsets[i + 1]).
+
+            @type  y_true: np.ndarray
+            @type  y_predicted: np.ndarray
+            @type  offsets: np.ndarray
+            @param offsets: Array of length cells_num + 1
+        """
+        self.y_true = np.asarray(y_true)
+        self.y_predicted = np.asarray(y_predicted)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.cells_num = len(self.offsets) - 1
+        self.lengths = np.diff(self.offsets)
+
+        if len(self.y_true) != len(self.y_predicted):
+            raise ValueError("Length of y_true and y_predicted vectors differs")
+
+        classes = np.union1d(self.y_true, self.y_predicted)
+        # Binary metrics are computed for class `1` as the positive one
+        self.is_binary = classes.dtype.kind in "biuf" and \
+            set(classes.tolist()) <= {0, 1}
+        if self.is_binary:
+            self.classes_num = 2
+            self.true_codes = self.y_true.astype(np.int64)
+            self.predicted_codes = self.y_predicted.astype(np.int64)
+        else:
+            self.classes_num = len(classes)
+            self.true_codes = np.searchsorted(classes, self.y_true)
+            self.predicted_codes = np.searchsorted(classes, self.y_predicted)
+
+        self._confusion = None
+
+    @classmethod
+    def from_pairs(cls, pairs):
+        """
+            @type  pairs: list
+            @param pairs: [(y_true, y_predicted) or None for missing cell]
+        """
+        lengths = np.array([
+            len(pair[0]) if pair is not None else 0
+            for pair in pairs
+        ], dtype=np.int64)
+        offsets = np.zeros(len(pairs) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+
+        present = [pair for pair in pairs if pair is not None and len(pair[0])]
+        if present:
+            y_true = np.concatenate([np.asarray(pair[0]) for pair in present])
+            y_predicted = np.concatenate([np.asarray(pair[1]) for pair in present])
+        else:
+            y_true = np.array([], dtype=np.int64)
+            y_predicted = np.array([], dtype=np.int64)
+
+        return cls(y_true, y_predicted, offsets)
+
+    def cell(self, idx):
+        start, end = self.offsets[idx], self.offsets[idx + 1]
+        return self.y_true[start:end], self.y_predicted[start:end]
+
+    def confusion(self):
+        """
+            Confusion counts for all cells in a single `np.bincount` pass
+
+            @rtype: np.ndarray
+            @return: Array of shape (cells_num, classes_num, classes_num),
+                [cell, true class, predicted class] -> count
+        """
+        if self._confusion is None:
+            k = self.classes_num
+            cell_idx = np.repeat(np.arange(self.cells_num), self.lengths)
+            flat = (cell_idx * k + self.true_codes) * k + self.predicted_codes
+            self._confusion = np.bincount(
+                flat, minlength=self.cells_num * k * k
+            ).reshape((self.cells_num, k, k)).astype(np.float64)
+        return self._confusion
+
+
+# Functions computing metric from confusion counts of all cells.
+#   Returns (values, valid mask), cells with ill-defined value are
+#   marked invalid and scored by original sklearn function
+def accuracy_from_confusion(cm):
+    total = cm.sum(axis=(1, 2))
+    correct = cm.diagonal(axis1=1, axis2=2).sum(axis=1)
+    return correct / total, total > 0
+
+
+def hamming_loss_from_confusion(cm):
+    accuracy, valid = accuracy_from_confusion(cm)
+    return 1.0 - accuracy, valid
+
+
+def _binary_counts(cm):
+    """
+        @return: tp, fp, fn, tn
+    """
+    return cm[:, 1, 1], cm[:, 0, 1], cm[:, 1, 0], cm[:, 0, 0]
+
+
+def recall_from_confusion(cm):
+    tp, fp, fn, tn = _binary_counts(cm)
+    return tp / (tp + fn), (tp + fn) > 0
+
+
+def f1_from_confusion(cm):
+    tp, fp, fn, tn = _binary_counts(cm)
+    denominator = 2 * tp + fp + fn
+    return 2 * tp / denominator, denominator > 0
+
+
+def mcc_from_confusion(cm):
+    tp, fp, fn, tn = _binary_counts(cm)
+    denominator = (tp + fp) * (tp + fn) * (tn + fp) * (tn + fn)
+    return (tp * tn - fp * fn) / np.sqrt(denominator), denominator > 0
+
+
+def auc_from_confusion(cm):
+    # ROC curve for crisp predictions has a single inner point (FPR, TPR)
+    tp, fp, fn, tn = _binary_counts(cm)
+    positive = tp + fn
+    negative = fp + tn
+    tpr = tp / positive
+    fpr = fp / negative
+    return (1.0 + tpr - fpr) / 2.0, (positive > 0) & (negative > 0)
+
+
+# sklearn before 0.19 integrates precision-recall curve by trapezoids,
+#   later versions sum precision weighted by recall increments
+AP_TRAPEZOIDAL = LooseVersion(sklearn.__version__) < LooseVersion("0.19")
+
+
+def average_precision_from_confusion(cm):
+    # For crisp predictions precision-recall curve has a single inner
+    #   point (recall, precision), ends are (0, 1) and (1, positive rate)
+    tp, fp, fn, tn = _binary_counts(cm)
+    positive = tp + fn
+    predicted = tp + fp
+    precision = tp / predicted
+    recall = tp / positive
+    base_rate = positive / (positive + fp + tn)
+    if AP_TRAPEZOIDAL:
+        values = recall * (1.0 + precision) / 2.0 + \
+            (1.0 - recall) * (precision + base_rate) / 2.0
+    else:
+        values = precision * recall + (1.0 - recall) * base_rate
+    return values, (positive > 0) & (predicted > 0)
+
+
 class MetricInfo(object):
     def __init__(self, name, func, title,
                  produce_single_number=True, require_binary=True,
-                 to_dict=None,
+                 to_dict=None, confusion_func=None,
                  **kwargs):
+        """
+            @param confusion_func: Function computing metric for many cells at once
+                from confusion counts, see `accuracy_from_confusion`
+        """
         self.name = name
         self.title = title
         self.func = func
+        self.confusion_func = confusion_func
         self.require_binary = require_binary
         self.produce_single_number = produce_single_number
         self.options = kwargs
@@ -32,26 +192,35 @@ class MetricInfo(object):
 
 metrics = [
     MetricInfo("average_precision", average_precision_score,
-               title="AP (average precision)", require_binary=True),
+               title="AP (average precision)", require_binary=True,
+               confusion_func=average_precision_from_confusion),
     MetricInfo("AUC", roc_auc_score,
-               title="AUC (Area Under the Curve)", require_binary=True),
+               title="AUC (Area Under the Curve)", require_binary=True,
+               confusion_func=auc_from_confusion),
     MetricInfo("MCC", matthews_corrcoef,
-               title="MCC (Matthews correlation coefficient)", require_binary=True),
+               title="MCC (Matthews correlation coefficient)", require_binary=True,
+               confusion_func=mcc_from_confusion),
 
     # For the following metrics in multiclass case we need to select additional parameters
     # to obtain singular value, so we would limit them only to binary case
     MetricInfo("f1", f1_score,
-               title="F1 score", require_binary=True),
+               title="F1 score", require_binary=True,
+               confusion_func=f1_from_confusion),
     MetricInfo("recall_score", recall_score,
-               title="Recall", require_binary=True),
+               title="Recall", require_binary=True,
+               confusion_func=recall_from_confusion),
 
     ### Metrics, which supports multiclass classification
     MetricInfo("accuracy", accuracy_score,
-               title="Accuracy", require_binary=False),
+               title="Accuracy", require_binary=False,
+               confusion_func=accuracy_from_confusion),
     MetricInfo("hamming_loss", hamming_loss,
-               title="Average Hamming loss", require_binary=False),
+               title="Average Hamming loss", require_binary=False,
+               confusion_func=hamming_loss_from_confusion),
+    # For single label vectors Jaccard similarity equals to accuracy
     MetricInfo("jaccard_similarity", jaccard_similarity_score,
-               title="Jaccard similarity coefficient", require_binary=False),
+               title="Jaccard similarity coefficient", require_binary=False,
+               confusion_func=accuracy_from_confusion),
 
     ### Metrics with non-single value results
     MetricInfo("confusion_matrix", confusion_matrix,
@@ -72,14 +241,67 @@ def compute_score_by_metric_name(y_true, y_predicted, metric_name):
     return metrics_dict[metric_name].apply(y_true, y_predicted)
 
 
+def compute_packed_scores(packed, metric, propagate_error=False):
+    """
+        Computes single number metric for every cell of packed labels.
+        Cells are scored from confusion counts when metric supports it,
+        remaining ones (e.g. ill-defined cases) by sklearn function
+        on slices of packed arrays.
+
+        @type packed: PackedLabels
+        @type metric: MetricInfo
+
+        @rtype: np.ndarray
+        @return: Scores, NaN for cells we failed to score
+    """
+    result = np.empty(packed.cells_num, dtype=np.float64)
+    result.fill(np.nan)
+    need_fallback = packed.lengths > 0
+
+    if metric.confusion_func is not None and \
+            (packed.is_binary or not metric.require_binary):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            values, valid = metric.confusion_func(packed.confusion())
+        result[valid] = values[valid]
+        need_fallback &= ~valid
+
+    for idx in np.flatnonzero(need_fallback):
+        y_true, y_predicted = packed.cell(idx)
+        try:
+            value = metric.func(y_true, y_predicted, **metric.options)
+            result[idx] = float(value)
+        except Exception, e:
+            if propagate_error:
+                raise e
+            log.debug("Failed to compute metric %s for cell %s: %s", metric.name, idx, e)
+
+    return result
+
+
+def compute_scores_by_metric_name(pairs, metric_name, propagate_error=False):
+    """
+        @type  pairs: list
+        @param pairs: [(y_true, y_predicted) or None for missing cell]
+
+        @rtype: np.ndarray
+    """
+    return compute_packed_scores(
+        PackedLabels.from_pairs(pairs), metrics_dict[metric_name], propagate_error)
+
+
 def compute_scores(y_true, y_predicted, metrics_subset=None, is_classes_binary=True):
     result = {}
+    packed = PackedLabels.from_pairs([(y_true, y_predicted)])
     for metric in metrics:
         if metrics_subset is not None and metric.name in metrics_subset:
             continue
 
         if not metric.require_binary or is_classes_binary:
-            result[metric.name] = metric.apply(y_true, y_predicted)
+            if metric.produce_single_number:
+                value = compute_packed_scores(packed, metric)[0]
+                result[metric.name] = None if np.isnan(value) else value
+            else:
+                result[metric.name] = metric.apply(y_true, y_predicted)
 
     return result
 
@@ -48,11 +48,11 @@ def apply_classifier(
     target_class_column = train_es.pheno_metadata["user_class_title"]
 
 
-    # Unpack data
-    x_train = train_es.get_assay_data_frame().as_matrix().transpose()
+    # Unpack data, assay arrays are read-only views shared between workers
+    x_train = train_es.get_assay_array(mmap=True).transpose()
     y_train = train_es.get_pheno_data_frame()[target_class_column].as_matrix()
 
-    x_test = test_es.get_assay_data_frame().as_matrix().transpose()
+    x_test = test_es.get_assay_array(mmap=True).transpose()
     y_test = test_es.get_pheno_data_frame()[target_class_column].as_matrix()
 
     # Unfortunately svm can't operate with string labels as a target classes
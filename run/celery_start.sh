@@ -1,5 +1,7 @@
 #!/bin/bash
+# Usage: celery_start.sh <pool> [extra celery worker options]
+#   pools are declared in CELERY_WORKER_POOLS, see mixgene/celerysettings.py
 
 . /usr/local/bin/virtualenvwrapper.sh
 workon mixgene_venv
-CELERY_RDBSIG=1 celery worker --app=mixgene.celery --loglevel=DEBUG
+CELERY_RDBSIG=1 exec python -m mixgene.workers "$@"
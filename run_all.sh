@@ -11,7 +11,8 @@ SESSION=$USER
 # system
 
 ### celery
-#python mixgene_project/manage.py celery worker --loglevel=DEBUG &
+# one worker per pool: control, io, cpu, r (see mixgene/celerysettings.py)
+#(cd mixgene_project && python -m mixgene.workers control) &
 
 ### gunicorn
 #gunicorn -b 127.0.0.1:9431 mixgene.wsgi:application &
@@ -33,11 +34,20 @@ tmux select-pane -t 1
 tmux send-keys "cd notify_server/ && node server.js" C-m
 tmux resize-pane -R 20
 tmux select-pane -t 2
-tmux send-keys "cd mixgene_project/ && celery worker --app=mixgene.celery --loglevel=INFO" C-m
+tmux send-keys "cd mixgene_project/ && python -m mixgene.workers control" C-m
 tmux split-window -v
 tmux select-pane -t 3
 #tmux send-keys "python mixgene_project/manage.py celery flower --port=5555" C-m
 
+# Workers for computation queues
+tmux new-window -t $SESSION:2 -n 'Celery-pools'
+tmux send-keys "cd mixgene_project/ && python -m mixgene.workers cpu" C-m
+tmux split-window -v
+tmux send-keys "cd mixgene_project/ && python -m mixgene.workers r" C-m
+tmux split-window -h
+tmux send-keys "cd mixgene_project/ && python -m mixgene.workers io" C-m
+tmux select-window -t $SESSION:1
+
 tmux select-pane -t 0
 
 # Set default window
@@ -1,4 +1,4 @@
-Constructor.factory("blockAccess", function($http, $log){
+Constructor.factory("blockAccess", function($http, $log, $rootScope){
     var access = {}
 
     access.blocks_uuids = [];
@@ -39,6 +39,15 @@ Constructor.factory("blockAccess", function($http, $log){
                 access.reload_block(block_);
             }
 
+            if( msg.type === "block_progress"){
+                var block_ = access.block_bodies[msg.block_uuid];
+                if( block_ ){
+                    $rootScope.$apply(function(){
+                        block_.progress = msg;
+                    });
+                }
+            }
+
             if( msg.type === "updated_all"){
                 access.fetch_blocks();
                 // TODO: reload scope variables when added